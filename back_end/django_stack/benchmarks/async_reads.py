@@ -0,0 +1,103 @@
+# benchmarks/async_reads.py
+"""
+Compare read-endpoint throughput and tail latency between deployments.
+
+Run the same project twice against the same Postgres database, e.g.
+
+    uvicorn mysite.asgi:application --port 8001 --workers 4
+    gunicorn mysite.wsgi --bind 127.0.0.1:8002 --workers 4 --threads 8
+
+then:
+
+    python -m benchmarks.async_reads --target asgi=http://127.0.0.1:8001 \\
+        --target wsgi=http://127.0.0.1:8002 --concurrency 256
+
+Request throttling (REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']) applies to the
+benchmark client like any other; raise the rates on the servers under test
+or 429s will dominate the results.
+"""
+
+import argparse
+import asyncio
+import json
+
+from .loadgen import Target, request, run_workers, summarize
+
+SAMPLE_CALCULATION = {
+    'calculation_name': 'Benchmark scenario',
+    'origin_state_id': 1,
+    'current_rent': '1500.00',
+    'current_utilities': '180.00',
+    'current_groceries': '450.00',
+    'current_transportation': '300.00',
+    'current_healthcare': '200.00',
+    'current_entertainment': '150.00',
+    'gross_annual_income': '65000.00',
+}
+
+
+async def obtain_token(target, username, password):
+    await request(target, 'POST', '/api/calculations/auth/register/', body={
+        'username': username,
+        'email': f'{username}@example.com',
+        'password': password,
+        'password_confirm': password,
+    })
+    status, _, body = await request(target, 'POST', '/api/calculations/auth/login/', body={
+        'username': username, 'password': password,
+    })
+    if status != 200:
+        raise SystemExit(f'Login failed with HTTP {status}: {body[:200]!r}')
+    return json.loads(body)['token']
+
+
+async def seed_calculations(target, headers, count):
+    for _ in range(count):
+        _, _, body = await request(target, 'POST', '/api/calculations/', headers=headers, body=SAMPLE_CALCULATION)
+    return json.loads(body).get('id')
+
+
+async def main(args):
+    targets = dict(spec.split('=', 1) for spec in args.target)
+    first = Target(next(iter(targets.values())))
+    token = await obtain_token(first, args.username, args.password)
+    headers = {'Authorization': f'Token {token}'}
+    calculation_id = await seed_calculations(first, headers, args.seed)
+
+    paths = [
+        '/api/states/',
+        '/api/states/compare/?origin=1',
+        '/api/calculations/',
+        f'/api/calculations/{calculation_id}/',
+        '/api/calculations/dashboard/',
+    ]
+
+    results = {}
+    for name, url in targets.items():
+        target = Target(url)
+        results[name] = {}
+        for path in paths:
+            latencies, statuses = await run_workers(
+                args.concurrency, args.duration,
+                lambda path=path: request(target, 'GET', path, headers=headers),
+            )
+            summary = summarize(latencies, statuses)
+            summary['throughput_rps'] = round(len(latencies) / args.duration, 1)
+            results[name][path] = summary
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--target', action='append', required=True,
+                        help='name=base_url, repeat for each deployment')
+    parser.add_argument('--username', default='loadtest')
+    parser.add_argument('--password', default='loadtest-password')
+    parser.add_argument('--seed', type=int, default=20, help='calculations to create for the test user')
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--concurrency', type=int, default=128)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    print(json.dumps(asyncio.run(main(parse_args())), indent=2))
@@ -0,0 +1,189 @@
+# benchmarks/cases.py
+"""Micro and endpoint benchmark cases; import only after django.setup()"""
+
+import copy
+import io
+import statistics
+import time
+
+from django.db import connection
+from django.db.models import Max
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from calculations import serializers as calculation_serializers
+from calculations.models import CalculationNote, CostCalculation, UserProfile
+from mysite.parsers import ORJSONParser
+from mysite.renderers import ORJSONRenderer
+from state_data import serializers as state_serializers
+from state_data.models import StateData, VeteranBenefit
+
+from .loadgen import percentile
+
+SAMPLE_CALCULATION = {
+    'calculation_name': 'Benchmark scenario',
+    'current_rent': '1500.00',
+    'current_utilities': '180.00',
+    'current_groceries': '450.00',
+    'current_transportation': '300.00',
+    'current_healthcare': '200.00',
+    'current_entertainment': '150.00',
+    'gross_annual_income': '65000.00',
+}
+
+
+def summarize_samples(samples, unit, queries=None):
+    """Per-operation timings (seconds) summarized in ``unit`` ('us' or 'ms')"""
+    scale = {'us': 1e6, 'ms': 1e3}[unit]
+    values = [sample * scale for sample in samples]
+    result = {
+        'unit': unit,
+        'samples': len(values),
+        'median': round(statistics.median(values), 3),
+        'mean': round(statistics.fmean(values), 3),
+        'p95': round(percentile(values, 95), 3),
+        'min': round(min(values), 3),
+    }
+    if queries is not None:
+        result['queries'] = queries
+    return result
+
+
+def time_batches(func, batches, inner):
+    """Seconds per call of ``func``, measured over ``batches`` runs of ``inner`` calls"""
+    func()
+    samples = []
+    for _ in range(batches):
+        start = time.perf_counter()
+        for _ in range(inner):
+            func()
+        samples.append((time.perf_counter() - start) / inner)
+    return samples
+
+
+def time_each(func, iterations, warmup=5):
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+# Micro-benchmarks
+
+def micro_cases(dataset):
+    """name -> zero-argument callable; all database reads happen here, not in the callables"""
+    calculations = list(
+        CostCalculation.objects.filter(user=dataset.user)
+        .select_related('user', 'origin_state', 'destination_state')
+        .prefetch_related('notes')[:50]
+    )
+    calculation = calculations[0]
+    engine_input = copy.copy(calculation)
+    profile = UserProfile.objects.select_related('user', 'current_state').get(user=dataset.user)
+    states = list(StateData.objects.order_by('state_name'))
+    benefits = list(VeteranBenefit.objects.select_related('state'))
+    notes = list(CalculationNote.objects.filter(calculation__user=dataset.user)[:20])
+    create_payload = {**SAMPLE_CALCULATION, 'origin_state_id': dataset.origin.pk}
+    registration_payload = {
+        'username': 'bench-new-user',
+        'email': 'bench-new-user@example.com',
+        'password': 'bench-password',
+        'password_confirm': 'bench-password',
+    }
+
+    def validate(serializer_class, data):
+        return lambda: serializer_class(data=data).is_valid(raise_exception=True)
+
+    # JSON encoding and decoding alone, on already serialized list and detail payloads
+    list_payload = {
+        'count': len(calculations), 'next': None, 'previous': None,
+        'results': calculation_serializers.CostCalculationSerializer(calculations, many=True).data,
+    }
+    detail_payload = calculation_serializers.CostCalculationSerializer(calculation).data
+    json_cases = {}
+    for label, renderer_class, parser_class in [
+        ('stdlib', JSONRenderer, JSONParser), ('orjson', ORJSONRenderer, ORJSONParser),
+    ]:
+        for kind, payload in [('list', list_payload), ('detail', detail_payload)]:
+            body = renderer_class().render(payload)
+            json_cases[f'json.render.{label}.{kind}'] = lambda r=renderer_class, p=payload: r().render(p)
+            json_cases[f'json.parse.{label}.{kind}'] = (
+                lambda p=parser_class, b=body: p().parse(io.BytesIO(b), parser_context={})
+            )
+
+    return {
+        'engine.calculate_maine_estimates': engine_input.calculate_maine_estimates,
+        'engine.total_current_monthly_expenses': lambda: calculation.total_current_monthly_expenses,
+        'serializer.CostCalculationSerializer': lambda: calculation_serializers.CostCalculationSerializer(calculation).data,
+        'serializer.CostCalculationSerializer.page': lambda: calculation_serializers.CostCalculationSerializer(calculations, many=True).data,
+        'serializer.CostCalculationSerializer.validate': validate(calculation_serializers.CostCalculationSerializer, create_payload),
+        'serializer.CostCalculationSummarySerializer.page': lambda: calculation_serializers.CostCalculationSummarySerializer(calculations, many=True).data,
+        'serializer.CalculationNoteSerializer.many': lambda: calculation_serializers.CalculationNoteSerializer(notes, many=True).data,
+        'serializer.UserSerializer': lambda: calculation_serializers.UserSerializer(dataset.user).data,
+        'serializer.UserRegistrationSerializer.validate': validate(calculation_serializers.UserRegistrationSerializer, registration_payload),
+        'serializer.UserProfileSerializer': lambda: calculation_serializers.UserProfileSerializer(profile).data,
+        'serializer.calculations.StateDataSerializer.all': lambda: calculation_serializers.StateDataSerializer(states, many=True).data,
+        'serializer.calculations.VeteranBenefitSerializer.all': lambda: calculation_serializers.VeteranBenefitSerializer(benefits, many=True).data,
+        'serializer.state_data.StateDataSerializer.all': lambda: state_serializers.StateDataSerializer(states, many=True).data,
+        'serializer.state_data.VeteranBenefitSerializer.all': lambda: state_serializers.VeteranBenefitSerializer(benefits, many=True).data,
+        **json_cases,
+    }
+
+
+def run_micro(dataset, batches=20, inner=50):
+    results = {}
+    for name, func in micro_cases(dataset).items():
+        results[name] = summarize_samples(time_batches(func, batches, inner), 'us')
+    return results
+
+
+# Endpoint benchmarks
+
+def endpoint_cases(dataset):
+    """name -> (method, path, body, expected status)"""
+    calculation = dataset.calculation
+    compare = f'origin={dataset.origin.pk}&destination={dataset.destination.pk}'
+    return {
+        'endpoint.calculation_list': ('get', '/api/calculations/', None, 200),
+        'endpoint.calculation_list.favorites': ('get', '/api/calculations/?is_favorite=true', None, 200),
+        'endpoint.calculation_detail': ('get', f'/api/calculations/{calculation.pk}/', None, 200),
+        'endpoint.dashboard': ('get', '/api/calculations/dashboard/', None, 200),
+        'endpoint.compare_states': ('get', f'/api/calculations/compare-states/?{compare}', None, 200),
+        'endpoint.states_compare': ('get', f'/api/states/compare/?{compare}', None, 200),
+        'endpoint.state_list': ('get', '/api/states/', None, 200),
+        'endpoint.calculation_create': (
+            'post', '/api/calculations/', {**SAMPLE_CALCULATION, 'origin_state_id': dataset.origin.pk}, 201,
+        ),
+    }
+
+
+def run_endpoints(dataset, iterations=100):
+    client = Client(HTTP_AUTHORIZATION=f'Token {dataset.token.key}')
+    results = {}
+    for name, (method, path, body, expected) in endpoint_cases(dataset).items():
+        last_pk = CostCalculation.objects.aggregate(last=Max('pk'))['last']
+
+        def call():
+            if body is None:
+                response = getattr(client, method)(path)
+            else:
+                response = getattr(client, method)(path, body, content_type='application/json')
+            if response.status_code != expected:
+                raise RuntimeError(f'{name}: expected HTTP {expected}, got {response.status_code}')
+
+        with CaptureQueriesContext(connection) as captured:
+            call()
+        # Count now: every request start clears the connection's query log
+        queries = len(captured)
+        samples = time_each(call, iterations)
+        results[name] = summarize_samples(samples, 'ms', queries=queries)
+
+        # Keep the dataset unchanged so --keepdb runs stay comparable
+        CostCalculation.objects.filter(pk__gt=last_pk).delete()
+    return results
@@ -0,0 +1,78 @@
+# benchmarks/compare.py
+"""
+Compare a benchmark run against a baseline and flag regressions.
+
+    python -m benchmarks.compare benchmarks/baselines/1k.json results/1k.json --threshold 10
+
+A case regresses when its median is more than ``--threshold`` percent slower
+than the baseline, or when it runs more SQL queries. Exits with status 1 if
+anything regressed, so it can gate CI.
+"""
+
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path) as handle:
+        return json.load(handle)
+
+
+def compare(baseline, current, threshold, metric='median'):
+    """Rows of (case, baseline, current, change %, status) for every case in either run"""
+    rows = []
+    base_results, current_results = baseline['results'], current['results']
+    for name in sorted(base_results.keys() | current_results.keys()):
+        before, after = base_results.get(name), current_results.get(name)
+        if before is None or after is None:
+            rows.append((name, before and before[metric], after and after[metric], None,
+                         'new' if before is None else 'missing'))
+            continue
+
+        change = (after[metric] - before[metric]) / before[metric] * 100 if before[metric] else 0.0
+        status = 'ok'
+        if change > threshold:
+            status = 'REGRESSION'
+        elif change < -threshold:
+            status = 'improved'
+        if after.get('queries', 0) > before.get('queries', 0):
+            status = 'REGRESSION (queries %d -> %d)' % (before['queries'], after['queries'])
+        rows.append((name, before[metric], after[metric], change, status))
+    return rows
+
+
+def format_rows(rows, unit_of):
+    lines = [f"{'case':<55} {'baseline':>12} {'current':>12} {'change':>9}  status"]
+    for name, before, after, change, status in rows:
+        unit = unit_of(name)
+        lines.append('{:<55} {:>12} {:>12} {:>9}  {}'.format(
+            name,
+            f'{before:.2f}{unit}' if before is not None else '-',
+            f'{after:.2f}{unit}' if after is not None else '-',
+            f'{change:+.1f}%' if change is not None else '-',
+            status,
+        ))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=10.0, help='allowed slowdown in percent')
+    parser.add_argument('--metric', choices=['median', 'mean', 'p95', 'min'], default='median')
+    args = parser.parse_args(argv)
+
+    baseline, current = load(args.baseline), load(args.current)
+    if baseline['meta'].get('size') != current['meta'].get('size'):
+        sys.stderr.write('warning: comparing runs of different dataset sizes\n')
+
+    rows = compare(baseline, current, args.threshold, args.metric)
+    units = {name: result['unit'] for name, result in {**baseline['results'], **current['results']}.items()}
+    print(format_rows(rows, units.get))
+    return 1 if any(row[4].startswith('REGRESSION') for row in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+# benchmarks/datasets.py
+"""Deterministic benchmark datasets; import only after django.setup()"""
+
+import io
+import random
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from rest_framework.authtoken.models import Token
+
+from calculations.models import CalculationNote, CostCalculation
+from state_data.models import StateData
+
+SIZES = {
+    '1k': 1_000,
+    '100k': 100_000,
+    '1m': 1_000_000,
+}
+
+BENCH_USERNAME = 'bench-user'
+BENCH_PASSWORD = 'bench-password'
+
+
+class Dataset:
+    """What the benchmark cases need to know about the seeded data"""
+
+    def __init__(self, user, token, calculation, origin, destination):
+        self.user = user
+        self.token = token
+        self.calculation = calculation
+        self.origin = origin
+        self.destination = destination
+
+
+def random_calculation(rng, user, origin, destination, index):
+    calculation = CostCalculation(
+        user=user,
+        calculation_name=f'Scenario {index}',
+        origin_state=origin,
+        destination_state=destination,
+        current_rent=Decimal(rng.randrange(60000, 350000)) / 100,
+        current_utilities=Decimal(rng.randrange(8000, 40000)) / 100,
+        current_groceries=Decimal(rng.randrange(20000, 120000)) / 100,
+        current_transportation=Decimal(rng.randrange(10000, 80000)) / 100,
+        current_healthcare=Decimal(rng.randrange(0, 60000)) / 100,
+        current_entertainment=Decimal(rng.randrange(0, 50000)) / 100,
+        gross_annual_income=Decimal(rng.randrange(2500000, 15000000)) / 100,
+        is_favorite=rng.random() < 0.1,
+    )
+    calculation.calculate_maine_estimates()
+    return calculation
+
+
+def seed(total, random_seed=1234, batch_size=5000):
+    """Create ``total`` calculations: 1% for the benchmark user, the rest spread over other users"""
+    call_command('populate_states', stdout=io.StringIO())
+    own = max(10, total // 100)
+    call_command(
+        'generate_synthetic_data', users=max(1, (total - own) // 20), calculations=total - own,
+        seed=random_seed, prefix='bench-synthetic', stdout=io.StringIO(),
+    )
+
+    rng = random.Random(random_seed)
+    states = list(StateData.objects.order_by('state_code'))
+    maine = next(state for state in states if state.state_code == 'ME')
+    bench_user = User.objects.create_user(BENCH_USERNAME, password=BENCH_PASSWORD)
+    CostCalculation.objects.bulk_create(
+        (random_calculation(rng, bench_user, rng.choice(states), maine, index) for index in range(own)),
+        batch_size=batch_size,
+    )
+    CalculationNote.objects.bulk_create(
+        CalculationNote(calculation_id=pk, note=f'Benchmark note {pk}')
+        for pk in CostCalculation.objects.filter(user=bench_user).values_list('pk', flat=True)[::10]
+    )
+
+
+def ensure_dataset(total, random_seed=1234):
+    """Seed the (test) database unless it already holds this dataset, e.g. with --keepdb"""
+    if CostCalculation.objects.count() != total or not User.objects.filter(username=BENCH_USERNAME).exists():
+        call_command('flush', interactive=False, verbosity=0)
+        seed(total, random_seed)
+
+    user = User.objects.get(username=BENCH_USERNAME)
+    token, _ = Token.objects.get_or_create(user=user)
+    calculation = CostCalculation.objects.filter(user=user).order_by('pk').first()
+    return Dataset(
+        user=user,
+        token=token,
+        calculation=calculation,
+        origin=calculation.origin_state,
+        destination=calculation.destination_state,
+    )
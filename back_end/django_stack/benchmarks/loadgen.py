@@ -0,0 +1,87 @@
+# benchmarks/loadgen.py
+"""Small asyncio HTTP/1.1 load generator (stdlib only) for benchmarking a running server"""
+
+import asyncio
+import json
+import math
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+
+class Target:
+    """Host/port of the server under test, parsed from a base URL"""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname or '127.0.0.1'
+        self.port = parts.port or 80
+
+
+async def request(target, method, path, headers=None, body=None, timeout=30):
+    """Send one request on a fresh connection; returns (status, seconds, body bytes)"""
+    payload = b''
+    all_headers = {'Host': f'{target.host}:{target.port}', 'Connection': 'close'}
+    if body is not None:
+        payload = json.dumps(body).encode()
+        all_headers['Content-Type'] = 'application/json'
+        all_headers['Content-Length'] = str(len(payload))
+    all_headers.update(headers or {})
+
+    head = f'{method} {path} HTTP/1.1\r\n' + ''.join(f'{k}: {v}\r\n' for k, v in all_headers.items())
+    started = time.perf_counter()
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(target.host, target.port), timeout
+    )
+    try:
+        writer.write(head.encode() + b'\r\n' + payload)
+        await writer.drain()
+        raw = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - started
+
+    status_line, _, rest = raw.partition(b'\r\n')
+    status = int(status_line.split()[1]) if status_line else 0
+    _, _, response_body = rest.partition(b'\r\n\r\n')
+    return status, elapsed, response_body
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def summarize(latencies, statuses):
+    """Latency summary in milliseconds plus a status code histogram"""
+    ms = [s * 1000 for s in latencies]
+    return {
+        'requests': len(ms),
+        'p50_ms': round(percentile(ms, 50), 2) if ms else None,
+        'p95_ms': round(percentile(ms, 95), 2) if ms else None,
+        'p99_ms': round(percentile(ms, 99), 2) if ms else None,
+        'max_ms': round(max(ms), 2) if ms else None,
+        'statuses': dict(Counter(statuses)),
+    }
+
+
+async def run_workers(concurrency, duration, make_request):
+    """Run ``concurrency`` loops of ``make_request`` for ``duration`` seconds"""
+    latencies, statuses = [], []
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            try:
+                status, elapsed, _ = await make_request()
+            except (OSError, asyncio.TimeoutError):
+                statuses.append('error')
+                continue
+            latencies.append(elapsed)
+            statuses.append(status)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, statuses
@@ -0,0 +1,76 @@
+# benchmarks/login_storm.py
+"""
+Measure how a login storm affects latency of unrelated endpoints.
+
+Start the server first, e.g. ``uvicorn mysite.asgi:application --workers 4``
+or ``gunicorn mysite.wsgi --workers 4``, then run:
+
+    python -m benchmarks.login_storm --url http://127.0.0.1:8000
+
+The probe endpoint is hit alone for ``--duration`` seconds, then again while
+``--storm-concurrency`` clients log in continuously. Compare probe p99 across
+the two phases and across the ASGI/WSGI deployments.
+
+Request throttling (REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']) applies to the
+benchmark client like any other, and login is limited per client IP by the
+'login' scope; raise the rates on the servers under test or 429s will
+dominate the results.
+"""
+
+import argparse
+import asyncio
+import json
+
+from .loadgen import Target, request, run_workers, summarize
+
+
+async def ensure_user(target, username, password):
+    await request(target, 'POST', '/api/calculations/auth/register/', body={
+        'username': username,
+        'email': f'{username}@example.com',
+        'password': password,
+        'password_confirm': password,
+    })
+
+
+async def main(args):
+    target = Target(args.url)
+    await ensure_user(target, args.username, args.password)
+
+    def probe():
+        return request(target, 'GET', args.probe_path)
+
+    def login():
+        return request(target, 'POST', '/api/calculations/auth/login/', body={
+            'username': args.username, 'password': args.password,
+        })
+
+    baseline = summarize(*await run_workers(args.probe_concurrency, args.duration, probe))
+
+    storm_task = asyncio.ensure_future(run_workers(args.storm_concurrency, args.duration, login))
+    under_storm = summarize(*await run_workers(args.probe_concurrency, args.duration, probe))
+    logins = summarize(*await storm_task)
+
+    return {
+        'url': args.url,
+        'probe_path': args.probe_path,
+        'probe_baseline': baseline,
+        'probe_during_storm': under_storm,
+        'logins': logins,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--probe-path', default='/api/states/')
+    parser.add_argument('--username', default='loadtest')
+    parser.add_argument('--password', default='loadtest-password')
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--probe-concurrency', type=int, default=8)
+    parser.add_argument('--storm-concurrency', type=int, default=64)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    print(json.dumps(asyncio.run(main(parse_args())), indent=2))
@@ -0,0 +1,123 @@
+# benchmarks/suite.py
+"""
+Reproducible benchmarks for the calculation engine, serializers and API endpoints.
+
+    python -m benchmarks.suite --size 1k --output results/1k.json
+    python -m benchmarks.compare benchmarks/baselines/1k.json results/1k.json
+
+Runs in a throwaway test database (the usual ``test_<NAME>``) seeded with the
+chosen number of calculations. ``--keepdb`` reuses it between runs, which
+matters for 100k and 1m. Throttling, the response cache, read replicas and
+the per-request access log are switched off so the numbers measure the code rather than the caches; pass
+``--response-cache`` to measure with it. ``--save-baseline`` stores the result
+as the baseline for that size.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BASELINE_DIR = Path(__file__).resolve().parent / 'baselines'
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_settings(args):
+    from django.conf import settings
+    return {
+        'REST_FRAMEWORK': {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}},
+        'RESPONSE_CACHE': {**settings.RESPONSE_CACHE, 'ENABLED': args.response_cache},
+        'DATABASE_ROUTING': {**settings.DATABASE_ROUTING, 'REPLICAS': []},
+        'PERFORMANCE': {**settings.PERFORMANCE, 'SAMPLE_RATE': 0.0},
+    }
+
+
+def run(args):
+    import django
+    django.setup()
+    # Access log records would otherwise be interleaved with results on stdout
+    logging.getLogger('mysite.request').setLevel(logging.WARNING)
+
+    from django.db import connection
+    from django.test.utils import override_settings, setup_test_environment
+
+    setup_test_environment(debug=False)
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=args.keepdb)
+    try:
+        with override_settings(**benchmark_settings(args)):
+            from .cases import run_endpoints, run_micro
+            from .datasets import SIZES, ensure_dataset
+
+            started = time.perf_counter()
+            dataset = ensure_dataset(SIZES[args.size], args.seed)
+            seed_seconds = time.perf_counter() - started
+
+            results = {}
+            results.update(run_micro(dataset, batches=args.batches, inner=args.inner))
+            results.update(run_endpoints(dataset, iterations=args.iterations))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=args.keepdb)
+
+    return {
+        'meta': {
+            'size': args.size,
+            'seed': args.seed,
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'response_cache': args.response_cache,
+            'seed_seconds': round(seed_seconds, 2),
+            'timestamp': int(time.time()),
+        },
+        'results': results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', choices=['1k', '100k', '1m'], default='1k',
+                        help='number of seeded calculations')
+    parser.add_argument('--seed', type=int, default=1234, help='random seed for the dataset')
+    parser.add_argument('--iterations', type=int, default=100, help='requests per endpoint')
+    parser.add_argument('--batches', type=int, default=20, help='timed batches per micro-benchmark')
+    parser.add_argument('--inner', type=int, default=50, help='calls per micro-benchmark batch')
+    parser.add_argument('--keepdb', action='store_true', help='keep and reuse the seeded test database')
+    parser.add_argument('--response-cache', action='store_true', help='leave the response cache on')
+    parser.add_argument('--output', help='write results to this file instead of stdout')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='also store the results as benchmarks/baselines/<size>.json')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
+    args = parse_args(argv)
+    report = json.dumps(run(args), indent=2, sort_keys=True)
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.output).write_text(report + '\n')
+    else:
+        sys.stdout.write(report + '\n')
+    if args.save_baseline:
+        BASELINE_DIR.mkdir(exist_ok=True)
+        (BASELINE_DIR / f'{args.size}.json').write_text(report + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CalculationsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'calculations'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from mysite import checks  # noqa: F401
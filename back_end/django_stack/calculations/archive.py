@@ -0,0 +1,158 @@
+# calculations/archive.py
+"""
+Cold storage for calculations nobody has touched in a while.
+
+archive_calculations moves stale calculations and their notes out of the
+hot tables into ArchivedCalculationBatch rows on the owner's shard: one
+zlib-compressed JSON document per batch of a user's calculations, with the
+column names stored once per batch. The hot tables, their indexes and
+every list and dashboard query then only cover what people actually use.
+
+Archived rows come back on demand: rehydrate() restores one calculation
+when a view misses it by id, and rehydrate_all() restores all of a user's
+when they ask for ``include_archived``. Rows are restored as they were, ids
+and timestamps included.
+"""
+
+import datetime
+import itertools
+import json
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+
+from mysite.response_cache import invalidate_tags
+from mysite.sharding import insert_rows, shard_for_user
+from .models import ArchivedCalculationBatch, CalculationNote, CostCalculation
+
+COMPRESSION_LEVEL = 6
+
+
+class ArchiveJSONEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder, except that datetimes keep their microseconds"""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def _columns(model):
+    return [field.attname for field in model._meta.concrete_fields]
+
+
+def pack(calculations, notes):
+    """Compressed JSON for ``calculations`` and their ``notes``, one list of values per row"""
+    document = {
+        model._meta.model_name: {
+            'columns': _columns(model),
+            'rows': [[getattr(obj, column) for column in _columns(model)] for obj in objs],
+        }
+        for model, objs in ((CostCalculation, calculations), (CalculationNote, notes))
+    }
+    return zlib.compress(json.dumps(document, cls=ArchiveJSONEncoder, separators=(',', ':')).encode(), COMPRESSION_LEVEL)
+
+
+def unpack(payload):
+    """(calculations, notes) as unsaved model instances"""
+    document = json.loads(zlib.decompress(payload))
+    result = []
+    for model in (CostCalculation, CalculationNote):
+        table = document[model._meta.model_name]
+        by_column = {field.attname: field for field in model._meta.concrete_fields}
+        fields = [by_column[column] for column in table['columns']]
+        result.append([
+            model(**{field.attname: field.to_python(value) for field, value in zip(fields, row)})
+            for row in table['rows']
+        ])
+    return tuple(result)
+
+
+def archive(alias, ids, cutoff, batch_size):
+    """
+    Move the calculations ``ids`` (rows on ``alias``) that are still not
+    updated since ``cutoff`` and not favorites, with their notes, into cold
+    batches of up to ``batch_size`` per user, in one transaction. Returns the
+    batches written.
+    """
+    with transaction.atomic(using=alias):
+        # Locked and checked again, so an edit or favorite made since the ids were picked keeps its row hot
+        calculations = list(
+            CostCalculation._base_manager.using(alias).select_for_update()
+            .filter(pk__in=ids, updated_at__lt=cutoff, is_favorite=False)
+        )
+        ids = [calculation.pk for calculation in calculations]
+        notes = {}
+        for note in CalculationNote._base_manager.using(alias).filter(calculation_id__in=ids):
+            notes.setdefault(note.calculation_id, []).append(note)
+
+        batches = []
+        ordered = sorted(calculations, key=lambda calculation: (calculation.user_id, calculation.pk))
+        for user_id, owned in itertools.groupby(ordered, key=lambda calculation: calculation.user_id):
+            owned = list(owned)
+            for start in range(0, len(owned), batch_size):
+                chunk = owned[start:start + batch_size]
+                batches.append(ArchivedCalculationBatch(
+                    user_id=user_id,
+                    first_id=chunk[0].pk,
+                    last_id=chunk[-1].pk,
+                    calculation_count=len(chunk),
+                    payload=pack(chunk, [note for calculation in chunk for note in notes.get(calculation.pk, ())]),
+                ))
+        ArchivedCalculationBatch.objects.using(alias).bulk_create(batches)
+
+        CalculationNote._base_manager.using(alias).filter(calculation_id__in=ids)._raw_delete(alias)
+        CostCalculation._base_manager.using(alias).filter(pk__in=ids)._raw_delete(alias)
+    return batches
+
+
+def _restore(batch, alias, wanted=None):
+    """Put the batch's calculations in ``wanted`` (all if None) back; returns how many came back"""
+    calculations, notes = unpack(batch.payload)
+    restored = [c for c in calculations if wanted is None or c.pk in wanted]
+    if not restored:
+        return 0
+    restored_ids = {calculation.pk for calculation in restored}
+    kept = [c for c in calculations if c.pk not in restored_ids]
+    insert_rows(CostCalculation, restored, alias)
+    insert_rows(CalculationNote, [note for note in notes if note.calculation_id in restored_ids], alias)
+    if kept:
+        kept_ids = [calculation.pk for calculation in kept]
+        batch.payload = pack(kept, [note for note in notes if note.calculation_id not in restored_ids])
+        batch.first_id, batch.last_id, batch.calculation_count = min(kept_ids), max(kept_ids), len(kept)
+        batch.save(using=alias, update_fields=['payload', 'first_id', 'last_id', 'calculation_count'])
+    else:
+        batch.delete(using=alias)
+    return len(restored)
+
+
+def _rehydrate(user, batches, wanted=None):
+    alias = shard_for_user(user.pk)
+    restored = 0
+    try:
+        with transaction.atomic(using=alias):
+            # Locked, so a concurrent request for the same rows waits and then finds them hot
+            for batch in batches.using(alias).select_for_update().order_by('pk'):
+                restored += _restore(batch, alias, wanted)
+    except IntegrityError:
+        # Another request restored them first
+        return 0
+    if restored:
+        invalidate_tags(f'user:{user.pk}:calculations', f'user:{user.pk}')
+    return restored
+
+
+def rehydrate(user, pk):
+    """Restore ``user``'s archived calculation ``pk``, if there is one; returns whether it was"""
+    batches = ArchivedCalculationBatch.objects.filter(user=user, first_id__lte=pk, last_id__gte=pk)
+    return bool(_rehydrate(user, batches, {pk}))
+
+
+def rehydrate_all(user):
+    """Restore every archived calculation of ``user``; returns how many there were"""
+    return _rehydrate(user, ArchivedCalculationBatch.objects.filter(user=user))
+
+
+def wants_archived(params):
+    return params.get('include_archived') in ('true', 'True', '1')
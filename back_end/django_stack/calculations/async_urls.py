@@ -0,0 +1,18 @@
+# calculations/async_urls.py - Async endpoints, mounted ahead of calculations/urls.py under ASGI
+
+from django.urls import path
+from . import async_views
+
+urlpatterns = [
+    # Authentication (password hashing runs in a bounded worker pool)
+    path('auth/register/', async_views.register_view, name='async-register'),
+    path('auth/login/', async_views.login_view, name='async-login'),
+    
+    # Read endpoints (writes on the same paths fall through to the sync views)
+    path('', async_views.calculation_list, name='async-calculation-list'),
+    path('<int:pk>/', async_views.calculation_detail, name='async-calculation-detail'),
+    path('<int:pk>/report.<str:extension>', async_views.calculation_report, name='async-calculation-report'),
+    path('dashboard/', async_views.dashboard, name='async-dashboard'),
+    path('bootstrap/', async_views.bootstrap, name='async-bootstrap'),
+    path('compare-states/', async_views.states_comparison, name='async-compare-states'),
+]
@@ -0,0 +1,383 @@
+# calculations/async_views.py - Native async endpoints served under mysite.asgi
+
+import asyncio
+import json
+import math
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.hashers import check_password, make_password
+from django.contrib.auth.models import User
+from django.db import IntegrityError, models, transaction
+from django.db.models import aprefetch_related_objects
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.filters import SearchFilter
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from mysite.async_api import api_response, async_api_view, async_throttle
+from mysite.throttling import ScopedBucketThrottle
+from state_data.catalog import aget_catalog
+from .archive import rehydrate, rehydrate_all, wants_archived
+from .authentication import reissue_token, token_has_expired
+from .bootstrap import bootstrap_payload
+from .executors import ExecutorBusy, password_hashing_executor, report_rendering_executor
+from .models import CostCalculation
+from .reports import (
+    CONTENT_TYPES, prepare_report, render_in_pool, report_not_modified, report_response, report_wait
+)
+from .serializers import (
+    CostCalculationSerializer, CostCalculationSummarySerializer,
+    StateDataSerializer, UserProfileSerializer, UserRegistrationSerializer
+)
+from .views import CostCalculationDetailView, CostCalculationListCreateView, auth_response_data
+
+
+def _request_data(request):
+    """Parse a JSON or form-encoded body the way DRF's default parsers would; ValueError unless it is an object"""
+    if request.content_type == 'application/json':
+        data = json.loads(request.body or b'{}')
+        if not isinstance(data, dict):
+            raise ValueError(f'Expected a JSON object, but got {type(data).__name__}.')
+        return data
+    return request.POST.dict()
+
+
+def _bad_request(detail):
+    return JsonResponse({'detail': detail}, status=400)
+
+
+def _busy_response(exc):
+    response = JsonResponse(
+        {'detail': 'Server is busy, please retry shortly.'},
+        status=503
+    )
+    response['Retry-After'] = str(exc.retry_after)
+    return response
+
+
+def _verify_password(user, raw_password):
+    """Check a password off the event loop; returns (valid, upgraded hash or None)"""
+    if user is None:
+        # Run the hasher anyway so unknown usernames don't answer faster (same as ModelBackend)
+        make_password(raw_password)
+        return False, None
+
+    upgraded = []
+    valid = check_password(
+        raw_password, user.password,
+        setter=lambda raw: upgraded.append(make_password(raw))
+    )
+    return valid, (upgraded[0] if upgraded else None)
+
+
+def _create_account(validated_data, password_hash):
+    """Insert user, profile and token in one transaction with no read-before-write"""
+    with transaction.atomic():
+        user = User(
+            username=User.normalize_username(validated_data['username']),
+            email=User.objects.normalize_email(validated_data.get('email', '')),
+            first_name=validated_data.get('first_name', ''),
+            last_name=validated_data.get('last_name', ''),
+            password=password_hash,
+        )
+        user.save()  # post_save creates the profile
+        token = Token.objects.create(user=user)
+    return user, token, user.profile
+
+
+@csrf_exempt
+@require_POST
+@async_throttle([ScopedBucketThrottle], 'login')
+async def login_view(request):
+    """Async counterpart of CustomAuthToken.post"""
+    try:
+        data = _request_data(request)
+    except ValueError as e:
+        return _bad_request(f'JSON parse error - {e}')
+
+    username = data.get('username')
+    password = data.get('password')
+    if not username or not password:
+        return JsonResponse(
+            {'non_field_errors': ['Must include "username" and "password".']},
+            status=400
+        )
+
+    # User, token (with its last use) and profile (with its state) in a single query
+    try:
+        user = await User.objects.select_related(
+            'auth_token__activity', 'profile__current_state'
+        ).aget(**{User.USERNAME_FIELD: username})
+    except User.DoesNotExist:
+        user = None
+
+    try:
+        valid, upgraded_hash = await password_hashing_executor.run(_verify_password, user, password)
+    except ExecutorBusy as e:
+        return _busy_response(e)
+
+    if not valid or not user.is_active:
+        return JsonResponse(
+            {'non_field_errors': ['Unable to log in with provided credentials.']},
+            status=400
+        )
+
+    if upgraded_hash:
+        user.password = upgraded_hash
+        await User.objects.filter(pk=user.pk).aupdate(password=upgraded_hash)
+
+    token = getattr(user, 'auth_token', None)
+    if token is None:
+        try:
+            token = await Token.objects.acreate(user=user)
+        except IntegrityError:
+            # A concurrent login for the same user created it first
+            token = await Token.objects.aget(user=user)
+    elif token_has_expired(token):
+        token = await sync_to_async(reissue_token)(user, token)
+
+    return JsonResponse(auth_response_data(user, token, UserProfileSerializer(user.profile).data))
+
+
+@csrf_exempt
+@require_POST
+@async_throttle([ScopedBucketThrottle], 'register')
+async def register_view(request):
+    """Async counterpart of UserRegistrationView.create"""
+    try:
+        data = _request_data(request)
+    except ValueError as e:
+        return _bad_request(f'JSON parse error - {e}')
+
+    serializer = UserRegistrationSerializer(data=data)
+    if not await sync_to_async(serializer.is_valid)():
+        return JsonResponse(serializer.errors, status=400)
+
+    try:
+        password_hash = await password_hashing_executor.run(
+            make_password, serializer.validated_data['password']
+        )
+    except ExecutorBusy as e:
+        return _busy_response(e)
+
+    try:
+        user, token, profile = await sync_to_async(_create_account)(
+            serializer.validated_data, password_hash
+        )
+    except IntegrityError:
+        # Lost a race with another registration for the same username
+        return JsonResponse(
+            {'username': ['A user with that username already exists.']},
+            status=400
+        )
+
+    return JsonResponse({
+        **auth_response_data(user, token, UserProfileSerializer(profile).data),
+        'message': 'User created successfully'
+    }, status=201)
+
+
+# Read endpoints
+
+def _parse_boolean(value):
+    """Values accepted by django-filter's BooleanFilter for ?is_favorite="""
+    if value in ('true', 'True', '1'):
+        return True
+    if value in ('false', 'False', '0'):
+        return False
+    raise ValidationError({'is_favorite': ['Select a valid choice.']})
+
+
+def filter_calculations(queryset, params):
+    """
+    Apply CostCalculationListCreateView's filter, search and ordering params.
+
+    Mirrors DjangoFilterBackend/SearchFilter/OrderingFilter but builds the
+    queryset without validating choices against the database, so nothing
+    runs synchronously inside the event loop.
+    """
+    view = CostCalculationListCreateView
+
+    if params.get('is_favorite'):
+        queryset = queryset.filter(is_favorite=_parse_boolean(params['is_favorite']))
+    for field in ('origin_state', 'destination_state'):
+        if params.get(field):
+            try:
+                queryset = queryset.filter(**{f'{field}_id': int(params[field])})
+            except ValueError:
+                raise ValidationError({field: ['Select a valid choice. That choice is not one of the available choices.']})
+
+    for term in SearchFilter().get_search_terms(_QueryParams(params)):
+        queryset = queryset.filter(calculation_name__icontains=term)
+
+    ordering = [
+        term.strip() for term in params.get('ordering', '').split(',')
+        if term.strip().lstrip('-') in view.ordering_fields
+    ]
+    return queryset.order_by(*(ordering or view.ordering))
+
+
+class _QueryParams:
+    """Just enough of a DRF Request for SearchFilter.get_search_terms()"""
+
+    def __init__(self, params):
+        self.query_params = params
+
+
+def _page_url(request, page_number):
+    url = request.build_absolute_uri()
+    if page_number == 1:
+        return remove_query_param(url, 'page')
+    return replace_query_param(url, 'page', page_number)
+
+
+async def paginate(request, queryset, serializer_class):
+    """Same envelope as PageNumberPagination: count/next/previous/results"""
+    page_size = api_settings.PAGE_SIZE
+    count = await queryset.acount()
+    num_pages = max(1, math.ceil(count / page_size))
+
+    page_param = request.GET.get('page', 1)
+    try:
+        page_number = num_pages if page_param == 'last' else int(page_param)
+    except ValueError:
+        raise NotFound('Invalid page.')
+    if page_number < 1 or page_number > num_pages:
+        raise NotFound('Invalid page.')
+
+    offset = (page_number - 1) * page_size
+    rows = [row async for row in queryset[offset:offset + page_size]]
+    return {
+        'count': count,
+        'next': _page_url(request, page_number + 1) if page_number < num_pages else None,
+        'previous': _page_url(request, page_number - 1) if page_number > 1 else None,
+        'results': serializer_class(rows, many=True).data,
+    }
+
+
+@async_api_view(fallback=CostCalculationListCreateView.as_view())
+async def calculation_list(request):
+    """Async GET for the calculation list; POST falls through to the sync create view"""
+    if wants_archived(request.GET):
+        await sync_to_async(rehydrate_all)(request.user)
+    calculations = await CostCalculation.objects.afor_user(request.user)
+    queryset = filter_calculations(
+        calculations.select_related('origin_state'),
+        request.GET,
+    )
+    return api_response(await paginate(request, queryset, CostCalculationSummarySerializer))
+
+
+async def _get_calculation(request, pk):
+    """The user's calculation ``pk`` with its states, brought back from the archive if it was archived"""
+    calculations = (await CostCalculation.objects.afor_user(request.user)).select_related(
+        'origin_state', 'destination_state', 'destination_region__state'
+    )
+    try:
+        calculation = await calculations.aget(pk=pk)
+    except CostCalculation.DoesNotExist:
+        # Looked up again whatever rehydrate() says: a concurrent request may have restored it first
+        await sync_to_async(rehydrate)(request.user, pk)
+        try:
+            calculation = await calculations.aget(pk=pk)
+        except CostCalculation.DoesNotExist:
+            raise NotFound('No CostCalculation matches the given query.')
+    # The user comes from the request: users are not on the calculation shards
+    calculation.user = request.user
+    return calculation
+
+
+@async_api_view(fallback=CostCalculationDetailView.as_view())
+async def calculation_detail(request, pk):
+    """Async GET for one calculation; PUT/PATCH/DELETE fall through to the sync detail view"""
+    calculation = await _get_calculation(request, pk)
+    await aprefetch_related_objects([calculation], 'notes')
+    return api_response(CostCalculationSerializer(calculation).data)
+
+
+@async_api_view()
+async def calculation_report(request, pk, extension):
+    """Async GET for a printable report; the render itself runs in report_rendering_executor"""
+    if extension not in CONTENT_TYPES:
+        raise NotFound('Reports are available as .html or .pdf')
+    report = await sync_to_async(prepare_report)(await _get_calculation(request, pk), extension)
+    not_modified = report_not_modified(request, report)
+    if not_modified is not None:
+        return not_modified
+    
+    try:
+        content = await sync_to_async(report.path.read_bytes)()
+    except FileNotFoundError:
+        try:
+            future = render_in_pool(report)
+        except ExecutorBusy as e:
+            return _busy_response(e)
+        try:
+            # Shielded: the render is shared and outlives a request that gives up on it
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), report_wait())
+        except asyncio.TimeoutError:
+            return api_response(
+                {'detail': 'The report is being prepared, please retry shortly.'},
+                status=202, headers={'Retry-After': str(report_rendering_executor.retry_after)}
+            )
+        content = await sync_to_async(report.path.read_bytes)()
+    return report_response(report, f'calculation-{pk}-report.{extension}', content)
+
+
+@async_api_view()
+async def dashboard(request):
+    """Async counterpart of user_dashboard_data"""
+    calculations = await CostCalculation.objects.afor_user(request.user)
+
+    # Count, favorites and average in one aggregate query
+    summary = await calculations.aaggregate(
+        total=models.Count('id'),
+        favorites=models.Count('id', filter=models.Q(is_favorite=True)),
+        avg_savings=models.Avg('total_monthly_savings'),
+    )
+    avg_monthly_savings = summary['avg_savings'] or 0
+
+    with_state = calculations.select_related('origin_state')
+    recent_calculations = [c async for c in with_state.order_by('-updated_at')[:5]]
+    best_savings = await with_state.order_by('-total_monthly_savings').afirst()
+    worst_savings = await with_state.order_by('total_monthly_savings').afirst()
+
+    return api_response({
+        'total_calculations': summary['total'],
+        'favorite_calculations': summary['favorites'],
+        'average_monthly_savings': round(avg_monthly_savings, 2),
+        'average_annual_savings': round(avg_monthly_savings * 12, 2),
+        'recent_calculations': CostCalculationSummarySerializer(recent_calculations, many=True).data,
+        'best_savings_scenario': CostCalculationSummarySerializer(best_savings).data if best_savings else None,
+        'worst_savings_scenario': CostCalculationSummarySerializer(worst_savings).data if worst_savings else None,
+    })
+
+
+@async_api_view()
+async def bootstrap(request):
+    """Async counterpart of bootstrap; the queries are few and cheap, so they share one thread hop"""
+    payload = await sync_to_async(bootstrap_payload)(
+        request, request.GET.get('states_version'), request.GET.get('ordering'),
+    )
+    return api_response(payload)
+
+
+@async_api_view(permission='any', throttle_classes=[ScopedBucketThrottle], throttle_scope='state_compare')
+async def states_comparison(request):
+    """Async counterpart of states_comparison_data"""
+    origin_state_id = request.GET.get('origin')
+    if not origin_state_id:
+        return api_response({'error': 'Origin state is required'}, status=400)
+
+    catalog = await aget_catalog()
+    origin_state, destination_state = catalog.resolve(origin_state_id, request.GET.get('destination'))
+    if origin_state is None or destination_state is None:
+        return api_response({'error': 'State not found'}, status=404)
+
+    response = api_response(catalog.comparison(origin_state, destination_state, StateDataSerializer))
+    response.content_version = f'{request.get_full_path()}:{catalog.version}'
+    return response
@@ -0,0 +1,290 @@
+# calculations/authentication.py
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+
+from mysite.metrics import cache_requests
+from mysite.response_cache import invalidate_tags, tag_versions
+
+from .models import AuthTokenActivity
+
+
+DEFAULT_TOKEN_AUTH = {
+    'CACHE_SIZE': 10000,              # max tokens kept per process
+    'CACHE_TTL': 30,                  # seconds a cached token is trusted before re-reading it
+    'EXPIRY': 60 * 60 * 24 * 14,      # sliding idle expiry in seconds, None = never expire
+    'LAST_SEEN_FLUSH_INTERVAL': 60,   # seconds between batched last-seen writes
+}
+
+
+def token_auth_setting(name):
+    return getattr(settings, 'TOKEN_AUTH', {}).get(name, DEFAULT_TOKEN_AUTH[name])
+
+
+def revocation_tags(key, user_id):
+    """Cache tags whose versions a cached token was resolved under; see revoke_token() and revoke_user_tokens()"""
+    return [f'auth:token:{key}', f'auth:user:{user_id}']
+
+
+def revoke_token(key):
+    """Make every worker re-read ``key`` (deleted on logout) instead of trusting its cached copy"""
+    invalidate_tags(f'auth:token:{key}')
+
+
+def revoke_user_tokens(user_id):
+    """Make every worker re-read the user's tokens (after deactivation or any other user change)"""
+    invalidate_tags(f'auth:user:{user_id}')
+
+
+class CachedToken:
+    """A resolved token held in the in-process cache, with the revocation tag versions it was read under"""
+
+    __slots__ = ('token', 'last_seen', 'cached_at', 'versions')
+
+    def __init__(self, token, last_seen, cached_at, versions):
+        self.token = token
+        self.last_seen = last_seen
+        self.cached_at = cached_at
+        self.versions = versions
+
+    @property
+    def key(self):
+        return self.token.key
+
+    @property
+    def user(self):
+        return self.token.user
+
+
+class TokenCache:
+    """
+    Bounded LRU cache of token key -> CachedToken with a per-entry TTL.
+
+    The cache is per process, so a hit is only trusted while the token's
+    revocation tags (revocation_tags()) still have the versions it was cached
+    under: logout or deactivation in any worker bumps them in the shared
+    cache, and every other worker drops its copy on the next request.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry.cached_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        if tag_versions(revocation_tags(key, entry.token.user_id)) != entry.versions:
+            self.invalidate(key)
+            return None
+        return entry
+
+    def set(self, entry):
+        with self._lock:
+            self._entries[entry.key] = entry
+            self._entries.move_to_end(entry.key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry.token.user_id == user_id]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class LastSeenBuffer:
+    """Collects token last-seen timestamps and writes them in one batch per interval"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def record(self, key, seen_at):
+        """Buffer a timestamp; returns True when the caller should flush()"""
+        with self._lock:
+            self._pending[key] = seen_at
+            return time.monotonic() - self._last_flush >= self.interval
+
+    def discard(self, key):
+        with self._lock:
+            self._pending.pop(key, None)
+
+    def flush(self):
+        """Upsert all pending timestamps; returns the number of tokens written"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return 0
+
+        # Tokens deleted since they were seen must not be resurrected as activity rows
+        live_keys = set(Token.objects.filter(key__in=pending).values_list('key', flat=True))
+        rows = [
+            AuthTokenActivity(token_id=key, last_seen=seen_at)
+            for key, seen_at in pending.items() if key in live_keys
+        ]
+        AuthTokenActivity.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['token'],
+            update_fields=['last_seen'],
+        )
+        return len(rows)
+
+
+token_cache = TokenCache(token_auth_setting('CACHE_SIZE'), token_auth_setting('CACHE_TTL'))
+last_seen_buffer = LastSeenBuffer(token_auth_setting('LAST_SEEN_FLUSH_INTERVAL'))
+
+
+def token_expiry_cutoff(now=None):
+    """Tokens not seen since the returned datetime are expired (None if expiry is disabled)"""
+    expiry = token_auth_setting('EXPIRY')
+    if expiry is None:
+        return None
+    return (now or timezone.now()) - timedelta(seconds=expiry)
+
+
+def token_has_expired(token, now=None):
+    """Whether ``token`` went unused for EXPIRY seconds (select_related('activity') to save a query)"""
+    cutoff = token_expiry_cutoff(now)
+    if cutoff is None:
+        return False
+    entry = token_cache.get(token.key)
+    if entry is not None:
+        # Fresher than the stored activity while its last-seen is still buffered
+        return entry.last_seen < cutoff
+    activity = getattr(token, 'activity', None)
+    return (activity.last_seen if activity else token.created) < cutoff
+
+
+def reissue_token(user, token):
+    """Replace ``user``'s expired ``token``; logging in again must not hand the dead key back"""
+    Token.objects.filter(pk=token.pk).delete()
+    try:
+        return Token.objects.create(user=user)
+    except IntegrityError:
+        # A concurrent login replaced it first
+        return Token.objects.get(user=user)
+
+
+def login_token(user):
+    """The token to return from a successful login: the current one, or a new one if it has expired"""
+    token, created = Token.objects.select_related('activity').get_or_create(user=user)
+    if not created and token_has_expired(token):
+        token = reissue_token(user, token)
+    return token
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication backed by an in-process LRU/TTL cache.
+
+    Cache hits cost no queries, only a check of the token's revocation
+    versions in the shared cache; misses resolve token, user and last-seen in
+    a single joined query. Tokens expire after EXPIRY seconds without use, and
+    last-seen timestamps are written in batches rather than per request.
+    """
+
+    def get_queryset(self):
+        return Token.objects.select_related('user', 'activity')
+
+    def authenticate_credentials(self, key):
+        entry = token_cache.get(key)
+        cache_requests.labels('token', 'miss' if entry is None else 'hit').inc()
+        if entry is None:
+            try:
+                entry = self.cache_token(self.get_queryset().get(key=key))
+            except Token.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        user, token, flush_due = self.check_entry(entry)
+        if flush_due:
+            last_seen_buffer.flush()
+        return (user, token)
+
+    async def aauthenticate(self, request):
+        """Async counterpart of authenticate() for native async views"""
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed(_('Invalid token header. Credentials string should not contain spaces.'))
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(_('Invalid token header. Token string should not contain invalid characters.'))
+        return await self.aauthenticate_credentials(key)
+
+    async def aauthenticate_credentials(self, key):
+        entry = token_cache.get(key)
+        cache_requests.labels('token', 'miss' if entry is None else 'hit').inc()
+        if entry is None:
+            try:
+                entry = self.cache_token(await self.get_queryset().aget(key=key))
+            except Token.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        user, token, flush_due = self.check_entry(entry)
+        if flush_due:
+            await sync_to_async(last_seen_buffer.flush)()
+        return (user, token)
+
+    def cache_token(self, token):
+        activity = getattr(token, 'activity', None)
+        entry = CachedToken(
+            token=token,
+            last_seen=activity.last_seen if activity else token.created,
+            cached_at=time.monotonic(),
+            versions=tag_versions(revocation_tags(token.key, token.user_id)),
+        )
+        if entry.user.is_active:
+            token_cache.set(entry)
+        return entry
+
+    def check_entry(self, entry):
+        """Validate a resolved token; returns (user, token, whether last-seen should be flushed)"""
+        if not entry.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        now = timezone.now()
+        cutoff = token_expiry_cutoff(now)
+        if cutoff is not None and entry.last_seen < cutoff:
+            token_cache.invalidate(entry.key)
+            last_seen_buffer.discard(entry.key)
+            raise exceptions.AuthenticationFailed(_('Token has expired.'))
+
+        entry.last_seen = now
+        flush_due = last_seen_buffer.record(entry.key, now)
+        return entry.user, entry.token, flush_due
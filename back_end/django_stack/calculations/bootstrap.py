@@ -0,0 +1,98 @@
+# calculations/bootstrap.py
+
+from django.db import models
+from django.urls import reverse
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from state_data.catalog import get_catalog
+from state_data.views import SAMPLE_STATES
+from .models import CostCalculation
+from .profiles import get_profile_payload
+from .serializers import CostCalculationSummarySerializer
+
+LIST_ORDERING_FIELDS = ['created_at', 'updated_at', 'total_monthly_savings']
+DEFAULT_ORDERING = '-updated_at'
+
+
+def _ordering(param):
+    """A single ordering term the calculation list accepts, or its default"""
+    if param and param.lstrip('-') in LIST_ORDERING_FIELDS:
+        return param
+    return DEFAULT_ORDERING
+
+
+def _best_and_worst(calculations, page, summary):
+    """Highest and lowest savings rows; only queried when the first page does not already hold them"""
+    savings = {calculation.total_monthly_savings: calculation for calculation in reversed(page)}
+    if summary['best'] not in savings or summary['worst'] not in savings:
+        extremes = calculations.select_related('origin_state').filter(
+            total_monthly_savings__in=[summary['best'], summary['worst']],
+        )
+        for calculation in extremes:
+            savings.setdefault(calculation.total_monthly_savings, calculation)
+    return savings.get(summary['best']), savings.get(summary['worst'])
+
+
+def bootstrap_payload(request, states_version=None, ordering=None):
+    """
+    Everything the app needs for its first screen: profile, state catalog,
+    dashboard summary and the first page of calculations.
+
+    The catalog is left out (``states`` is None) when the client already has
+    ``states_version``. One aggregate and one page query cover the
+    dashboard and the list; the best and worst scenarios cost a third only
+    when they are not on the first page.
+    """
+    user = request.user
+    calculations = CostCalculation.objects.for_user(user)
+    ordering = _ordering(ordering)
+    page_size = api_settings.PAGE_SIZE
+
+    summary = calculations.aggregate(
+        total=models.Count('id'),
+        favorites=models.Count('id', filter=models.Q(is_favorite=True)),
+        avg_savings=models.Avg('total_monthly_savings'),
+        best=models.Max('total_monthly_savings'),
+        worst=models.Min('total_monthly_savings'),
+    )
+    total = summary['total']
+    page = list(calculations.select_related('origin_state').order_by(ordering)[:page_size]) if total else []
+
+    if ordering == DEFAULT_ORDERING:
+        recent = page[:5]
+    else:
+        recent = list(calculations.select_related('origin_state').order_by(DEFAULT_ORDERING)[:5])
+    best, worst = _best_and_worst(calculations, page, summary) if total else (None, None)
+    avg_monthly_savings = summary['avg_savings'] or 0
+
+    list_url = request.build_absolute_uri(reverse('calculations:calculation-list-create'))
+    if ordering != DEFAULT_ORDERING:
+        list_url = replace_query_param(list_url, 'ordering', ordering)
+
+    catalog = get_catalog()
+    if states_version == catalog.version:
+        states = None
+    else:
+        states = catalog.serialized() if catalog.states else SAMPLE_STATES
+
+    return {
+        'profile': get_profile_payload(user),
+        'states_version': catalog.version,
+        'states': states,
+        'dashboard': {
+            'total_calculations': total,
+            'favorite_calculations': summary['favorites'],
+            'average_monthly_savings': round(avg_monthly_savings, 2),
+            'average_annual_savings': round(avg_monthly_savings * 12, 2),
+            'recent_calculations': CostCalculationSummarySerializer(recent, many=True).data,
+            'best_savings_scenario': CostCalculationSummarySerializer(best).data if best else None,
+            'worst_savings_scenario': CostCalculationSummarySerializer(worst).data if worst else None,
+        },
+        'calculations': {
+            'count': total,
+            'next': replace_query_param(list_url, 'page', 2) if total > page_size else None,
+            'previous': None,
+            'results': CostCalculationSummarySerializer(page, many=True).data,
+        },
+    }
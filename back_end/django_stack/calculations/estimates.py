@@ -0,0 +1,57 @@
+# calculations/estimates.py
+
+from collections import namedtuple
+from decimal import Decimal, ROUND_HALF_UP
+
+CENT = Decimal('0.01')
+
+# Destination / origin cost-of-living index ratios
+EstimateRatios = namedtuple('EstimateRatios', ['housing', 'utilities', 'grocery', 'transportation', 'overall'])
+
+
+def _ratio(destination_index, origin_index):
+    # Convert float indices to Decimal for proper calculation
+    return Decimal(str(destination_index)) / Decimal(str(origin_index))
+
+
+def estimate_ratios(origin_state, destination_state):
+    """Index ratios for moving from origin_state to destination_state; reusable across calculations"""
+    return EstimateRatios(
+        housing=_ratio(destination_state.housing_index, origin_state.housing_index),
+        utilities=_ratio(destination_state.utilities_index, origin_state.utilities_index),
+        grocery=_ratio(destination_state.grocery_index, origin_state.grocery_index),
+        transportation=_ratio(destination_state.transportation_index, origin_state.transportation_index),
+        overall=_ratio(destination_state.cost_of_living_index, origin_state.cost_of_living_index),
+    )
+
+
+def apply_estimates(calculation, ratios):
+    """Fill the estimated destination costs and savings of ``calculation`` from precomputed ratios"""
+    calculation.estimated_maine_rent = (calculation.current_rent * ratios.housing).quantize(
+        CENT, rounding=ROUND_HALF_UP
+    )
+    calculation.estimated_maine_utilities = (calculation.current_utilities * ratios.utilities).quantize(
+        CENT, rounding=ROUND_HALF_UP
+    )
+    calculation.estimated_maine_groceries = (calculation.current_groceries * ratios.grocery).quantize(
+        CENT, rounding=ROUND_HALF_UP
+    )
+    calculation.estimated_maine_transportation = (calculation.current_transportation * ratios.transportation).quantize(
+        CENT, rounding=ROUND_HALF_UP
+    )
+
+    maine_total = (
+        calculation.estimated_maine_rent +
+        calculation.estimated_maine_utilities +
+        calculation.estimated_maine_groceries +
+        calculation.estimated_maine_transportation +
+        calculation.current_healthcare +  # Assume healthcare stays the same
+        (calculation.current_entertainment * ratios.overall).quantize(CENT, rounding=ROUND_HALF_UP)
+    )
+
+    calculation.total_monthly_savings = (calculation.total_current_monthly_expenses - maine_total).quantize(
+        CENT, rounding=ROUND_HALF_UP
+    )
+    calculation.total_annual_savings = (calculation.total_monthly_savings * 12).quantize(
+        CENT, rounding=ROUND_HALF_UP
+    )
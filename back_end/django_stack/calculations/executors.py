@@ -0,0 +1,84 @@
+# calculations/executors.py
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+
+class ExecutorBusy(Exception):
+    """Raised when a bounded executor has no free slot for new work"""
+
+    def __init__(self, retry_after):
+        super().__init__('Executor queue is full')
+        self.retry_after = retry_after
+
+
+class BoundedExecutor:
+    """
+    Thread pool that refuses work instead of queueing without limit.
+
+    At most ``max_workers`` jobs run and ``max_queue`` more wait; anything
+    beyond that fails fast with ExecutorBusy so callers can shed load.
+    """
+
+    def __init__(self, name, max_workers, max_queue, retry_after=1):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def pool(self):
+        # Created lazily so pre-fork servers don't start threads in the master
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix=self.name,
+                    )
+        return self._pool
+
+    def submit(self, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            raise ExecutorBusy(self.retry_after)
+        try:
+            future = self.pool.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    async def run(self, fn, *args, **kwargs):
+        """Run ``fn`` in the pool and await its result without blocking the event loop"""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def shutdown(self, wait=True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+            self._pool = None
+
+
+def _executor_setting(setting, name, default):
+    return getattr(settings, setting, {}).get(name, default)
+
+
+password_hashing_executor = BoundedExecutor(
+    'password-hashing',
+    max_workers=_executor_setting('PASSWORD_HASHING_EXECUTOR', 'MAX_WORKERS', 4),
+    max_queue=_executor_setting('PASSWORD_HASHING_EXECUTOR', 'MAX_QUEUE', 32),
+    retry_after=_executor_setting('PASSWORD_HASHING_EXECUTOR', 'RETRY_AFTER', 1),
+)
+
+report_rendering_executor = BoundedExecutor(
+    'report-rendering',
+    max_workers=_executor_setting('REPORT_RENDERING_EXECUTOR', 'MAX_WORKERS', 2),
+    max_queue=_executor_setting('REPORT_RENDERING_EXECUTOR', 'MAX_QUEUE', 16),
+    retry_after=_executor_setting('REPORT_RENDERING_EXECUTOR', 'RETRY_AFTER', 2),
+)
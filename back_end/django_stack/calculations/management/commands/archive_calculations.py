@@ -0,0 +1,87 @@
+# calculations/management/commands/archive_calculations.py
+"""
+Move calculations not updated in --days days, with their notes, into
+compressed cold batches (see calculations/archive.py), on every shard.
+
+Favorites stay hot whatever their age. Each batch holds up to --batch-size
+calculations of one user. Batches are written in the same transaction that
+locks, re-checks and deletes their hot rows, a few thousand rows at a time,
+so a run can be interrupted and repeated safely, and a calculation edited
+or favorited while the run is under way stays hot. On PostgreSQL, autovacuum (or VACUUM) then
+hands the freed pages back to the table and its indexes.
+"""
+
+import itertools
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from calculations.archive import archive
+from calculations.models import CostCalculation
+from mysite.response_cache import invalidate_tags
+from mysite.sharding import sharding_setting
+
+ROWS_PER_TRANSACTION = 2000
+
+
+class Command(BaseCommand):
+    help = 'Archive calculations not updated in N days into compressed per-user batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=180, help='archive calculations untouched this long')
+        parser.add_argument('--batch-size', type=int, default=500, help='calculations per archived batch')
+        parser.add_argument('--dry-run', action='store_true', help='count what would be archived')
+
+    def handle(self, *args, **options):
+        if options['days'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--days and --batch-size must be positive')
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        started = time.perf_counter()
+        totals = {'calculations': 0, 'batches': 0, 'users': 0, 'bytes': 0}
+
+        for alias in sharding_setting('SHARDS'):
+            stale = list(
+                CostCalculation._base_manager.using(alias)
+                .filter(updated_at__lt=cutoff, is_favorite=False)
+                .order_by('user_id', 'pk')
+                .values_list('user_id', 'pk')
+            )
+            pending_users, pending_ids = [], []
+            for user_id, rows in itertools.groupby(stale, key=lambda row: row[0]):
+                pending_users.append(user_id)
+                pending_ids.extend(pk for _, pk in rows)
+                # Whole users per transaction, a few thousand rows at a time
+                if len(pending_ids) >= ROWS_PER_TRANSACTION:
+                    self.archive(alias, pending_users, pending_ids, cutoff, options, totals)
+                    pending_users, pending_ids = [], []
+            if pending_ids:
+                self.archive(alias, pending_users, pending_ids, cutoff, options, totals)
+
+        elapsed = time.perf_counter() - started
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                f"Would archive {totals['calculations']} calculations of {totals['users']} users "
+                f"not updated since {cutoff:%Y-%m-%d}"
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Archived {totals['calculations']} calculations of {totals['users']} users into "
+                f"{totals['batches']} batches ({totals['bytes'] / 1024:.0f} KiB compressed) in {elapsed:.1f}s"
+            ))
+
+    def archive(self, alias, user_ids, ids, cutoff, options, totals):
+        if options['dry_run']:
+            totals['users'] += len(user_ids)
+            totals['calculations'] += len(ids)
+            return
+        batches = archive(alias, ids, cutoff, options['batch_size'])
+        archived_users = {batch.user_id for batch in batches}
+        totals['users'] += len(archived_users)
+        totals['calculations'] += sum(batch.calculation_count for batch in batches)
+        totals['batches'] += len(batches)
+        totals['bytes'] += sum(len(batch.payload) for batch in batches)
+        invalidate_tags(*(
+            tag for user_id in archived_users for tag in (f'user:{user_id}:calculations', f'user:{user_id}')
+        ))
@@ -0,0 +1,298 @@
+# calculations/management/commands/generate_synthetic_data.py
+
+import itertools
+import math
+import multiprocessing
+import random
+import time
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import Max, Min
+
+from calculations.estimates import apply_estimates, estimate_ratios
+from calculations.models import (
+    ArchivedCalculationBatch, CalculationNote, CostCalculation, IdempotencyKey, UserProfile
+)
+from mysite.bulk import bulk_insert
+from mysite.sharding import id_range_start, shard_for_user, sharding_setting
+from state_data.models import StateData
+
+# Approximate population in millions, so origins follow where people actually live
+STATE_POPULATION = {
+    'AL': 5.1, 'AK': 0.7, 'AZ': 7.4, 'AR': 3.1, 'CA': 39.0, 'CO': 5.9, 'CT': 3.6, 'DE': 1.0,
+    'FL': 22.6, 'GA': 11.0, 'HI': 1.4, 'ID': 2.0, 'IL': 12.5, 'IN': 6.9, 'IA': 3.2, 'KS': 2.9,
+    'KY': 4.5, 'LA': 4.6, 'ME': 1.4, 'MD': 6.2, 'MA': 7.0, 'MI': 10.0, 'MN': 5.7, 'MS': 2.9,
+    'MO': 6.2, 'MT': 1.1, 'NE': 2.0, 'NV': 3.2, 'NH': 1.4, 'NJ': 9.3, 'NM': 2.1, 'NY': 19.6,
+    'NC': 10.8, 'ND': 0.8, 'OH': 11.8, 'OK': 4.1, 'OR': 4.2, 'PA': 13.0, 'RI': 1.1, 'SC': 5.4,
+    'SD': 0.9, 'TN': 7.1, 'TX': 30.5, 'UT': 3.4, 'VT': 0.6, 'VA': 8.7, 'WA': 7.8, 'WV': 1.8,
+    'WI': 5.9, 'WY': 0.6,
+}
+
+SERVICE_BRANCHES = ['army', 'navy', 'air_force', 'marines', 'coast_guard', 'space_force']
+SERVICE_BRANCH_WEIGHTS = [36, 25, 24, 12, 2, 1]
+
+CALCULATION_NAMES = [
+    'Retirement move', 'PCS plan', 'After separation', 'Family budget',
+    'Best case', 'Worst case', 'Downsizing', 'Near the coast',
+]
+
+SYNTHETIC_PASSWORD = 'synthetic-password'
+
+# Inherited by forked workers so users and states are not pickled for every chunk
+_context = None
+
+
+class GenerationContext:
+    """Everything a worker needs to generate calculation chunks"""
+
+    def __init__(self, seed, user_ids, states, destination, batch_size):
+        self.seed = seed
+        self.user_ids = user_ids
+        self.states = states
+        self.destination = destination
+        self.batch_size = batch_size
+        self.cum_weights = list(itertools.accumulate(
+            STATE_POPULATION.get(state.state_code, 1.0) for state in states
+        ))
+        # One set of ratios per origin instead of recomputing them for every row
+        self.ratios = {state.pk: estimate_ratios(state, destination) for state in states}
+
+
+def money(rng, low, high):
+    return Decimal(rng.randrange(int(low * 100), int(high * 100))) / 100
+
+
+def build_calculation(rng, context, index):
+    origin = rng.choices(context.states, cum_weights=context.cum_weights)[0]
+    # A few heavy users own most calculations, like in production
+    user_id = context.user_ids[int(len(context.user_ids) * rng.random() ** 3)]
+    housing = origin.housing_index / 100
+    calculation = CostCalculation(
+        user_id=user_id,
+        calculation_name=f'{rng.choice(CALCULATION_NAMES)} {index}',
+        origin_state_id=origin.pk,
+        destination_state_id=context.destination.pk,
+        current_rent=money(rng, 700 * housing, 2600 * housing),
+        current_utilities=money(rng, 90, 380),
+        current_groceries=money(rng, 250, 1100),
+        current_transportation=money(rng, 120, 750),
+        current_healthcare=money(rng, 0, 600),
+        current_entertainment=money(rng, 0, 500),
+        gross_annual_income=Decimal(round(rng.lognormvariate(math.log(65000), 0.35), 2)).quantize(Decimal('0.01')),
+        military_retirement_income=money(rng, 12000, 48000) if rng.random() < 0.3 else Decimal('0.00'),
+        disability_compensation_income=money(rng, 2000, 45000) if rng.random() < 0.25 else Decimal('0.00'),
+        is_favorite=rng.random() < 0.08,
+    )
+    apply_estimates(calculation, context.ratios[origin.pk])
+    return calculation
+
+
+def generate_calculation_chunk(job):
+    """Insert one chunk of calculations; the chunk number alone decides its contents"""
+    chunk, start, count = job
+    rng = random.Random(f'{_context.seed}:calculations:{chunk}')
+    by_shard = {}
+    for index in range(start, start + count):
+        calculation = build_calculation(rng, _context, index)
+        by_shard.setdefault(shard_for_user(calculation.user_id), []).append(calculation)
+    return sum(
+        bulk_insert(CostCalculation, calculations, _context.batch_size, using=alias)
+        for alias, calculations in by_shard.items()
+    )
+
+
+def generate_note_chunk(job):
+    """Add notes to roughly ``ratio`` of the calculations on shard ``alias`` with pk in [low, high)"""
+    alias, low, high, (first_user_id, last_user_id), ratio = job
+    threshold = int(ratio * 1000)
+    pks = CostCalculation.objects.using(alias).filter(
+        pk__gte=low, pk__lt=high, user_id__gte=first_user_id, user_id__lte=last_user_id,
+    ).values_list('pk', flat=True)
+    notes = [
+        CalculationNote(calculation_id=pk, note=f'Synthetic note for calculation {pk}')
+        # Deterministic per row, independent of how the range was split
+        for pk in pks if (pk * 2654435761 + _context.seed) % 1000 < threshold
+    ]
+    return bulk_insert(CalculationNote, notes, _context.batch_size, using=alias)
+
+
+def id_ranges(ids):
+    """Sorted ``ids`` as (first, last) runs of consecutive values"""
+    ranges = []
+    for pk in ids:
+        if ranges and pk == ranges[-1][1] + 1:
+            ranges[-1][1] = pk
+        else:
+            ranges.append([pk, pk])
+    return [tuple(run) for run in ranges]
+
+
+class Command(BaseCommand):
+    help = 'Generate deterministic synthetic users, profiles, calculations and notes for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--calculations', type=int, default=10000)
+        parser.add_argument('--notes-ratio', type=float, default=0.1,
+                            help='fraction of calculations that get a note')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--prefix', default='synthetic',
+                            help='username prefix; generated users are <prefix>-<n>')
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--chunk-size', type=int, default=100000,
+                            help='calculations per parallel job')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='parallel processes (default: CPU count on PostgreSQL, 1 elsewhere)')
+        parser.add_argument('--clear', action='store_true',
+                            help='delete users with this prefix (and their data) first; '
+                                 'run rebuild_percentile_sketches afterwards')
+
+    def handle(self, *args, **options):
+        global _context
+
+        states = list(StateData.objects.order_by('state_code'))
+        destination = next((state for state in states if state.state_code == 'ME'), None)
+        if destination is None:
+            raise CommandError('No state data found; run populate_states first')
+
+        prefix = options['prefix']
+        generated = User.objects.filter(username__startswith=f'{prefix}-')
+        if options['clear']:
+            self.clear(generated, options['batch_size'])
+        elif generated.exists():
+            raise CommandError(f'Users named {prefix}-* already exist; pass --clear or another --prefix')
+
+        workers = options['workers']
+        if workers is None:
+            workers = multiprocessing.cpu_count() if connections['default'].vendor == 'postgresql' else 1
+
+        user_ids = self.create_users(options)
+        _context = GenerationContext(options['seed'], user_ids, states, destination, options['batch_size'])
+
+        # Each user's rows go to their shard, so note ranges are tracked per shard
+        shards = sharding_setting('SHARDS')
+        last_pks = {alias: self.last_pk(alias) for alias in shards}
+        total, chunk_size = options['calculations'], options['chunk_size']
+        jobs = [
+            (chunk, start, min(chunk_size, total - start))
+            for chunk, start in enumerate(range(0, total, chunk_size))
+        ]
+        self.run_jobs('calculations', generate_calculation_chunk, jobs, workers)
+
+        if options['notes_ratio'] > 0:
+            step = max(chunk_size, 1)
+            jobs = []
+            for alias in shards:
+                last_pk, new_last_pk = last_pks[alias], self.last_pk(alias)
+                jobs.extend(
+                    (alias, low, min(low + step, new_last_pk + 1), (user_ids[0], user_ids[-1]), options['notes_ratio'])
+                    for low in range(last_pk + 1, new_last_pk + 1, step)
+                )
+            if jobs:
+                self.run_jobs('notes', generate_note_chunk, jobs, workers)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Done. Synthetic users log in as {prefix}-<n> with password "{SYNTHETIC_PASSWORD}".'
+        ))
+        # Bulk inserts and deletes send no signals, so the percentile sketches have not seen any of this
+        self.stdout.write(self.style.WARNING(
+            'Run rebuild_percentile_sketches to count the synthetic calculations in the percentile sketches.'
+        ))
+
+    def clear(self, generated, batch_size):
+        """
+        Delete the synthetic users and everything they own without loading it.
+
+        Calculations, their notes and archived batches are deleted with raw
+        DELETEs on every shard, in calculation id windows; post_delete signals
+        would otherwise fetch every row and take sketch counts away for rows
+        that were bulk-loaded and never counted. Profiles and idempotency keys
+        go the same way; the users themselves, now owning little, are deleted
+        normally so tokens and shard assignments are cleaned up with signals.
+        """
+        started = time.perf_counter()
+        user_ids = list(generated.order_by('pk').values_list('pk', flat=True))
+        ranges = id_ranges(user_ids)
+        deleted = 0
+        for alias in sharding_setting('SHARDS'):
+            calculations = CostCalculation._base_manager.using(alias)
+            notes = CalculationNote._base_manager.using(alias)
+            batches = ArchivedCalculationBatch._base_manager.using(alias)
+            for first, last in ranges:
+                owned = calculations.filter(user_id__gte=first, user_id__lte=last)
+                bounds = owned.aggregate(low=Min('pk'), high=Max('pk'))
+                for low in range(bounds['low'] or 0, (bounds['high'] or -1) + 1, batch_size):
+                    with transaction.atomic(using=alias):
+                        deleted += notes.filter(
+                            calculation_id__gte=low, calculation_id__lt=low + batch_size,
+                            calculation__user_id__gte=first, calculation__user_id__lte=last,
+                        )._raw_delete(alias)
+                        deleted += owned.filter(pk__gte=low, pk__lt=low + batch_size)._raw_delete(alias)
+                deleted += batches.filter(user_id__gte=first, user_id__lte=last)._raw_delete(alias)
+
+        for first, last in ranges:
+            for model in (UserProfile, IdempotencyKey):
+                deleted += model._base_manager.filter(user_id__gte=first, user_id__lte=last)._raw_delete('default')
+        for start in range(0, len(user_ids), batch_size):
+            deleted += User.objects.filter(pk__in=user_ids[start:start + batch_size]).delete()[0]
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {deleted} existing synthetic rows in {time.perf_counter() - started:.1f}s'
+        ))
+
+    def last_pk(self, alias):
+        """Highest calculation id on ``alias``, or just below the shard's id range when it has none"""
+        last = CostCalculation.objects.using(alias).aggregate(last=Max('pk'))['last']
+        return max(last or 0, id_range_start(alias))
+
+    def create_users(self, options):
+        rng = random.Random(f"{options['seed']}:users")
+        prefix, batch_size = options['prefix'], options['batch_size']
+        password = make_password(SYNTHETIC_PASSWORD)  # hashing once, not per user
+
+        started = time.perf_counter()
+        users = [
+            User(username=f'{prefix}-{index}', email=f'{prefix}-{index}@example.com', password=password)
+            for index in range(options['users'])
+        ]
+        bulk_insert(User, users, batch_size)
+        user_ids = list(
+            User.objects.filter(username__startswith=f'{prefix}-').order_by('pk').values_list('pk', flat=True)
+        )
+
+        states = list(StateData.objects.values_list('pk', flat=True))
+        profiles = []
+        for user_id in user_ids:
+            disabled = rng.random() < 0.3
+            profiles.append(UserProfile(
+                user_id=user_id,
+                is_veteran=rng.random() < 0.9,
+                service_branch=rng.choices(SERVICE_BRANCHES, weights=SERVICE_BRANCH_WEIGHTS)[0],
+                current_state_id=rng.choice(states),
+                receives_disability_compensation=disabled,
+                disability_rating=rng.randrange(10, 101, 10) if disabled else None,
+                receives_military_retirement=rng.random() < 0.3,
+            ))
+        bulk_insert(UserProfile, profiles, batch_size)
+        self.report('users and profiles', len(user_ids), started)
+        return user_ids
+
+    def run_jobs(self, label, func, jobs, workers):
+        started = time.perf_counter()
+        if workers > 1 and len(jobs) > 1:
+            # Forked workers must open their own database connections
+            connections.close_all()
+            with multiprocessing.get_context('fork').Pool(workers) as pool:
+                rows = sum(pool.imap_unordered(func, jobs))
+        else:
+            rows = sum(func(job) for job in jobs)
+        self.report(label, rows, started)
+
+    def report(self, label, rows, started):
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {rows} {label} in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:.0f} rows/s)'
+        ))
@@ -0,0 +1,36 @@
+# calculations/management/commands/prune_idempotency_keys.py
+"""
+Delete stored Idempotency-Key responses older than IDEMPOTENCY['TTL'] (see
+mysite/idempotency.py), and claims abandoned for longer than LOCK_TIMEOUT.
+
+Expired rows are already ignored and replaced when their key comes back;
+this only keeps the table from growing. Run it daily or so.
+"""
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from mysite.idempotency import get_keys, idempotency_setting
+
+
+class Command(BaseCommand):
+    help = 'Delete expired Idempotency-Key responses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='count what would be deleted')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        expired = get_keys().filter(
+            Q(status_code__isnull=False, created_at__lt=now - timedelta(seconds=idempotency_setting('TTL'))) |
+            Q(status_code__isnull=True, created_at__lt=now - timedelta(seconds=idempotency_setting('LOCK_TIMEOUT')))
+        )
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'Would delete {expired.count()} expired idempotency key(s)'))
+            return
+        deleted, _ = expired.delete()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired idempotency key(s)'))
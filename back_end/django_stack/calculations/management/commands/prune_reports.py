@@ -0,0 +1,51 @@
+# calculations/management/commands/prune_reports.py
+"""
+Delete rendered reports (MEDIA_ROOT/reports, see calculations/reports.py)
+not rendered in --days days.
+
+Reports are content-addressed, so edited calculations and state data leave
+their old files behind. A pruned report that is still wanted is simply
+rendered again on its next download.
+"""
+
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from calculations.reports import REPORTS_DIR
+
+
+class Command(BaseCommand):
+    help = 'Delete rendered calculation reports older than N days'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='delete reports rendered longer ago than this')
+        parser.add_argument('--dry-run', action='store_true', help='count what would be deleted')
+
+    def handle(self, *args, **options):
+        if options['days'] < 0:
+            raise CommandError('--days must not be negative')
+        root = Path(settings.MEDIA_ROOT) / REPORTS_DIR
+        cutoff = time.time() - options['days'] * 86400
+        deleted = freed = 0
+
+        for path in root.glob('*/*') if root.is_dir() else ():
+            stat = path.stat()
+            if stat.st_mtime >= cutoff:
+                continue
+            deleted += 1
+            freed += stat.st_size
+            if not options['dry_run']:
+                path.unlink(missing_ok=True)
+
+        if not options['dry_run']:
+            for directory in root.glob('*') if root.is_dir() else ():
+                if directory.is_dir() and not any(directory.iterdir()):
+                    directory.rmdir()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Would delete' if options['dry_run'] else 'Deleted'} {deleted} report(s) "
+            f'({freed / 1024:.0f} KiB) rendered before {time.strftime("%Y-%m-%d", time.localtime(cutoff))}'
+        ))
@@ -0,0 +1,41 @@
+# calculations/management/commands/purge_expired_tokens.py
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from rest_framework.authtoken.models import Token
+
+from calculations.authentication import last_seen_buffer, token_expiry_cutoff
+
+class Command(BaseCommand):
+    help = 'Delete auth tokens that have not been used within TOKEN_AUTH["EXPIRY"] seconds'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report how many tokens would be deleted',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = token_expiry_cutoff()
+        if cutoff is None:
+            self.stdout.write(self.style.WARNING('Token expiry is disabled, nothing to purge.'))
+            return
+
+        # Write out any last-seen timestamps this process is still holding
+        last_seen_buffer.flush()
+
+        expired = Token.objects.filter(
+            Q(activity__last_seen__lt=cutoff) |
+            Q(activity__isnull=True, created__lt=cutoff)
+        )
+
+        if options['dry_run']:
+            self.stdout.write(f'{expired.count()} expired tokens would be deleted (cutoff {cutoff:%Y-%m-%d %H:%M:%S}).')
+            return
+
+        _, deleted_by_model = expired.delete()
+        deleted = deleted_by_model.get(Token._meta.label, 0)
+        self.stdout.write(
+            self.style.SUCCESS(f'Deleted {deleted} expired tokens (cutoff {cutoff:%Y-%m-%d %H:%M:%S}).')
+        )
@@ -0,0 +1,194 @@
+# calculations/management/commands/rebalance_shards.py
+"""
+Move users' calculations, notes and archived batches between shards.
+
+Adding a shard, in three steps:
+
+1. ``rebalance_shards --pin-for default,shard1,shard2`` (the new list) while
+   the old list is still deployed: users whose hashed shard would change
+   are pinned in the directory to where their rows are now.
+2. Deploy the new DATABASE_SHARDS, ``migrate --database=shard2`` and
+   ``sync_shards``.
+3. ``rebalance_shards`` moves those pinned users to their hashed shard (in
+   batches with ``--limit``) and drops their pins.
+
+``--user ID --to ALIAS`` moves one user, e.g. off a hot shard; they stay
+there until moved again.
+
+A move copies the rows, switches the directory, waits ``--grace`` seconds
+for every worker to pick up the switch (they re-read the directory at
+least every DIRECTORY_TTL seconds, see mysite/sharding.py) and for requests
+that looked up the old shard to finish, copies whatever they changed, then
+deletes the rows from the old shard. The grace period may not be shorter
+than DIRECTORY_TTL; make it longer than your slowest request on top.
+"""
+
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from calculations.models import ArchivedCalculationBatch, CalculationNote, CostCalculation, UserShard
+from mysite.response_cache import invalidate_tags
+from mysite.sharding import (
+    get_shard_directory, hashed_shard, insert_rows, invalidate_shard_directory, sharding_setting
+)
+
+
+def copy_user_rows(user_id, source, target, since=None, copied=()):
+    """
+    Copy a user's rows from ``source`` to ``target``, replacing any already
+    there. With ``since``, only calculations not in ``copied`` or updated
+    after it, and notes created after it, are copied. Returns the ids of the
+    calculations on the source.
+    """
+    calculations = list(CostCalculation._base_manager.using(source).filter(user_id=user_id))
+    on_source = {calculation.pk for calculation in calculations}
+    notes = CalculationNote._base_manager.using(source).filter(calculation__user_id=user_id)
+    if since is not None:
+        calculations = [c for c in calculations if c.pk not in copied or c.updated_at >= since]
+        changed = [calculation.pk for calculation in calculations]
+        notes = notes.filter(Q(calculation_id__in=changed) | Q(created_at__gte=since))
+    notes = list(notes)
+
+    with transaction.atomic(using=target):
+        target_notes = CalculationNote._base_manager.using(target)
+        target_calculations = CostCalculation._base_manager.using(target)
+        if since is None:
+            target_notes.filter(calculation__user_id=user_id)._raw_delete(target)
+            target_calculations.filter(user_id=user_id)._raw_delete(target)
+        else:
+            # Changed since the first pass, or deleted from the source since then
+            replaced = changed + [pk for pk in copied if pk not in on_source]
+            target_notes.filter(calculation_id__in=replaced)._raw_delete(target)
+            target_notes.filter(pk__in=[note.pk for note in notes])._raw_delete(target)
+            target_calculations.filter(pk__in=replaced)._raw_delete(target)
+        insert_rows(CostCalculation, calculations, target)
+        insert_rows(CalculationNote, notes, target)
+
+        # Archived batches are few and only change when archiving or restoring, so always copied whole
+        target_batches = ArchivedCalculationBatch._base_manager.using(target).filter(user_id=user_id)
+        target_batches._raw_delete(target)
+        insert_rows(
+            ArchivedCalculationBatch,
+            list(ArchivedCalculationBatch._base_manager.using(source).filter(user_id=user_id)),
+            target,
+        )
+    return on_source
+
+
+def delete_user_rows(user_id, alias):
+    with transaction.atomic(using=alias):
+        CalculationNote._base_manager.using(alias).filter(calculation__user_id=user_id)._raw_delete(alias)
+        CostCalculation._base_manager.using(alias).filter(user_id=user_id)._raw_delete(alias)
+        ArchivedCalculationBatch._base_manager.using(alias).filter(user_id=user_id)._raw_delete(alias)
+
+
+class Command(BaseCommand):
+    help = "Move users' calculations between shards, or pin users ahead of a change to the shard list"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pin-for', metavar='ALIASES',
+                            help='comma-separated shard list about to be deployed; pin users it would rehome')
+        parser.add_argument('--user', type=int, help='move only this user (with --to)')
+        parser.add_argument('--to', metavar='ALIAS', help='shard to move --user to')
+        parser.add_argument('--limit', type=int, default=None, help='move at most this many pinned users')
+        parser.add_argument('--grace', type=float, default=None,
+                            help='seconds to let workers see the move and in-flight requests finish before the '
+                                 'catch-up copy (default: DIRECTORY_TTL + 2, at least DIRECTORY_TTL)')
+        parser.add_argument('--dry-run', action='store_true', help='report moves without making them')
+
+    def handle(self, *args, **options):
+        shards = sharding_setting('SHARDS')
+        if options['pin_for']:
+            return self.pin(shards, [alias.strip() for alias in options['pin_for'].split(',') if alias.strip()], options)
+
+        directory_ttl = sharding_setting('DIRECTORY_TTL')
+        if options['grace'] is None:
+            options['grace'] = directory_ttl + 2.0
+        elif options['grace'] < directory_ttl:
+            raise CommandError(
+                f'--grace must be at least DIRECTORY_TTL ({directory_ttl}s): until then workers may still '
+                f'route to the old shard, whose rows would be deleted under them'
+            )
+
+        directory = get_shard_directory()
+        if options['user'] is not None:
+            if not options['to']:
+                raise CommandError('--user needs --to')
+            self.check_aliases([options['to']], shards)
+            if not User.objects.filter(pk=options['user']).exists():
+                raise CommandError(f"User {options['user']} does not exist")
+            moves = [(options['user'], directory.shard_for(options['user']), options['to'])]
+        else:
+            pinned = UserShard.objects.filter(rehome=True).order_by('user_id').values_list('user_id', 'alias')
+            moves = [
+                (user_id, alias, hashed_shard(user_id, shards))
+                for user_id, alias in pinned
+                if alias != hashed_shard(user_id, shards)
+            ][:options['limit']]
+            # Pins that already match the hashed shard are no longer needed
+            stale = [user_id for user_id, alias in pinned if alias == hashed_shard(user_id, shards)]
+            if stale and not options['dry_run']:
+                UserShard.objects.filter(user_id__in=stale).delete()
+
+        started = time.perf_counter()
+        for user_id, source, target in moves:
+            if options['dry_run']:
+                self.stdout.write(f'Would move user {user_id} from {source} to {target}')
+            elif source != target:
+                rows = self.move(user_id, source, target, shards, options['grace'])
+                self.stdout.write(f'Moved user {user_id} ({rows} calculations) from {source} to {target}')
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Would move' if options['dry_run'] else 'Moved'} {len(moves)} user(s) "
+            f'in {time.perf_counter() - started:.1f}s'
+        ))
+
+    def move(self, user_id, source, target, shards, grace):
+        started = timezone.now()
+        copied = copy_user_rows(user_id, source, target)
+
+        if target == hashed_shard(user_id, shards):
+            UserShard.objects.filter(user_id=user_id).delete()
+        else:
+            UserShard.objects.update_or_create(user_id=user_id, defaults={'alias': target, 'rehome': False})
+
+        # Workers route to the old shard until they re-read the directory, and
+        # requests that resolved it before then may still write there
+        time.sleep(grace)
+        copy_user_rows(user_id, source, target, since=started, copied=copied)
+        delete_user_rows(user_id, source)
+        invalidate_tags(f'user:{user_id}:calculations', f'user:{user_id}')
+        return len(copied)
+
+    def pin(self, shards, new_shards, options):
+        if new_shards[:len(shards)] != shards:
+            raise CommandError(f"The new list must start with the current one: {','.join(shards)}")
+
+        directory = get_shard_directory()
+        pins = []
+        for user_id in User.objects.values_list('pk', flat=True).iterator(chunk_size=10000):
+            if user_id in directory.placements:
+                continue
+            current = hashed_shard(user_id, shards)
+            if hashed_shard(user_id, new_shards) != current:
+                pins.append(UserShard(user_id=user_id, alias=current, rehome=True))
+
+        if not options['dry_run']:
+            UserShard.objects.bulk_create(pins, batch_size=1000, ignore_conflicts=True)
+            # bulk_create sends no signals
+            invalidate_shard_directory()
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Would pin' if options['dry_run'] else 'Pinned'} {len(pins)} user(s) to their current shard"
+        ))
+
+    def check_aliases(self, aliases, shards):
+        for alias in aliases:
+            if alias not in settings.DATABASES:
+                raise CommandError(f'{alias} is not in DATABASES')
+            if alias not in shards:
+                raise CommandError(f'{alias} is not in DATABASE_SHARDING["SHARDS"]')
@@ -0,0 +1,65 @@
+# calculations/management/commands/rebuild_percentile_sketches.py
+"""
+Recount every expense percentile sketch (see calculations/percentiles.py)
+from the calculations on every shard, archived ones included.
+
+Needed after bulk loads that skip model signals (generate_synthetic_data)
+and to recover changes a process buffered but never flushed. Changes other
+processes have buffered while the rebuild reads may be counted twice, so
+run it when writes are quiet.
+"""
+
+import time
+from collections import Counter, defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from calculations.archive import unpack
+from calculations.models import EXPENSE_FIELDS, ArchivedCalculationBatch, CostCalculation, ExpenseSketch
+from calculations.percentiles import CATEGORIES, SKETCH_TAG, QuantileSketch, bucket_index
+from mysite.response_cache import invalidate_tags
+from mysite.sharding import sharding_setting
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the expense percentile sketches from all calculations'
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        counts = defaultdict(Counter)
+        totals = {'calculations': 0, 'archived': 0}
+
+        def count(values):
+            origin_state_id, *amounts = values
+            for category, amount in zip(CATEGORIES, amounts):
+                counts[origin_state_id, category][bucket_index(amount)] += 1
+
+        columns = ['origin_state_id', *EXPENSE_FIELDS.values()]
+        for alias in sharding_setting('SHARDS'):
+            rows = CostCalculation._base_manager.using(alias).values_list(*columns)
+            for values in rows.iterator(chunk_size=5000):
+                count(values)
+                totals['calculations'] += 1
+            batches = ArchivedCalculationBatch._base_manager.using(alias).values_list('payload', flat=True)
+            for payload in batches.iterator(chunk_size=100):
+                calculations, _ = unpack(payload)
+                for calculation in calculations:
+                    count(calculation.sketched_values())
+                    totals['archived'] += 1
+
+        sketches = []
+        for (origin_state_id, category), buckets in counts.items():
+            sketch = QuantileSketch({index: n for index, n in buckets.items() if index is not None}, buckets[None])
+            sketches.append(sketch.to_row(ExpenseSketch(origin_state_id=origin_state_id, category=category)))
+        with transaction.atomic(using='default'):
+            ExpenseSketch.objects.all().delete()
+            ExpenseSketch.objects.bulk_create(sketches, batch_size=500)
+        invalidate_tags(SKETCH_TAG)
+
+        stored = sum(len(sketch.buckets) for sketch in sketches)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {len(sketches)} sketches from {totals['calculations']} calculations and "
+            f"{totals['archived']} archived ones ({stored / 1024:.1f} KiB of buckets) "
+            f'in {time.perf_counter() - started:.1f}s'
+        ))
@@ -0,0 +1,42 @@
+# calculations/management/commands/sync_shards.py
+"""
+Prepare every calculation shard after ``migrate --database=<alias>``.
+
+Sets each shard's id sequences to the start of its range and copies the
+reference tables (StateData, Region) over from ``default``. Safe to re-run;
+afterwards signals and ingest_regions keep the copies current.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from mysite.sharding import (
+    id_range_start, reference_models, replicate_reference_rows, reserve_id_range, sharding_setting
+)
+
+
+class Command(BaseCommand):
+    help = 'Reserve id ranges on the calculation shards and copy reference data to them'
+
+    def handle(self, *args, **options):
+        shards = sharding_setting('SHARDS')
+        missing = [alias for alias in shards if alias not in settings.DATABASES]
+        if missing:
+            raise CommandError(f"Shards not in DATABASES: {', '.join(missing)}")
+        if len(shards) == 1:
+            self.stdout.write('Only the default database is configured; nothing to do')
+            return
+
+        started = time.perf_counter()
+        for alias in shards[1:]:
+            for table in reserve_id_range(alias):
+                self.stdout.write(f'{alias}: new {table} ids start at {id_range_start(alias) + 1}')
+        for model in reference_models():
+            replicate_reference_rows(model)
+            self.stdout.write(f'Copied {model._meta.label} to {len(shards) - 1} shard(s)')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Synced {len(shards) - 1} shard(s) in {time.perf_counter() - started:.1f}s'
+        ))
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authtoken', '0004_alter_tokenproxy_options'),
+        ('calculations', '0002_alter_costcalculation_destination_state_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthTokenActivity',
+            fields=[
+                ('token', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='activity', serialize=False, to='authtoken.token')),
+                ('last_seen', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Auth Token Activity',
+                'verbose_name_plural': 'Auth Token Activity',
+            },
+        ),
+    ]
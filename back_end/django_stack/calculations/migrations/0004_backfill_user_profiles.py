@@ -0,0 +1,28 @@
+# Backfill profiles for users created before profiles were created automatically
+
+from django.conf import settings
+from django.db import migrations
+
+
+def create_missing_profiles(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    UserProfile = apps.get_model('calculations', 'UserProfile')
+    db_alias = schema_editor.connection.alias
+
+    missing = User.objects.using(db_alias).filter(profile__isnull=True).values_list('pk', flat=True)
+    UserProfile.objects.using(db_alias).bulk_create(
+        (UserProfile(user_id=user_id) for user_id in missing.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculations', '0003_authtokenactivity'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(create_missing_profiles, migrations.RunPython.noop),
+    ]
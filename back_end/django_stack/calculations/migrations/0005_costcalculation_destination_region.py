@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculations', '0004_backfill_user_profiles'),
+        ('state_data', '0002_region'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='costcalculation',
+            name='destination_region',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='destination_calculations', to='state_data.region'),
+        ),
+    ]
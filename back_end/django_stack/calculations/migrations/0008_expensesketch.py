@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculations', '0007_archivedcalculationbatch'),
+        ('state_data', '0003_state_centroids'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExpenseSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(max_length=20)),
+                ('count', models.PositiveBigIntegerField(default=0)),
+                ('zero_count', models.PositiveBigIntegerField(default=0)),
+                ('min_index', models.IntegerField(default=0)),
+                ('buckets', models.BinaryField(default=b'')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('origin_state', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='expense_sketches', to='state_data.statedata')),
+            ],
+            options={
+                'verbose_name': 'Expense Sketch',
+                'verbose_name_plural': 'Expense Sketches',
+                'constraints': [models.UniqueConstraint(fields=('origin_state', 'category'), name='unique_expense_sketch')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Backfill token activity for tokens issued before sliding expiry existed
+
+from django.db import migrations
+from django.utils import timezone
+
+
+def start_expiry_clocks(apps, schema_editor):
+    """Count existing tokens as seen now; otherwise every token older than EXPIRY dies on deploy"""
+    Token = apps.get_model('authtoken', 'Token')
+    AuthTokenActivity = apps.get_model('calculations', 'AuthTokenActivity')
+    db_alias = schema_editor.connection.alias
+
+    now = timezone.now()
+    missing = Token.objects.using(db_alias).filter(activity__isnull=True).values_list('pk', flat=True)
+    AuthTokenActivity.objects.using(db_alias).bulk_create(
+        (AuthTokenActivity(token_id=key, last_seen=now) for key in missing.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authtoken', '0004_alter_tokenproxy_options'),
+        ('calculations', '0008_expensesketch'),
+    ]
+
+    operations = [
+        migrations.RunPython(start_expiry_clocks, migrations.RunPython.noop),
+    ]
@@ -2,9 +2,26 @@
 
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.authtoken.models import Token
 from django.core.validators import MinValueValidator, MaxValueValidator
 from decimal import Decimal, ROUND_HALF_UP
-from state_data.models import StateData
+import logging
+import operator
+import time
+from .estimates import apply_estimates, estimate_ratios
+from mysite.metrics import registry
+from mysite.sharding import ShardedQuerySet
+from state_data.catalog import default_destination
+from state_data.models import Region, StateData
+
+logger = logging.getLogger(__name__)
+
+calculation_runs = registry.counter(
+    'calculation_engine_runs_total', 'calculate_maine_estimates runs by outcome (ok or fallback)', ['outcome'])
+calculation_duration = registry.histogram(
+    'calculation_engine_duration_seconds', 'Time spent in calculate_maine_estimates',
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1))
 
 class UserProfile(models.Model):
     """Extended user profile for veteran-specific information"""
@@ -56,10 +73,23 @@ class UserProfile(models.Model):
         return f"{self.user.username} Profile"
 
 
+# Expense categories users can compare themselves on, and the fields they come from
+EXPENSE_FIELDS = {
+    'rent': 'current_rent',
+    'utilities': 'current_utilities',
+    'groceries': 'current_groceries',
+    'transportation': 'current_transportation',
+    'healthcare': 'current_healthcare',
+    'entertainment': 'current_entertainment',
+}
+SKETCHED_ATTNAMES = frozenset(['origin_state_id', *EXPENSE_FIELDS.values()])
+_sketched_values = operator.attrgetter('origin_state_id', *EXPENSE_FIELDS.values())
+
 class CostCalculation(models.Model):
     """Model to store user's cost of living calculations"""
     
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='calculations')
+    # Users stay on default while calculations live on their shard (mysite.sharding)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='calculations', db_constraint=False)
     calculation_name = models.CharField(
         max_length=100, 
         help_text="Name for this calculation scenario"
@@ -78,6 +108,14 @@ class CostCalculation(models.Model):
         null=True,
         blank=True
     )
+    # Optional county or metro area within destination_state; its indices replace the state's
+    destination_region = models.ForeignKey(
+        Region,
+        on_delete=models.SET_NULL,
+        related_name='destination_calculations',
+        null=True,
+        blank=True
+    )
     
     # Current expenses (monthly amounts)
     current_rent = models.DecimalField(
@@ -167,14 +205,29 @@ class CostCalculation(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     is_favorite = models.BooleanField(default=False)
     
+    objects = ShardedQuerySet.as_manager()
+    
     class Meta:
         verbose_name = "Cost Calculation"
         verbose_name_plural = "Cost Calculations"
         ordering = ['-updated_at']
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # What the percentile sketches count for this row, to diff against on save and delete
+        instance._sketched_values = instance.sketched_values()
+        return instance
+    
     def __str__(self):
         return f"{self.user.username} - {self.calculation_name}"
     
+    def sketched_values(self):
+        """(origin_state_id, *EXPENSE_FIELDS values) for the percentile sketches, or None if any is deferred"""
+        if not SKETCHED_ATTNAMES.issubset(self.__dict__):
+            return None
+        return _sketched_values(self)
+    
     @property
     def total_current_monthly_expenses(self):
         """Calculate total current monthly expenses"""
@@ -189,8 +242,12 @@ class CostCalculation(models.Model):
     
     def calculate_maine_estimates(self):
         """Calculate estimated Maine costs based on cost of living indices"""
+        start = time.perf_counter()
+        outcome = 'ok'
         try:
-            # Get Maine state data - set as destination if not already set
+            # Default to Maine, from the in-memory catalog when it has the row
+            if not self.destination_state:
+                self.destination_state = default_destination()
             if not self.destination_state:
                 maine_state, created = StateData.objects.get_or_create(
                     state_code='ME',
@@ -210,65 +267,26 @@ class CostCalculation(models.Model):
                 )
                 self.destination_state = maine_state
             
-            maine_data = self.destination_state
-            origin_data = self.origin_state
-            
-            # Convert float indices to Decimal for proper calculation
-            # Calculate housing costs
-            housing_ratio = Decimal(str(maine_data.housing_index)) / Decimal(str(origin_data.housing_index))
-            self.estimated_maine_rent = (self.current_rent * housing_ratio).quantize(
-                Decimal('0.01'), rounding=ROUND_HALF_UP
-            )
-            
-            # Calculate utilities
-            utilities_ratio = Decimal(str(maine_data.utilities_index)) / Decimal(str(origin_data.utilities_index))
-            self.estimated_maine_utilities = (self.current_utilities * utilities_ratio).quantize(
-                Decimal('0.01'), rounding=ROUND_HALF_UP
-            )
-            
-            # Calculate groceries
-            grocery_ratio = Decimal(str(maine_data.grocery_index)) / Decimal(str(origin_data.grocery_index))
-            self.estimated_maine_groceries = (self.current_groceries * grocery_ratio).quantize(
-                Decimal('0.01'), rounding=ROUND_HALF_UP
-            )
-            
-            # Calculate transportation
-            transport_ratio = Decimal(str(maine_data.transportation_index)) / Decimal(str(origin_data.transportation_index))
-            self.estimated_maine_transportation = (self.current_transportation * transport_ratio).quantize(
-                Decimal('0.01'), rounding=ROUND_HALF_UP
-            )
-            
-            # Calculate total savings
-            current_total = self.total_current_monthly_expenses
+            destination = self.destination_region or self.destination_state
+            apply_estimates(self, estimate_ratios(self.origin_state, destination))
             
-            # Calculate Maine total with proper Decimal handling
-            overall_ratio = Decimal(str(maine_data.cost_of_living_index)) / Decimal(str(origin_data.cost_of_living_index))
-            
-            maine_total = (
-                self.estimated_maine_rent +
-                self.estimated_maine_utilities +
-                self.estimated_maine_groceries +
-                self.estimated_maine_transportation +
-                self.current_healthcare +  # Assume healthcare stays the same
-                (self.current_entertainment * overall_ratio).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-            )
-            
-            self.total_monthly_savings = (current_total - maine_total).quantize(
-                Decimal('0.01'), rounding=ROUND_HALF_UP
-            )
-            self.total_annual_savings = (self.total_monthly_savings * 12).quantize(
-                Decimal('0.01'), rounding=ROUND_HALF_UP
-            )
-            
-        except Exception as e:
+        except Exception:
             # Log the error and set default values
-            print(f"Error in calculate_maine_estimates: {str(e)}")
+            outcome = 'fallback'
+            logger.exception('Error in calculate_maine_estimates for calculation %s', self.pk)
             self.estimated_maine_rent = self.current_rent
             self.estimated_maine_utilities = self.current_utilities
             self.estimated_maine_groceries = self.current_groceries
             self.estimated_maine_transportation = self.current_transportation
             self.total_monthly_savings = Decimal('0.00')
             self.total_annual_savings = Decimal('0.00')
+        finally:
+            calculation_runs.labels(outcome).inc()
+            calculation_duration.observe(time.perf_counter() - start)
+
+
+class CalculationNoteQuerySet(ShardedQuerySet):
+    user_lookup = 'calculation__user'
 
 
 class CalculationNote(models.Model):
@@ -282,10 +300,132 @@ class CalculationNote(models.Model):
     note = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = CalculationNoteQuerySet.as_manager()
+    
     class Meta:
         verbose_name = "Calculation Note"
         verbose_name_plural = "Calculation Notes"
         ordering = ['-created_at']
     
     def __str__(self):
-        return f"Note for {self.calculation.calculation_name}"
\ No newline at end of file
+        return f"Note for {self.calculation.calculation_name}"
+
+
+class AuthTokenActivity(models.Model):
+    """Last time an auth token was used, written in batches by CachedTokenAuthentication"""
+    
+    token = models.OneToOneField(
+        Token,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='activity'
+    )
+    last_seen = models.DateTimeField(db_index=True)
+    
+    class Meta:
+        verbose_name = "Auth Token Activity"
+        verbose_name_plural = "Auth Token Activity"
+    
+    def __str__(self):
+        return f"Token activity for user {self.token.user_id}"
+
+
+class ArchivedCalculationBatch(models.Model):
+    """Stale calculations of one user and their notes, compressed together (see calculations/archive.py)"""
+    
+    # Stored on the user's shard, like their calculations
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='archived_calculation_batches',
+        db_constraint=False
+    )
+    first_id = models.BigIntegerField()
+    last_id = models.BigIntegerField()
+    calculation_count = models.PositiveIntegerField()
+    payload = models.BinaryField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    objects = ShardedQuerySet.as_manager()
+    
+    class Meta:
+        verbose_name = "Archived Calculation Batch"
+        verbose_name_plural = "Archived Calculation Batches"
+        indexes = [
+            # Finding the batch that holds an id
+            models.Index(fields=['user', 'last_id'], name='archive_user_last_id'),
+        ]
+    
+    def __str__(self):
+        return f"{self.calculation_count} archived calculations of user {self.user_id}"
+
+
+class UserShard(models.Model):
+    """Shard holding a user's calculations, for users not on the one their id hashes to"""
+    
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='shard'
+    )
+    alias = models.CharField(max_length=50)
+    rehome = models.BooleanField(
+        default=False,
+        help_text="Pinned ahead of a shard list change; rebalance_shards moves the user to their hashed shard"
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = "User Shard"
+        verbose_name_plural = "User Shards"
+    
+    def __str__(self):
+        return f"User {self.user_id} on {self.alias}"
+
+
+class ExpenseSketch(models.Model):
+    """Streaming quantile sketch of one expense category among calculations from one origin state"""
+    
+    origin_state = models.ForeignKey(StateData, on_delete=models.CASCADE, related_name='expense_sketches')
+    category = models.CharField(max_length=20)
+    count = models.PositiveBigIntegerField(default=0)
+    zero_count = models.PositiveBigIntegerField(default=0)
+    # Bucket counts from min_index up, packed and compressed (see calculations/percentiles.py)
+    min_index = models.IntegerField(default=0)
+    buckets = models.BinaryField(default=b'')
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = "Expense Sketch"
+        verbose_name_plural = "Expense Sketches"
+        constraints = [
+            models.UniqueConstraint(fields=['origin_state', 'category'], name='unique_expense_sketch'),
+        ]
+    
+    def __str__(self):
+        return f"{self.category} sketch for state {self.origin_state_id} ({self.count} values)"
+
+
+class IdempotencyKey(models.Model):
+    """A client's Idempotency-Key and the response its first request got (see mysite/idempotency.py)"""
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    # sha256 of the header value, which may be up to MAX_KEY_LENGTH characters
+    key = models.CharField(max_length=64)
+    fingerprint = models.CharField(max_length=64)
+    # Null while the first request is still running
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_data = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    response_headers = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(db_index=True)
+    
+    class Meta:
+        verbose_name = "Idempotency Key"
+        verbose_name_plural = "Idempotency Keys"
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key'),
+        ]
+    
+    def __str__(self):
+        return f"Idempotency key {self.key[:12]} of user {self.user_id}"
@@ -0,0 +1,320 @@
+# calculations/percentiles.py
+"""
+"How do I compare?" percentile ranks from streaming quantile sketches.
+
+For every origin state and expense category (EXPENSE_FIELDS) an
+ExpenseSketch counts the calculations' monthly amounts in logarithmic
+buckets, DDSketch style: bucket ``i`` holds values in (GAMMA**(i-1),
+GAMMA**i], zero has a bucket of its own. Unlike t-digest or KLL, bucket
+counts can be decremented exactly, so edits and deletes keep the sketches
+true without periodic rebuilds, and a sketch stays a few hundred bytes
+however many calculations it covers.
+
+Error bound: a value is only placed to within its bucket, whose bounds are
+a factor GAMMA (about 1.02 for RELATIVE_ACCURACY = 0.01) apart. The
+reported percentile rank of ``v`` (the share of calculations below it,
+counting those in its own bucket as half below) therefore lies between the
+exact ranks of ``v / GAMMA`` and ``v * GAMMA``.
+
+Writes are counted as they commit and buffered per process
+(sketch_buffer); a background thread merges them into the stored sketches
+in one transaction at most FLUSH_INTERVAL seconds later, and whatever is
+still pending is merged at exit (and from gunicorn's worker_exit hook).
+Changes that bypass model signals (bulk inserts such as
+generate_synthetic_data, archiving and shard moves, which only relocate
+rows) are not seen; a buffer lost with a killed process, or bulk-loaded
+data, is made good by ``rebuild_percentile_sketches``, which counts
+archived calculations too. Reads come from an in-process catalog of every sketch,
+reloaded when the ``expense_sketches`` cache tag moves on.
+"""
+
+import atexit
+import logging
+import math
+import os
+import sys
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from mysite.response_cache import invalidate_tags, tag_versions
+from .models import EXPENSE_FIELDS, ExpenseSketch
+
+logger = logging.getLogger(__name__)
+
+CATEGORIES = list(EXPENSE_FIELDS)
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(GAMMA)
+
+SKETCH_TAG = 'expense_sketches'
+
+DEFAULT_PERCENTILE_SKETCHES = {
+    'FLUSH_INTERVAL': 10,  # seconds between merges of buffered changes
+    'MIN_SAMPLE_SIZE': 10,  # fewer calculations than this give no percentile
+}
+
+
+def percentile_setting(name):
+    return getattr(settings, 'PERCENTILE_SKETCHES', {}).get(name, DEFAULT_PERCENTILE_SKETCHES[name])
+
+
+def bucket_index(value):
+    """The bucket holding ``value``; None for zero (and anything below, or too small for a float)"""
+    value = float(value)
+    if value <= 0:
+        return None
+    if not math.isfinite(value):
+        # A Decimal too large for a float ranks with the largest one
+        value = sys.float_info.max
+    return math.ceil(math.log(value) / _LOG_GAMMA)
+
+
+class QuantileSketch:
+    """Bucket counts of one sketch, with the cumulative counts percentile_rank() needs"""
+
+    def __init__(self, buckets=None, zero_count=0):
+        self.buckets = dict(buckets or {})
+        self.zero_count = zero_count
+        self._ranks = None
+
+    def _prepared(self):
+        # Sorted bucket indices, the count below each, and the total
+        if self._ranks is None:
+            indices = sorted(self.buckets)
+            below, running = [], self.zero_count
+            for index in indices:
+                below.append(running)
+                running += self.buckets[index]
+            self._ranks = (indices, below, running)
+        return self._ranks
+
+    @property
+    def count(self):
+        return self._prepared()[2]
+
+    def update(self, deltas):
+        """Apply {bucket index or None: count change}; counts lost with a buffer can only be clamped at zero"""
+        for index, delta in deltas.items():
+            if index is None:
+                self.zero_count = max(self.zero_count + delta, 0)
+            else:
+                count = self.buckets.get(index, 0) + delta
+                if count > 0:
+                    self.buckets[index] = count
+                else:
+                    self.buckets.pop(index, None)
+        self._ranks = None
+
+    def percentile_rank(self, value):
+        """Percentage of counted values below ``value``, those in its bucket counting half; None if empty"""
+        indices, below, total = self._prepared()
+        if not total:
+            return None
+        index = bucket_index(value)
+        if index is None:
+            return 100.0 * (self.zero_count / 2) / total
+        position = bisect_left(indices, index)
+        smaller = below[position] if position < len(indices) else total
+        same = self.buckets.get(index, 0)
+        return 100.0 * (smaller + same / 2) / total
+
+    # Stored as the counts from min_index to the highest bucket, as little-endian uint32s, compressed
+
+    @classmethod
+    def from_row(cls, row):
+        buckets = {}
+        if row.buckets:
+            counts = array('I')
+            counts.frombytes(zlib.decompress(row.buckets))
+            if sys.byteorder == 'big':
+                counts.byteswap()
+            buckets = {row.min_index + offset: count for offset, count in enumerate(counts) if count}
+        return cls(buckets, row.zero_count)
+
+    def to_row(self, row):
+        row.zero_count = self.zero_count
+        row.count = self.count
+        if self.buckets:
+            row.min_index = min(self.buckets)
+            counts = array('I', [0]) * (max(self.buckets) - row.min_index + 1)
+            for index, count in self.buckets.items():
+                counts[index - row.min_index] = count
+            if sys.byteorder == 'big':
+                counts.byteswap()
+            row.buckets = zlib.compress(counts.tobytes())
+        else:
+            row.min_index, row.buckets = 0, b''
+        return row
+
+
+def calculation_deltas(old, new):
+    """{(origin_state_id, category): {bucket: change}} for a row counted as ``old`` now being ``new``"""
+    deltas = defaultdict(Counter)
+    for values, sign in ((old, -1), (new, 1)):
+        if values is None:
+            continue
+        origin_state_id, *amounts = values
+        for category, amount in zip(CATEGORIES, amounts):
+            deltas[origin_state_id, category][bucket_index(amount)] += sign
+    return {key: {index: delta for index, delta in changes.items() if delta} for key, changes in deltas.items()}
+
+
+class SketchBuffer:
+    """
+    Collects committed sketch changes and merges them into the stored
+    sketches in one batch per interval, from a flusher thread started with
+    the first change. close() stops the thread and merges what is left.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._reset()
+
+    def _reset(self):
+        self._pending = defaultdict(Counter)
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._closing = threading.Event()
+        self._thread = None
+
+    def record(self, deltas):
+        """Buffer changes; the flusher thread merges them within ``interval`` seconds"""
+        with self._lock:
+            for key, changes in deltas.items():
+                self._pending[key].update(changes)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sketch-flusher', daemon=True)
+                self._thread.start()
+
+    def _seconds_to_flush(self):
+        return max(self._last_flush + self.interval - time.monotonic(), 0)
+
+    def _run(self):
+        while not self._closing.wait(self._seconds_to_flush()):
+            if self._seconds_to_flush() > 0:
+                continue
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Merging buffered percentile sketch changes failed')
+            finally:
+                # This thread's connections would otherwise stay open between flushes
+                connections.close_all()
+
+    def close(self):
+        """Stop the flusher thread and merge whatever is still pending"""
+        self._closing.set()
+        if self._thread is not None:
+            self._thread.join(2.0)
+        return self.flush()
+
+    def flush(self):
+        """Merge all pending changes into the stored sketches; returns the number of sketches written"""
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(Counter)
+            self._last_flush = time.monotonic()
+        pending = {key: changes for key, changes in pending.items() if any(changes.values())}
+        if not pending:
+            return 0
+
+        try:
+            rows = self._merge(pending)
+        except Exception:
+            # Kept for the next flush rather than lost
+            with self._lock:
+                for key, changes in pending.items():
+                    self._pending[key].update(changes)
+            raise
+        invalidate_tags(SKETCH_TAG)
+        return len(rows)
+
+    def _merge(self, pending):
+        with transaction.atomic(using='default'):
+            ExpenseSketch.objects.bulk_create(
+                [ExpenseSketch(origin_state_id=state_id, category=category) for state_id, category in pending],
+                ignore_conflicts=True,
+            )
+            # Locked, so concurrent flushes from other processes merge one after the other
+            rows = [
+                row for row in ExpenseSketch.objects.select_for_update().filter(
+                    origin_state_id__in={state_id for state_id, _ in pending},
+                    category__in={category for _, category in pending},
+                )
+                if (row.origin_state_id, row.category) in pending
+            ]
+            now = timezone.now()
+            for row in rows:
+                sketch = QuantileSketch.from_row(row)
+                sketch.update(pending[row.origin_state_id, row.category])
+                sketch.to_row(row)
+                row.updated_at = now
+            ExpenseSketch.objects.bulk_update(rows, ['count', 'zero_count', 'min_index', 'buckets', 'updated_at'])
+        return rows
+
+
+sketch_buffer = SketchBuffer(percentile_setting('FLUSH_INTERVAL'))
+# A forked worker starts with an empty buffer and no flusher; the parent keeps (and merges) its own changes
+os.register_at_fork(after_in_child=sketch_buffer._reset)
+atexit.register(sketch_buffer.close)
+
+
+def record_calculation(instance, deleted=False):
+    """Count a saved or deleted calculation's change in the sketches once its transaction commits"""
+    old = getattr(instance, '_sketched_values', None)
+    new = None if deleted else instance.sketched_values()
+    if new is None and not deleted:
+        # Saved with deferred fields: the loaded values stay what is counted
+        return
+    instance._sketched_values = new
+    deltas = calculation_deltas(old, new)
+    if not deltas:
+        return
+
+    transaction.on_commit(lambda: sketch_buffer.record(deltas), using=instance._state.db)
+
+
+class SketchCatalog:
+    """Every stored sketch, keyed by (origin_state_id, category)"""
+
+    def __init__(self, sketches, version):
+        self.sketches = sketches
+        self.version = version
+
+    def percentile(self, origin_state_id, category, value):
+        """(percentile rank or None, sample size) of ``value`` among calculations from the origin state"""
+        sketch = self.sketches.get((origin_state_id, category))
+        if sketch is None:
+            return None, 0
+        count = sketch.count
+        if count < percentile_setting('MIN_SAMPLE_SIZE'):
+            return None, count
+        return sketch.percentile_rank(value), count
+
+
+_catalog = None
+_lock = threading.Lock()
+
+
+def get_sketch_catalog():
+    """The current sketches, reloaded when the ``expense_sketches`` tag has moved on"""
+    global _catalog
+    [version] = tag_versions([SKETCH_TAG])
+    catalog = _catalog
+    if catalog is None or catalog.version != version:
+        with _lock:
+            if _catalog is None or _catalog.version != version:
+                _catalog = SketchCatalog({
+                    (row.origin_state_id, row.category): QuantileSketch.from_row(row)
+                    for row in ExpenseSketch.objects.all()
+                }, version)
+            catalog = _catalog
+    return catalog
@@ -0,0 +1,37 @@
+# calculations/profiles.py
+
+from django.conf import settings
+from django.core.cache import cache
+from mysite.metrics import cache_requests
+
+from .models import UserProfile
+from .serializers import UserProfileSerializer
+
+
+def profile_cache_key(user_id):
+    return f'profile:payload:{user_id}'
+
+
+def get_profile_queryset():
+    """Profiles with the user and current state joined in, as UserProfileSerializer needs them"""
+    return UserProfile.objects.select_related('user', 'current_state')
+
+
+def get_profile_payload(user):
+    """Serialized profile for ``user``, served from cache and built with a single query on a miss"""
+    key = profile_cache_key(user.pk)
+    payload = cache.get(key)
+    cache_requests.labels('profile', 'miss' if payload is None else 'hit').inc()
+    if payload is None:
+        profile = get_profile_queryset().get(user=user)
+        payload = UserProfileSerializer(profile).data
+        cache.set(key, payload, getattr(settings, 'PROFILE_CACHE_TIMEOUT', 300))
+    return payload
+
+
+def invalidate_profile_payload(user_id):
+    cache.delete(profile_cache_key(user_id))
+
+
+def invalidate_profile_payloads(user_ids):
+    cache.delete_many([profile_cache_key(user_id) for user_id in user_ids])
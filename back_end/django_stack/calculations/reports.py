@@ -0,0 +1,369 @@
+# calculations/reports.py
+"""
+Printable relocation reports (HTML and PDF) for a calculation.
+
+A report is content-addressed: report_context() gathers everything it
+shows (the calculation's figures, the states and region it compares, their
+veteran benefits and the current index ratios) and the file is named after
+a hash of that context, under MEDIA_ROOT/reports/. Repeat downloads are
+served straight from the file; editing the calculation or any state data
+the report shows gives it a new name, so nothing has to be invalidated.
+Bump RENDERER_VERSION when the template or the PDF layout changes.
+
+Missing files are rendered by report_rendering_executor, off the request
+thread; concurrent requests for the same report share one render.
+prune_reports removes files that have not been rendered in a while.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import zlib
+from collections import namedtuple
+from pathlib import Path
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.template.loader import render_to_string
+
+from state_data.catalog import default_destination, get_catalog
+from state_data.models import VeteranBenefit
+from .estimates import CENT, estimate_ratios
+from .executors import report_rendering_executor
+
+RENDERER_VERSION = 1
+
+REPORTS_DIR = 'reports'
+
+CONTENT_TYPES = {
+    'html': 'text/html; charset=utf-8',
+    'pdf': 'application/pdf',
+}
+
+Report = namedtuple('Report', ['key', 'path', 'extension', 'context'])
+
+# (label, current expense field, estimated field); healthcare is assumed not to change
+EXPENSES = [
+    ('Housing', 'current_rent', 'estimated_maine_rent'),
+    ('Utilities', 'current_utilities', 'estimated_maine_utilities'),
+    ('Groceries', 'current_groceries', 'estimated_maine_groceries'),
+    ('Transportation', 'current_transportation', 'estimated_maine_transportation'),
+    ('Healthcare', 'current_healthcare', 'current_healthcare'),
+]
+
+INCOME = [
+    ('Gross annual income', 'gross_annual_income'),
+    ('Military retirement income', 'military_retirement_income'),
+    ('VA disability compensation', 'disability_compensation_income'),
+    ('Origin state income tax', 'origin_state_tax'),
+    ('Destination state income tax', 'maine_state_tax'),
+]
+
+BENEFITS = [
+    ('Property tax exemption', 'property_tax_exemption'),
+    ('Property tax exemption amount', 'property_tax_exemption_amount'),
+    ('Military retirement exempt from income tax', 'military_retirement_exempt'),
+    ('VA disability compensation exempt from income tax', 'disability_compensation_exempt'),
+    ('Vehicle registration discount', 'vehicle_registration_discount'),
+    ('Free hunting and fishing licenses', 'hunting_fishing_license_free'),
+    ('Homestead exemption', 'homestead_exemption'),
+]
+
+RATIOS = [
+    ('Housing', 'housing'),
+    ('Utilities', 'utilities'),
+    ('Groceries', 'grocery'),
+    ('Transportation', 'transportation'),
+    ('Overall cost of living', 'overall'),
+]
+
+
+def _money(value):
+    if value is None:
+        return '—'
+    return f'-${-value:,.2f}' if value < 0 else f'${value:,.2f}'
+
+
+def _benefit(benefits, field):
+    if benefits is None:
+        return '—'
+    value = getattr(benefits, field)
+    if isinstance(value, bool):
+        return 'Yes' if value else 'No'
+    return _money(value)
+
+
+def report_context(calculation):
+    """Everything the report shows, as strings, so equal contexts render equal files"""
+    catalog = get_catalog()
+    origin = catalog.by_pk.get(calculation.origin_state_id) or calculation.origin_state
+    destination_state = (
+        catalog.by_pk.get(calculation.destination_state_id) or calculation.destination_state
+        if calculation.destination_state_id else default_destination()
+    )
+    region = calculation.destination_region
+    destination = region or destination_state
+    benefits = {
+        benefit.state_id: benefit
+        for benefit in VeteranBenefit.objects.filter(state_id__in=[origin.pk, destination_state.pk])
+    }
+
+    expenses = [
+        (label, getattr(calculation, current), getattr(calculation, estimated))
+        for label, current, estimated in EXPENSES
+    ]
+    # Entertainment is not stored; it is what the saved destination total leaves over
+    total_current = calculation.total_current_monthly_expenses
+    entertainment = None
+    if calculation.total_monthly_savings is not None and all(estimated is not None for _, _, estimated in expenses):
+        total_destination = total_current - calculation.total_monthly_savings
+        entertainment = (total_destination - sum(estimated for _, _, estimated in expenses)).quantize(CENT)
+    expenses.append(('Entertainment and dining', calculation.current_entertainment, entertainment))
+
+    ratios = estimate_ratios(origin, destination)
+    return {
+        'title': calculation.calculation_name,
+        'origin': origin.state_name,
+        'destination': f'{region.name}, {destination_state.state_name}' if region else destination_state.state_name,
+        'destination_state': destination_state.state_name,
+        'updated': calculation.updated_at.date().isoformat() if calculation.updated_at else '',
+        'expenses': [
+            [label, _money(current), _money(estimated), _money(None if estimated is None else estimated - current)]
+            for label, current, estimated in expenses
+        ],
+        'expense_total': [
+            'Total', _money(total_current),
+            _money(None if calculation.total_monthly_savings is None else total_current - calculation.total_monthly_savings),
+            _money(None if calculation.total_monthly_savings is None else -calculation.total_monthly_savings),
+        ],
+        'savings': [
+            ['Monthly savings', _money(calculation.total_monthly_savings)],
+            ['Annual savings', _money(calculation.total_annual_savings)],
+        ],
+        'income': [
+            [label, _money(getattr(calculation, field))]
+            for label, field in INCOME
+            if getattr(calculation, field) is not None
+        ],
+        'ratios': [
+            [label, f'{getattr(ratios, field):.3f}', f'{(getattr(ratios, field) - 1) * 100:+.1f}%']
+            for label, field in RATIOS
+        ],
+        'benefits': [
+            [label, _benefit(benefits.get(origin.pk), field), _benefit(benefits.get(destination_state.pk), field)]
+            for label, field in BENEFITS
+        ],
+        'benefit_notes': [
+            [state.state_name, benefits[state.pk].notes]
+            for state in (origin, destination_state)
+            if state.pk in benefits and benefits[state.pk].notes
+        ],
+    }
+
+
+def report_key(context, extension):
+    document = json.dumps([RENDERER_VERSION, extension, context], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(document.encode()).hexdigest()
+
+
+def report_path(key, extension):
+    return Path(settings.MEDIA_ROOT) / REPORTS_DIR / key[:2] / f'{key}.{extension}'
+
+
+def prepare_report(calculation, extension):
+    """The Report for ``calculation`` in ``extension`` ('html' or 'pdf'); its file may not exist yet"""
+    context = report_context(calculation)
+    key = report_key(context, extension)
+    return Report(key, report_path(key, extension), extension, context)
+
+
+# PDF: text only, in the base-14 Helvetica fonts, so no PDF library is needed
+
+PAGE_WIDTH, PAGE_HEIGHT, MARGIN = 612, 792, 54
+
+
+def _pdf_string(text):
+    encoded = text.encode('cp1252', 'replace')
+    return encoded.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+class _PdfLayout:
+    """Lays out lines of text cells top to bottom, starting new pages as needed"""
+
+    def __init__(self):
+        self.pages = []
+        self._new_page()
+
+    def _new_page(self):
+        self.stream = []
+        self.pages.append(self.stream)
+        self.y = PAGE_HEIGHT - MARGIN
+
+    def line(self, cells, size=10, bold=False, before=4):
+        """``cells`` are (x offset from the margin, text) pairs"""
+        if self.y - size - before < MARGIN:
+            self._new_page()
+        self.y -= size + before
+        font = b'/F2' if bold else b'/F1'
+        for x, text in cells:
+            if not text:
+                continue
+            self.stream.append(b'BT %s %d Tf %d %d Td (%s) Tj ET' % (font, size, MARGIN + x, self.y, _pdf_string(text)))
+
+    def table(self, heading, columns, rows, header=None, footer=None):
+        self.line([(0, heading)], size=13, bold=True, before=18)
+        if header:
+            self.line(list(zip(columns, header)), bold=True, before=8)
+        for row in rows:
+            self.line(list(zip(columns, row)))
+        if footer:
+            self.line(list(zip(columns, footer)), bold=True, before=6)
+
+
+def _pdf_document(pages):
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(None)
+    page_tree = add(None)
+    regular = add(b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>')
+    bold = add(b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>')
+    kids = []
+    for stream in pages:
+        content = zlib.compress(b'\n'.join(stream))
+        contents = add(b'<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream' % (len(content), content))
+        kids.append(add(
+            b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] '
+            b'/Resources << /Font << /F1 %d 0 R /F2 %d 0 R >> >> /Contents %d 0 R >>'
+            % (page_tree, PAGE_WIDTH, PAGE_HEIGHT, regular, bold, contents)
+        ))
+    objects[catalog - 1] = b'<< /Type /Catalog /Pages %d 0 R >>' % page_tree
+    objects[page_tree - 1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+        b' '.join(b'%d 0 R' % kid for kid in kids), len(kids)
+    )
+
+    output = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += b'%d 0 obj\n%s\nendobj\n' % (number, body)
+    xref = len(output)
+    output += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    output += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    output += b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, catalog, xref)
+    return bytes(output)
+
+
+def render_pdf(context):
+    layout = _PdfLayout()
+    layout.line([(0, f"Relocation report: {context['title']}")], size=18, bold=True, before=0)
+    layout.line([(0, f"{context['origin']} to {context['destination']}")], size=12, before=8)
+    if context['updated']:
+        layout.line([(0, f"Calculation last updated {context['updated']}")], size=9)
+
+    layout.table(
+        'Monthly expenses', (0, 190, 290, 400), context['expenses'],
+        header=['', 'Current', 'Estimated', 'Change'], footer=context['expense_total'],
+    )
+    layout.table('Savings', (0, 190), context['savings'])
+    if context['income']:
+        layout.table('Income and taxes (annual)', (0, 190), context['income'])
+    layout.table(
+        'Cost of living compared', (0, 190, 290), context['ratios'], header=['', 'Ratio', 'Change'],
+    )
+    layout.table(
+        'Veteran benefits', (0, 270, 390), context['benefits'],
+        header=['', context['origin'], context['destination_state']],
+    )
+    for state_name, notes in context['benefit_notes']:
+        layout.line([(0, f'{state_name}:')], bold=True, before=8)
+        for paragraph in notes.splitlines():
+            # Roughly 95 Helvetica characters at 10pt fit the text width
+            words, line = paragraph.split(), ''
+            for word in words:
+                if line and len(line) + len(word) >= 95:
+                    layout.line([(0, line)])
+                    line = ''
+                line = f'{line} {word}' if line else word
+            if line:
+                layout.line([(0, line)])
+    return _pdf_document(layout.pages)
+
+
+def render_html(context):
+    return render_to_string('calculations/report.html', context).encode()
+
+
+def _write_atomically(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=path.parent, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(content)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def render_report(report):
+    """Render ``report`` to its file; returns the path"""
+    render = render_pdf if report.extension == 'pdf' else render_html
+    _write_atomically(report.path, render(report.context))
+    return report.path
+
+
+_rendering = {}
+_rendering_lock = threading.Lock()
+
+
+def render_in_pool(report):
+    """
+    Future for ``report``'s file, rendered by report_rendering_executor and
+    shared with concurrent requests for the same report. Raises ExecutorBusy
+    when the pool's queue is full.
+    """
+    with _rendering_lock:
+        future = _rendering.get(report.path)
+        if future is None:
+            future = _rendering[report.path] = report_rendering_executor.submit(render_report, report)
+            # dict.pop is atomic, and the callback may run right away if the render already finished
+            future.add_done_callback(lambda _: _rendering.pop(report.path, None))
+    return future
+
+
+def report_wait():
+    """Seconds a request waits for a render before telling the client to come back"""
+    return getattr(settings, 'REPORT_RENDERING_EXECUTOR', {}).get('WAIT', 5)
+
+
+def report_not_modified(request, report):
+    """An HttpResponseNotModified if the client already has this exact report, else None"""
+    if f'"{report.key}"' not in request.headers.get('If-None-Match', ''):
+        return None
+    response = HttpResponseNotModified()
+    response['ETag'] = f'"{report.key}"'
+    return response
+
+
+def report_response(report, filename, content=None):
+    """The rendered report; PDFs are streamed from disk unless ``content`` was already read"""
+    if content is None and report.extension == 'pdf':
+        response = FileResponse(report.path.open('rb'), content_type=CONTENT_TYPES['pdf'])
+    else:
+        response = HttpResponse(
+            content if content is not None else report.path.read_bytes(),
+            content_type=CONTENT_TYPES[report.extension],
+        )
+        # Same key, same bytes: compressed once (mysite/compression.py)
+        response.content_version = f'report:{report.key}'
+    disposition = 'attachment' if report.extension == 'pdf' else 'inline'
+    response['Content-Disposition'] = f'{disposition}; filename="{filename}"'
+    response['ETag'] = f'"{report.key}"'
+    response['Cache-Control'] = 'private, no-cache'
+    return response
@@ -3,7 +3,9 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
 from .models import CostCalculation, UserProfile, CalculationNote
-from state_data.models import StateData, VeteranBenefit
+from state_data.catalog import get_catalog, state_exists
+from state_data.models import Region, StateData, VeteranBenefit
+from state_data.serializers import RegionSerializer
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -75,6 +77,8 @@ class CostCalculationSerializer(serializers.ModelSerializer):
     destination_state = StateDataSerializer(read_only=True)
     origin_state_id = serializers.IntegerField(write_only=True)
     destination_state_id = serializers.IntegerField(write_only=True, required=False)
+    destination_region = RegionSerializer(read_only=True)
+    destination_region_id = serializers.IntegerField(write_only=True, required=False, allow_null=True)
     notes = CalculationNoteSerializer(many=True, read_only=True)
     total_current_monthly_expenses = serializers.ReadOnlyField()
     
@@ -83,6 +87,7 @@ class CostCalculationSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'calculation_name', 'user', 'origin_state', 'destination_state',
             'origin_state_id', 'destination_state_id',
+            'destination_region', 'destination_region_id',
             
             # Current expenses
             'current_rent', 'current_utilities', 'current_groceries',
@@ -107,29 +112,100 @@ class CostCalculationSerializer(serializers.ModelSerializer):
             'total_annual_savings', 'created_at', 'updated_at'
         ]
     
+    def validate_origin_state_id(self, value):
+        if not state_exists(value):
+            raise serializers.ValidationError('State not found.')
+        return value
+    
+    def validate_destination_state_id(self, value):
+        if not state_exists(value):
+            raise serializers.ValidationError('State not found.')
+        return value
+    
+    def validate_destination_region_id(self, value):
+        if value is None:
+            return None
+        # Kept whole: its indices drive the estimates, so the save needs no second lookup
+        self._destination_region = Region.objects.filter(pk=value).first()
+        if self._destination_region is None:
+            raise serializers.ValidationError('Region not found.')
+        return value
+    
+    def validate(self, attrs):
+        # A region always sits in its own state, whatever destination_state_id says
+        if attrs.get('destination_region_id'):
+            attrs['destination_state_id'] = self._destination_region.state_id
+        elif 'destination_state_id' in attrs and 'destination_region_id' not in attrs and self.instance is not None:
+            # Moving the destination to another state drops a region left over in the old one
+            region_state_id = self.current_region_state_id(self.instance)
+            if region_state_id is not None and region_state_id != attrs['destination_state_id']:
+                attrs['destination_region_id'] = None
+        return attrs
+    
+    def current_region_state_id(self, calculation):
+        if calculation.destination_region_id is None:
+            return None
+        if CostCalculation.destination_region.is_cached(calculation):
+            return calculation.destination_region.state_id
+        return Region.objects.filter(pk=calculation.destination_region_id).values_list('state_id', flat=True).first()
+    
+    def attach_relations(self, calculation):
+        """Point the relations at objects already in memory, so estimating and rendering do not query"""
+        request = self.context.get('request')
+        if request is not None and calculation.user_id == request.user.pk:
+            calculation.user = request.user
+        catalog = get_catalog()
+        if calculation.origin_state_id in catalog.by_pk:
+            calculation.origin_state = catalog.by_pk[calculation.origin_state_id]
+        if calculation.destination_state_id in catalog.by_pk:
+            calculation.destination_state = catalog.by_pk[calculation.destination_state_id]
+        region = getattr(self, '_destination_region', None)
+        if region is not None and calculation.destination_region_id == region.pk:
+            calculation.destination_region = region
+        if CostCalculation.destination_region.is_cached(calculation) and calculation.destination_region is not None:
+            region = calculation.destination_region
+            if region.state_id in catalog.by_pk:
+                region.state = catalog.by_pk[region.state_id]
+    
     def create(self, validated_data):
-        # Set destination to Maine by default
-        if 'destination_state_id' not in validated_data:
-            maine_state = StateData.objects.get(state_code='ME')
-            validated_data['destination_state_id'] = maine_state.id
-        
-        validated_data['user'] = self.context['request'].user
-        calculation = super().create(validated_data)
-        
-        # Calculate Maine estimates
+        # Derived fields are computed before the INSERT, so creating is a single write
+        calculation = CostCalculation(user_id=self.context['request'].user.pk, **validated_data)
+        self.attach_relations(calculation)
+        # Defaults the destination to Maine from the catalog
         calculation.calculate_maine_estimates()
-        calculation.save()
-        
+        calculation.save(force_insert=True)
         return calculation
     
     def update(self, instance, validated_data):
-        calculation = super().update(instance, validated_data)
+        fields = [field for field in CostCalculation._meta.concrete_fields if not field.primary_key]
+        before = {field.attname: getattr(instance, field.attname) for field in fields}
         
-        # Recalculate Maine estimates
-        calculation.calculate_maine_estimates()
-        calculation.save()
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        self.attach_relations(instance)
+        instance.calculate_maine_estimates()
         
-        return calculation
+        # One UPDATE of just the columns that changed, or none at all
+        changed = [field.name for field in fields if getattr(instance, field.attname) != before[field.attname]]
+        if changed:
+            instance.save(update_fields=changed + ['updated_at'])
+        return instance
+    
+    def duplicate(self, original):
+        """Unsaved-then-inserted copy of ``original``, with estimates recomputed against current state data"""
+        copy = CostCalculation(**{
+            field.attname: getattr(original, field.attname)
+            for field in CostCalculation._meta.concrete_fields
+            if not field.primary_key and field.name not in ('created_at', 'updated_at')
+        })
+        copy.calculation_name = f"Copy of {original.calculation_name}"[:CostCalculation._meta.get_field('calculation_name').max_length]
+        copy.is_favorite = False
+        if original.destination_region_id is not None:
+            copy.destination_region = original.destination_region
+        self.attach_relations(copy)
+        copy.calculate_maine_estimates()
+        copy.save(force_insert=True)
+        return copy
 
 class CostCalculationSummarySerializer(serializers.ModelSerializer):
     """Lightweight serializer for calculation lists"""
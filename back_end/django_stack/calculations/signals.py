@@ -0,0 +1,120 @@
+# calculations/signals.py
+
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from mysite.events import publish_on_commit
+from mysite.response_cache import invalidate_tags
+from mysite.sharding import invalidate_shard_directory, shard_for_user
+from state_data.models import StateData
+from .authentication import last_seen_buffer, revoke_token, revoke_user_tokens, token_cache
+from .models import ArchivedCalculationBatch, CalculationNote, CostCalculation, UserProfile, UserShard
+from .percentiles import record_calculation
+from .profiles import invalidate_profile_payload, invalidate_profile_payloads
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    """Drop a token from the auth cache of every worker as soon as it is deleted (e.g. logout)"""
+    token_cache.invalidate(instance.key)
+    revoke_token(instance.key)
+    last_seen_buffer.discard(instance.key)
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance, **kwargs):
+    """Cached tokens carry the user object, so any user change (deactivation included) evicts them everywhere"""
+    token_cache.invalidate_user(instance.pk)
+    revoke_user_tokens(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def create_user_profile(sender, instance, created, raw=False, **kwargs):
+    """Every user gets a profile when it is created, so profile reads never have to write"""
+    if created and not raw:
+        UserProfile.objects.create(user=instance)
+    elif not created:
+        # The cached profile payload embeds the user's name and email
+        invalidate_profile_payload(instance.pk)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def invalidate_profile(sender, instance, **kwargs):
+    invalidate_profile_payload(instance.user_id)
+
+
+@receiver(post_save, sender=StateData)
+def invalidate_resident_profiles(sender, instance, created, **kwargs):
+    """Profile payloads embed the current state, so refresh them when that state's data changes"""
+    if not created:
+        invalidate_profile_payloads(
+            UserProfile.objects.filter(current_state=instance).values_list('user_id', flat=True)
+        )
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_responses(sender, instance, created, **kwargs):
+    """Calculation detail payloads embed the user"""
+    if not created:
+        invalidate_tags(f'user:{instance.pk}')
+
+
+@receiver(post_save, sender=CostCalculation)
+@receiver(post_delete, sender=CostCalculation)
+def invalidate_calculation_responses(sender, instance, **kwargs):
+    invalidate_tags(f'calculation:{instance.pk}', f'user:{instance.user_id}:calculations')
+
+
+@receiver(post_save, sender=CostCalculation)
+def publish_calculation_change(sender, instance, raw=False, **kwargs):
+    """Tell the owner's open streams the new totals, so clients can patch their lists in place"""
+    if raw:
+        return
+    publish_on_commit(f'user:{instance.user_id}', 'calculation', {
+        'id': instance.pk,
+        'total_monthly_savings': str(instance.total_monthly_savings),
+        'total_annual_savings': str(instance.total_annual_savings),
+        'updated_at': instance.updated_at.isoformat() if instance.updated_at else None,
+    })
+
+
+@receiver(post_delete, sender=CostCalculation)
+def publish_calculation_deletion(sender, instance, **kwargs):
+    publish_on_commit(f'user:{instance.user_id}', 'calculation_deleted', {'id': instance.pk})
+
+
+@receiver(post_save, sender=CostCalculation)
+def count_calculation_expenses(sender, instance, raw=False, **kwargs):
+    """Keep the percentile sketches in step with the calculation's expenses"""
+    if not raw:
+        record_calculation(instance)
+
+
+@receiver(post_delete, sender=CostCalculation)
+def uncount_calculation_expenses(sender, instance, **kwargs):
+    record_calculation(instance, deleted=True)
+
+
+@receiver(post_save, sender=CalculationNote)
+@receiver(post_delete, sender=CalculationNote)
+def invalidate_note_responses(sender, instance, **kwargs):
+    """Calculation detail payloads embed their notes"""
+    invalidate_tags(f'calculation:{instance.calculation_id}')
+
+
+@receiver(pre_delete, sender=User)
+def delete_sharded_calculations(sender, instance, **kwargs):
+    """The cascade from a user only reaches its own database, so clear their shard first"""
+    alias = shard_for_user(instance.pk)
+    if alias != 'default':
+        CostCalculation.objects.using(alias).filter(user_id=instance.pk).delete()
+        ArchivedCalculationBatch.objects.using(alias).filter(user_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=UserShard)
+@receiver(post_delete, sender=UserShard)
+def invalidate_directory(sender, instance, **kwargs):
+    invalidate_shard_directory()
@@ -1,3 +1,789 @@
-from django.test import TestCase
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from mysite.checks import check_metrics_token, check_production_caches, check_shared_caches
+from mysite.events import bus, event_stream, publish
+from mysite.idempotency import get_keys
+from mysite.parsers import ORJSONParser
+from mysite.renderers import ORJSONRenderer
+from mysite.sharding import get_shard_directory, replicate_reference_rows, shard_for_user, sharding_setting
+from mysite.throttling import get_bucket_store
+from state_data.catalog import get_catalog
+from state_data.models import Region, StateData
+from .archive import archive, rehydrate
+from .authentication import TokenCache, last_seen_buffer, token_cache
+from .management.commands.generate_synthetic_data import id_ranges
+from .models import (
+    ArchivedCalculationBatch, AuthTokenActivity, CalculationNote, CostCalculation, ExpenseSketch, UserProfile,
+    UserShard
+)
+from .percentiles import QuantileSketch, SketchBuffer, bucket_index, sketch_buffer
+
+
+class CacheIsolationMixin:
+    """Start every test with empty caches: tag versions, tokens and throttle buckets outlive a rolled-back test"""
+
+    def setUp(self):
+        super().setUp()
+        for cache in caches.all():
+            cache.clear()
+        token_cache.clear()
+        last_seen_buffer.flush()
+        get_bucket_store().clear()
+
+
+def create_state(code, name, **indices):
+    values = {
+        'cost_of_living_index': 100, 'housing_index': 100, 'utilities_index': 100,
+        'grocery_index': 100, 'transportation_index': 100, 'state_income_tax_min': 0,
+        'state_income_tax_max': 5, 'sales_tax_rate': 5, 'property_tax_rate': 1,
+    }
+    values.update(indices)
+    return StateData.objects.create(state_code=code, state_name=name, **values)
+
+
+def calculation_payload(origin_state, **overrides):
+    payload = {
+        'calculation_name': 'Move to Maine',
+        'origin_state_id': origin_state.pk,
+        'current_rent': '1500.00',
+        'current_utilities': '200.00',
+        'current_groceries': '400.00',
+        'current_transportation': '300.00',
+        'current_healthcare': '250.00',
+        'current_entertainment': '150.00',
+        'gross_annual_income': '60000.00',
+    }
+    payload.update(overrides)
+    return payload
+
+
+class APITestMixin(CacheIsolationMixin):
+    """A signed-in client for a fresh user, with Maine and one origin state to calculate between"""
+
+    # Calculations live on their owner's shard when DATABASE_SHARDING has several
+    databases = '__all__'
+
+    def setUp(self):
+        super().setUp()
+        self.maine = create_state('ME', 'Maine', cost_of_living_index=110, housing_index=120)
+        self.origin = create_state('TX', 'Texas', cost_of_living_index=95, housing_index=90)
+        # on_commit never fires inside a TestCase, so copy the reference rows to the shards by hand
+        replicate_reference_rows(StateData)
+        self.user = User.objects.create_user('veteran', password='correct horse battery')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def create_calculation(self, **overrides):
+        response = self.client.post(
+            '/api/calculations/', calculation_payload(self.origin, **overrides), format='json',
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+
+class CacheCheckTests(SimpleTestCase):
+
+    def check_ids(self, backend, location='', debug=False, deploy=False):
+        with override_settings(DEBUG=debug, CACHES={'default': {'BACKEND': backend, 'LOCATION': location}}):
+            messages = check_shared_caches(None) + (check_production_caches(None) if deploy else [])
+        return sorted(message.id for message in messages)
+
+    def private_dir(self, mode):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        os.chmod(path, mode)
+        return path
+
+    def test_per_process_cache_is_refused(self):
+        self.assertEqual(self.check_ids('django.core.cache.backends.locmem.LocMemCache', debug=True), ['mysite.W001'])
+        self.assertEqual(self.check_ids('django.core.cache.backends.locmem.LocMemCache'), ['mysite.E001'])
+
+    def test_file_cache_is_for_development_only(self):
+        backend = 'django.core.cache.backends.filebased.FileBasedCache'
+        self.assertEqual(self.check_ids(backend, self.private_dir(0o700)), [])
+        self.assertEqual(self.check_ids(backend, self.private_dir(0o700), deploy=True), ['mysite.E002'])
+        redis = 'django.core.cache.backends.redis.RedisCache'
+        self.assertEqual(self.check_ids(redis, 'redis://cache:6379', deploy=True), [])
+
+    def test_file_cache_others_can_write_is_refused(self):
+        backend = 'django.core.cache.backends.filebased.FileBasedCache'
+        self.assertEqual(self.check_ids(backend, self.private_dir(0o777), debug=True), ['mysite.E003'])
+        # Anyone could create it first
+        missing = os.path.join(self.private_dir(0o777), 'cache')
+        self.assertEqual(self.check_ids(backend, missing, debug=True), ['mysite.E003'])
+        missing = os.path.join(self.private_dir(0o700), 'cache')
+        self.assertEqual(self.check_ids(backend, missing, debug=True), [])
+
+
+class MetricsAccessTests(SimpleTestCase):
+
+    def scrape(self, token='', debug=False, **headers):
+        with override_settings(DEBUG=debug, METRICS={'AUTH_TOKEN': token}):
+            return self.client.get('/metrics', headers=headers).status_code
+
+    def test_open_without_a_token_only_under_debug(self):
+        self.assertEqual(self.scrape(), 403)
+        self.assertEqual(self.scrape(debug=True), 200)
+
+    def test_token_is_required_when_set(self):
+        for debug in (False, True):
+            self.assertEqual(self.scrape('s3cret', debug), 403)
+            self.assertEqual(self.scrape('s3cret', debug, authorization='Bearer wrong'), 403)
+            self.assertEqual(self.scrape('s3cret', debug, authorization='Bearer s3cret'), 200)
+
+    def test_deploy_check_requires_a_token(self):
+        with override_settings(METRICS={'AUTH_TOKEN': ''}):
+            self.assertEqual([message.id for message in check_metrics_token(None)], ['mysite.E004'])
+        with override_settings(METRICS={'AUTH_TOKEN': 's3cret'}):
+            self.assertEqual(check_metrics_token(None), [])
+
+
+class EventStreamTests(SimpleTestCase):
+
+    async def read(self, stream):
+        return [chunk async for chunk in stream]
+
+    @override_settings(EVENTS={'HEARTBEAT': 0.05, 'MAX_AGE': 0.2})
+    async def test_stream_ends_after_max_age(self):
+        stream = event_stream(['user:1'])
+        self.assertTrue((await anext(stream)).startswith(b'retry: '))
+        publish('user:1', 'calculation', {'id': 1})
+        started = time.monotonic()
+        chunks = await asyncio.wait_for(self.read(stream), 5)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(chunks[0], b'event: calculation\ndata: {"id":1}\n\n')
+        self.assertIn(b': keep-alive\n\n', chunks)
+        self.assertEqual(bus.subscriber_count(), 0)
+
+    @override_settings(EVENTS={'HEARTBEAT': 0.05, 'MAX_AGE': None})
+    async def test_stream_without_max_age_stays_open(self):
+        stream = event_stream(['user:1'])
+        await anext(stream)
+        for _ in range(5):
+            self.assertEqual(await asyncio.wait_for(anext(stream), 5), b': keep-alive\n\n')
+        await stream.aclose()
+        self.assertEqual(bus.subscriber_count(), 0)
+
+
+class JSONParityTests(SimpleTestCase):
+    """The orjson renderer and parser against DRF's JSONRenderer and JSONParser, byte for byte"""
+
+    def test_rendering_matches_drf(self):
+        moment = datetime(2026, 1, 2, 3, 4, 5, 123456)
+        for data in [
+            {'id': 1, 'name': 'Maine', 'values': [None, True, False, 0, -1, 1.5, 0.1, -0.0]},
+            Decimal('1.10'), Decimal('12345678901234567890.5'),
+            'line\u2028paragraph\u2029', {'\u2028': ['\u2029']}, 'é😀\x00\x1f"\\/',
+            gettext_lazy('Lazy'), {'message': gettext_lazy('Lazy')},
+            moment, moment.replace(tzinfo=dt_timezone.utc), moment.date(), moment.time(), timedelta(days=1, seconds=5),
+            uuid.UUID(int=5),
+            2 ** 63 - 1, 2 ** 63, 2 ** 64, -2 ** 63 - 1, 10 ** 25, [10 ** 30],
+            1e20, 1e16, 1.5e-7, 5e-324, 1.7976931348623157e308, Decimal('1E+20'),
+            {1: 'int key', None: 'null key'}, (1, 2), [], {},
+        ]:
+            self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data), repr(data))
+
+    def test_non_finite_floats_raise_like_drf(self):
+        for data in [float('nan'), float('inf'), {'x': [float('-inf')]}, Decimal('NaN'), Decimal('-Infinity')]:
+            with self.assertRaises(ValueError):
+                JSONRenderer().render(data)
+            with self.assertRaises(ValueError, msg=repr(data)):
+                ORJSONRenderer().render(data)
+
+    def parse(self, parser, body, encoding='utf-8'):
+        try:
+            return parser.parse(BytesIO(body), 'application/json', {'encoding': encoding})
+        except ParseError as e:
+            return ('ParseError', str(e.detail))
+
+    def test_parsing_matches_drf(self):
+        for body in [
+            b'{"a": 1, "b": [true, false, null], "c": "\\u2028"}', b'[1, 2.5, -0.0, 1E5, 1e16, 0.1]',
+            b'12345678901234567890123', b'-99999999999999999999', b'18446744073709551615', b'18446744073709551616',
+            b'[1e400, -1e400, 1e-400]', b'{"a": 1, "a": 2}', b'"\\ud83d\\ude00"', b'"\xc3\xa9"',
+            b'NaN', b'[Infinity]', b'{', b'', b'\xff', b'{"a": 1} x', b'\xef\xbb\xbf{}',
+        ]:
+            self.assertEqual(repr(self.parse(ORJSONParser(), body)), repr(self.parse(JSONParser(), body)), body)
+
+    def test_other_charsets_match_drf(self):
+        body = '{"é": "ü"}'.encode('latin-1')
+        self.assertEqual(self.parse(ORJSONParser(), body, 'latin-1'), {'é': 'ü'})
+        self.assertEqual(self.parse(ORJSONParser(), body, 'latin-1'), self.parse(JSONParser(), body, 'latin-1'))
+
+
+class TokenExpiryTests(CacheIsolationMixin, TestCase):
+    login_url = '/api/calculations/auth/login/'
+    profile_url = '/api/calculations/auth/profile/'
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('veteran', password='correct horse battery')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+
+    def expire(self, token):
+        seen = timezone.now() - timedelta(days=30)
+        AuthTokenActivity.objects.update_or_create(token=token, defaults={'last_seen': seen})
+        token_cache.clear()
+
+    def authenticated_get(self, key):
+        return self.client.get(self.profile_url, HTTP_AUTHORIZATION=f'Token {key}')
+
+    def test_used_token_stays_valid(self):
+        self.assertEqual(self.authenticated_get(self.token.key).status_code, 200)
+        self.assertEqual(self.authenticated_get(self.token.key).status_code, 200)
+
+    def test_expired_token_is_rejected(self):
+        self.expire(self.token)
+        response = self.authenticated_get(self.token.key)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['detail'], 'Token has expired.')
+
+    def test_login_keeps_a_live_token(self):
+        response = self.client.post(self.login_url, {'username': 'veteran', 'password': 'correct horse battery'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['token'], self.token.key)
+
+    def test_login_replaces_an_expired_token(self):
+        self.expire(self.token)
+        response = self.client.post(self.login_url, {'username': 'veteran', 'password': 'correct horse battery'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.data['token'], self.token.key)
+        self.assertFalse(Token.objects.filter(key=self.token.key).exists())
+        self.assertEqual(self.authenticated_get(response.data['token']).status_code, 200)
+        self.assertEqual(self.authenticated_get(self.token.key).status_code, 401)
+
+    @override_settings(ROOT_URLCONF='mysite.asgi_urls')
+    async def test_async_auth_refuses_a_body_that_is_not_an_object(self):
+        for url in (self.login_url, '/api/calculations/auth/register/'):
+            for body in ('[]', '"x"', '1', 'null'):
+                response = await self.async_client.post(url, body, content_type='application/json')
+                self.assertEqual(response.status_code, 400, (url, body))
+
+    @override_settings(ROOT_URLCONF='mysite.asgi_urls')
+    async def test_async_login_replaces_an_expired_token(self):
+        await AuthTokenActivity.objects.acreate(token=self.token, last_seen=timezone.now() - timedelta(days=30))
+        response = await self.async_client.post(
+            self.login_url, {'username': 'veteran', 'password': 'correct horse battery'},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        key = response.json()['token']
+        self.assertNotEqual(key, self.token.key)
+        self.assertTrue(await Token.objects.filter(key=key, user=self.user).aexists())
+
+
+class TokenRevocationTests(CacheIsolationMixin, TestCase):
+    """Each worker has its own token cache; a second TokenCache stands in for another worker's"""
+
+    profile_url = '/api/calculations/auth/profile/'
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('veteran', password='correct horse battery')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.other_worker = TokenCache(100, 3600)
+
+    def get_on_other_worker(self):
+        with patch('calculations.authentication.token_cache', self.other_worker):
+            return self.client.get(self.profile_url)
+
+    def test_logout_elsewhere_revokes_a_cached_token(self):
+        self.assertEqual(self.get_on_other_worker().status_code, 200)
+        self.assertIsNotNone(self.other_worker.get(self.token.key))
+
+        self.assertEqual(self.client.post('/api/calculations/auth/logout/').status_code, 200)
+
+        self.assertIsNone(self.other_worker.get(self.token.key))
+        self.assertEqual(self.get_on_other_worker().status_code, 401)
+
+    def test_deactivation_elsewhere_revokes_a_cached_token(self):
+        self.assertEqual(self.get_on_other_worker().status_code, 200)
+
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertIsNone(self.other_worker.get(self.token.key))
+        self.assertEqual(self.get_on_other_worker().status_code, 401)
+
+    def test_unrelated_revocation_keeps_the_entry(self):
+        self.assertEqual(self.get_on_other_worker().status_code, 200)
+        other = User.objects.create_user('other', password='correct horse battery')
+        Token.objects.create(user=other).delete()
+        self.assertIsNotNone(self.other_worker.get(self.token.key))
+
+
+# An hourly rate, so password hashing is never slow enough for a token to refill mid-test
+@override_settings(REST_FRAMEWORK={
+    **settings.REST_FRAMEWORK,
+    'DEFAULT_THROTTLE_RATES': {**settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], 'login': '3/hour'},
+})
+class AuthThrottleTests(CacheIsolationMixin, TestCase):
+
+    credentials = {'username': 'veteran', 'password': 'wrong'}
+
+    def test_login_attempts_are_limited_per_client(self):
+        for _ in range(3):
+            self.assertEqual(self.client.post('/api/calculations/auth/login/', self.credentials).status_code, 400)
+        response = self.client.post('/api/calculations/auth/login/', self.credentials)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+    @override_settings(ROOT_URLCONF='mysite.asgi_urls')
+    async def test_async_login_attempts_are_limited_per_client(self):
+        for _ in range(3):
+            response = await self.async_client.post(
+                '/api/calculations/auth/login/', self.credentials, content_type='application/json',
+            )
+            self.assertEqual(response.status_code, 400)
+        response = await self.async_client.post(
+            '/api/calculations/auth/login/', self.credentials, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+
+@override_settings(REST_FRAMEWORK={
+    **settings.REST_FRAMEWORK,
+    'DEFAULT_THROTTLE_RATES': {**settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], 'token': '3/hour'},
+})
+class TokenThrottleTests(CacheIsolationMixin, TestCase):
+
+    # The dashboard reads the user's shard
+    databases = '__all__'
+    profile_url = '/api/calculations/auth/profile/'
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('veteran', password='correct horse battery')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+
+    def get(self, key):
+        return self.client.get(self.profile_url, HTTP_AUTHORIZATION=f'Token {key}')
+
+    def test_requests_are_limited_per_token(self):
+        for _ in range(3):
+            self.assertEqual(self.get(self.token.key).status_code, 200)
+        response = self.get(self.token.key)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+        # A new token for the same user (say after logging in again) starts with a full bucket
+        self.token.delete()
+        fresh = Token.objects.create(user=self.user)
+        self.assertEqual(self.get(fresh.key).status_code, 200)
+
+    @override_settings(ROOT_URLCONF='mysite.asgi_urls')
+    async def test_async_requests_are_limited_per_token(self):
+        headers = {'Authorization': f'Token {self.token.key}'}
+        for _ in range(3):
+            response = await self.async_client.get('/api/calculations/dashboard/', headers=headers)
+            self.assertEqual(response.status_code, 200)
+        response = await self.async_client.get('/api/calculations/dashboard/', headers=headers)
+        self.assertEqual(response.status_code, 429)
+
+
+@skipUnless(len(sharding_setting('SHARDS')) > 1, 'needs DATABASE_SHARDING with at least two shards')
+class ShardMoveTests(APITestMixin, TestCase):
+
+    def other_shard(self, alias):
+        return next(shard for shard in sharding_setting('SHARDS') if shard != alias)
+
+    def test_move_copies_then_deletes(self):
+        pk = self.create_calculation()
+        response = self.client.post(f'/api/calculations/{pk}/notes/', {'note': 'Check VA clinics'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        source = shard_for_user(self.user.pk)
+        target = self.other_shard(source)
+
+        with override_settings(DATABASE_SHARDING={**settings.DATABASE_SHARDING, 'DIRECTORY_TTL': 0}):
+            call_command('rebalance_shards', user=self.user.pk, to=target, grace=0, stdout=StringIO())
+
+            self.assertEqual(shard_for_user(self.user.pk), target)
+            self.assertFalse(CostCalculation._base_manager.using(source).filter(user=self.user).exists())
+            self.assertTrue(CostCalculation._base_manager.using(target).filter(pk=pk).exists())
+            self.assertEqual(CalculationNote._base_manager.using(target).filter(calculation_id=pk).count(), 1)
+
+            response = self.client.get(f'/api/calculations/{pk}/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['notes']), 1)
+
+    def test_grace_shorter_than_directory_ttl_is_refused(self):
+        pk = self.create_calculation()
+        source = shard_for_user(self.user.pk)
+        with override_settings(DATABASE_SHARDING={**settings.DATABASE_SHARDING, 'DIRECTORY_TTL': 5}):
+            with self.assertRaises(CommandError):
+                call_command('rebalance_shards', user=self.user.pk, to=self.other_shard(source), grace=1,
+                             stdout=StringIO())
+        self.assertTrue(CostCalculation._base_manager.using(source).filter(pk=pk).exists())
+
+    def test_directory_is_reread_without_a_tag_change(self):
+        """A worker whose cache never hears of a move still picks it up within DIRECTORY_TTL"""
+        source = shard_for_user(self.user.pk)
+        target = self.other_shard(source)
+        get_shard_directory()
+        # bulk_create sends no signals, so the cache tag stays where it was
+        UserShard.objects.bulk_create([UserShard(user_id=self.user.pk, alias=target)])
+
+        with override_settings(DATABASE_SHARDING={**settings.DATABASE_SHARDING, 'DIRECTORY_TTL': 60}):
+            self.assertEqual(shard_for_user(self.user.pk), source)
+        with override_settings(DATABASE_SHARDING={**settings.DATABASE_SHARDING, 'DIRECTORY_TTL': 0}):
+            self.assertEqual(shard_for_user(self.user.pk), target)
+
+
+class StateCatalogTests(APITestMixin, TestCase):
+
+    def add_state_quietly(self, code, name):
+        """A state whose ``states`` tag bump this worker's cache never saw"""
+        get_catalog()
+        StateData.objects.bulk_create([StateData(
+            state_code=code, state_name=name, cost_of_living_index=100, housing_index=100,
+            utilities_index=100, grocery_index=100, transportation_index=100,
+            state_income_tax_min=0, state_income_tax_max=5, sales_tax_rate=5, property_tax_rate=1,
+        )])
+        replicate_reference_rows(StateData)
+        return StateData.objects.get(state_code=code)
+
+    def test_state_missing_from_the_catalog_is_accepted(self):
+        state = self.add_state_quietly('VT', 'Vermont')
+        with override_settings(STATE_CATALOG_TTL=60):
+            self.assertNotIn(state.pk, get_catalog().by_pk)
+            self.create_calculation(origin_state_id=state.pk)
+
+    def test_unknown_state_is_refused(self):
+        response = self.client.post(
+            '/api/calculations/', calculation_payload(self.origin, origin_state_id=999999), format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('origin_state_id', response.data)
+
+    def test_catalog_is_reloaded_after_its_ttl(self):
+        state = self.add_state_quietly('VT', 'Vermont')
+        with override_settings(STATE_CATALOG_TTL=0):
+            self.assertIn(state.pk, get_catalog().by_pk)
+
+
+class DestinationRegionTests(APITestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.portland = Region.objects.create(
+            state=self.maine, region_type=Region.METRO, code='38860', name='Portland',
+            cost_of_living_index=130, housing_index=180, utilities_index=110,
+            grocery_index=105, transportation_index=100,
+        )
+        replicate_reference_rows(Region)
+
+    def patch(self, pk, data):
+        response = self.client.patch(f'/api/calculations/{pk}/', data, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_new_destination_state_drops_a_region_from_the_old_one(self):
+        pk = self.create_calculation(destination_region_id=self.portland.pk)
+        without_region = self.patch(self.create_calculation(), {'destination_state_id': self.origin.pk})
+
+        data = self.patch(pk, {'destination_state_id': self.origin.pk})
+        self.assertIsNone(data['destination_region'])
+        self.assertEqual(data['destination_state']['id'], self.origin.pk)
+        self.assertEqual(data['estimated_maine_rent'], without_region['estimated_maine_rent'])
+        self.assertIsNone(CostCalculation.objects.for_user(self.user).get(pk=pk).destination_region_id)
+
+    def test_region_stays_while_the_state_does(self):
+        pk = self.create_calculation(destination_region_id=self.portland.pk)
+        data = self.patch(pk, {'destination_state_id': self.maine.pk, 'calculation_name': 'Renamed'})
+        self.assertEqual(data['destination_region']['id'], self.portland.pk)
+
+
+class SyntheticDataTests(APITestMixin, TestCase):
+
+    def generate(self, *args):
+        call_command(
+            'generate_synthetic_data', '--users', '6', '--calculations', '60', '--notes-ratio', '0.5',
+            '--workers', '1', '--batch-size', '7', *args, stdout=StringIO(),
+        )
+
+    def synthetic_rows(self):
+        user_ids = list(User.objects.filter(username__startswith='synthetic-').values_list('pk', flat=True))
+        calculations = notes = 0
+        for alias in sharding_setting('SHARDS'):
+            calculations += CostCalculation._base_manager.using(alias).filter(user_id__in=user_ids).count()
+            notes += CalculationNote._base_manager.using(alias).filter(calculation__user_id__in=user_ids).count()
+        return len(user_ids), calculations, notes
+
+    def test_clear_replaces_synthetic_rows_without_signals(self):
+        pk = self.create_calculation()
+        self.generate()
+        generated = self.synthetic_rows()
+        self.assertEqual(generated[:2], (6, 60))
+        self.assertGreater(generated[2], 0)
+
+        with patch('calculations.signals.record_calculation') as counted:
+            self.generate('--clear', '--seed', '7')
+        counted.assert_not_called()
+        self.assertEqual(self.synthetic_rows()[:2], (6, 60))
+        self.assertEqual(UserProfile.objects.filter(user__username__startswith='synthetic-').count(), 6)
+        self.assertTrue(CostCalculation.objects.for_user(self.user).filter(pk=pk).exists())
+
+    def test_id_ranges(self):
+        self.assertEqual(id_ranges([]), [])
+        self.assertEqual(id_ranges([3, 4, 5, 9, 11, 12]), [(3, 5), (9, 9), (11, 12)])
+
+
+class ArchiveTests(APITestMixin, TestCase):
+
+    def make_stale(self, *pks):
+        CostCalculation._base_manager.using(shard_for_user(self.user.pk)).filter(pk__in=pks).update(
+            updated_at=timezone.now() - timedelta(days=365),
+        )
+
+    def test_archives_stale_calculations_only(self):
+        stale, fresh, favorite = self.create_calculation(), self.create_calculation(), self.create_calculation()
+        self.client.post(f'/api/calculations/{favorite}/toggle-favorite/')
+        self.make_stale(stale, favorite)
+
+        call_command('archive_calculations', days=180, stdout=StringIO())
+
+        hot = set(CostCalculation.objects.for_user(self.user).values_list('pk', flat=True))
+        self.assertEqual(hot, {fresh, favorite})
+        self.assertEqual(ArchivedCalculationBatch.objects.for_user(self.user).get().calculation_count, 1)
+
+    def test_rows_changed_after_selection_stay_hot(self):
+        edited, favorited = self.create_calculation(), self.create_calculation()
+        self.make_stale(edited, favorited)
+        cutoff = timezone.now() - timedelta(days=180)
+        alias = shard_for_user(self.user.pk)
+
+        # Picked as stale, then changed before archive() gets to them
+        self.client.patch(f'/api/calculations/{edited}/', {'current_rent': '1600.00'}, format='json')
+        self.client.post(f'/api/calculations/{favorited}/toggle-favorite/')
+        self.assertEqual(archive(alias, [edited, favorited], cutoff, batch_size=500), [])
+
+        calculation = CostCalculation.objects.for_user(self.user).get(pk=edited)
+        self.assertEqual(calculation.current_rent, Decimal('1600.00'))
+        self.assertTrue(CostCalculation.objects.for_user(self.user).get(pk=favorited).is_favorite)
+        self.assertFalse(ArchivedCalculationBatch.objects.for_user(self.user).exists())
+
+    def test_archived_calculation_comes_back_as_it_was(self):
+        pk = self.create_calculation()
+        self.client.post(f'/api/calculations/{pk}/notes/', {'note': 'Ask about property tax'}, format='json')
+        self.make_stale(pk)
+        before = CostCalculation.objects.for_user(self.user).get(pk=pk)
+        call_command('archive_calculations', days=180, stdout=StringIO())
+        self.assertFalse(CostCalculation.objects.for_user(self.user).filter(pk=pk).exists())
+
+        response = self.client.get(f'/api/calculations/{pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['notes']), 1)
+        after = CostCalculation.objects.for_user(self.user).get(pk=pk)
+        self.assertEqual((after.created_at, after.updated_at), (before.created_at, before.updated_at))
+        self.assertEqual(after.total_monthly_savings, before.total_monthly_savings)
+        self.assertFalse(ArchivedCalculationBatch.objects.for_user(self.user).exists())
+
+    def test_include_archived_restores_the_list(self):
+        pks = {self.create_calculation(), self.create_calculation()}
+        self.make_stale(*pks)
+        call_command('archive_calculations', days=180, stdout=StringIO())
+
+        self.assertEqual(self.client.get('/api/calculations/').data['count'], 0)
+        response = self.client.get('/api/calculations/', {'include_archived': 'true'})
+        self.assertEqual({row['id'] for row in response.data['results']}, pks)
+
+    def test_request_that_loses_the_restore_race_still_finds_the_row(self):
+        pk = self.create_calculation()
+        self.make_stale(pk)
+        call_command('archive_calculations', days=180, stdout=StringIO())
+
+        def restored_by_another_request(user, pk):
+            rehydrate(user, pk)
+            return False
+
+        with patch('calculations.views.rehydrate', restored_by_another_request):
+            self.assertEqual(self.client.get(f'/api/calculations/{pk}/').status_code, 200)
+            self.assertEqual(self.client.post(f'/api/calculations/{pk}/toggle-favorite/').status_code, 200)
+
+
+class SketchTests(APITestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        sketch_buffer.flush()
+
+    def tearDown(self):
+        # Nothing may be left for the flusher thread to write once the test's transaction is gone
+        sketch_buffer.flush()
+        super().tearDown()
+
+    def committing(self):
+        # Sketch changes are recorded on commit of the calculation's own database
+        return self.captureOnCommitCallbacks(using=shard_for_user(self.user.pk), execute=True)
+
+    def stored_counts(self):
+        return {
+            row.category: (row.count, QuantileSketch.from_row(row).buckets)
+            for row in ExpenseSketch.objects.filter(origin_state=self.origin)
+        }
+
+    def test_saves_edits_and_deletes_move_the_counts(self):
+        with self.committing():
+            pk = self.create_calculation(current_rent='1500.00')
+        sketch_buffer.flush()
+        count, buckets = self.stored_counts()['rent']
+        self.assertEqual((count, buckets), (1, {bucket_index(Decimal('1500.00')): 1}))
+
+        with self.committing():
+            self.client.patch(f'/api/calculations/{pk}/', {'current_rent': '900.00'}, format='json')
+        sketch_buffer.flush()
+        self.assertEqual(self.stored_counts()['rent'], (1, {bucket_index(Decimal('900.00')): 1}))
+
+        with self.committing():
+            self.client.delete(f'/api/calculations/{pk}/')
+        sketch_buffer.flush()
+        self.assertEqual(self.stored_counts()['rent'], (0, {}))
+
+    def test_incremental_counts_match_a_rebuild(self):
+        with self.committing():
+            for rent in ('800.00', '1200.00', '0.00', '2500.00'):
+                self.create_calculation(current_rent=rent)
+        sketch_buffer.flush()
+        incremental = self.stored_counts()
+
+        call_command('rebuild_percentile_sketches', stdout=StringIO())
+        self.assertEqual(self.stored_counts(), incremental)
+
+    def test_changes_are_flushed_without_further_writes(self):
+        buffer = SketchBuffer(interval=0.05)
+        with patch.object(buffer, '_merge', return_value=[]) as merge:
+            buffer.record({(self.origin.pk, 'rent'): {1: 1}})
+            deadline = time.monotonic() + 5
+            while not merge.called and time.monotonic() < deadline:
+                time.sleep(0.01)
+            buffer.close()
+        merge.assert_called_once_with({(self.origin.pk, 'rent'): {1: 1}})
+
+    def test_close_merges_what_is_pending(self):
+        buffer = SketchBuffer(interval=3600)
+        with patch.object(buffer, '_merge', return_value=[]) as merge:
+            buffer.record({(self.origin.pk, 'rent'): {1: 1}})
+            buffer.close()
+        merge.assert_called_once_with({(self.origin.pk, 'rent'): {1: 1}})
+
+    def test_failed_flush_keeps_the_changes(self):
+        buffer = SketchBuffer(interval=3600)
+        with patch.object(buffer, '_merge', side_effect=DatabaseError):
+            buffer.record({(self.origin.pk, 'rent'): {1: 1}})
+            with self.assertRaises(DatabaseError):
+                buffer.flush()
+        with patch.object(buffer, '_merge', return_value=[]) as merge:
+            buffer.close()
+        merge.assert_called_once_with({(self.origin.pk, 'rent'): {1: 1}})
+
+    def test_out_of_range_amounts_rank_at_the_ends(self):
+        ExpenseSketch.objects.create(origin_state=self.origin, category='rent')
+        row = ExpenseSketch.objects.get(origin_state=self.origin, category='rent')
+        QuantileSketch({bucket_index(1000 + 100 * n): 1 for n in range(20)}).to_row(row).save()
+
+        response = self.client.get('/api/calculations/percentiles/', {'origin': self.origin.pk, 'rent': '1e400'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['percentiles']['rent']['percentile'], 100.0)
+        response = self.client.get('/api/calculations/percentiles/', {'origin': self.origin.pk, 'rent': '1e-400'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['percentiles']['rent']['percentile'], 0.0)
+
+
+class IdempotencyTests(APITestMixin, TestCase):
+
+    def post(self, url, data=None, key='retry-1'):
+        return self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_first_response(self):
+        payload = calculation_payload(self.origin)
+        first = self.post('/api/calculations/', payload)
+        retry = self.post('/api/calculations/', payload)
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((retry.status_code, retry.data['id']), (201, first.data['id']))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(CostCalculation.objects.for_user(self.user).count(), 1)
+
+    def test_key_reused_for_another_request_is_refused(self):
+        self.post('/api/calculations/', calculation_payload(self.origin))
+        response = self.post('/api/calculations/', calculation_payload(self.origin, current_rent='999.00'))
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(CostCalculation.objects.for_user(self.user).count(), 1)
+
+    def test_keys_are_per_user(self):
+        self.post('/api/calculations/', calculation_payload(self.origin))
+        other = User.objects.create_user('other', password='correct horse battery')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=other).key}')
+        response = self.post('/api/calculations/', calculation_payload(self.origin))
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+
+    def test_replayed_toggle_does_not_toggle_again(self):
+        pk = self.create_calculation()
+        self.post(f'/api/calculations/{pk}/toggle-favorite/')
+        response = self.post(f'/api/calculations/{pk}/toggle-favorite/')
+        self.assertTrue(response.data['is_favorite'])
+        self.assertTrue(CostCalculation.objects.for_user(self.user).get(pk=pk).is_favorite)
+
+    def test_failed_request_releases_the_key(self):
+        self.assertEqual(self.post('/api/calculations/', {'calculation_name': 'Incomplete'}).status_code, 400)
+        self.assertEqual(self.post('/api/calculations/', {'calculation_name': 'Incomplete'}).status_code, 400)
+        self.assertFalse(get_keys().exists())
+
+    @override_settings(IDEMPOTENCY={'WAIT': 0})
+    def test_request_in_progress_elsewhere_is_a_conflict(self):
+        payload = calculation_payload(self.origin)
+        self.post('/api/calculations/', payload)
+        # As if another worker had just claimed the key and were still running
+        get_keys().update(status_code=None, response_data=None)
+        response = self.post('/api/calculations/', payload)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(CostCalculation.objects.for_user(self.user).count(), 1)
+
+    def test_abandoned_claim_is_taken_over(self):
+        payload = calculation_payload(self.origin)
+        self.post('/api/calculations/', payload)
+        get_keys().update(status_code=None, response_data=None, created_at=timezone.now() - timedelta(minutes=5))
+        response = self.post('/api/calculations/', payload)
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(get_keys().get().status_code, 201)
+
+    def test_prune_deletes_expired_keys(self):
+        self.post('/api/calculations/', calculation_payload(self.origin), key='old')
+        self.post('/api/calculations/', calculation_payload(self.origin), key='new')
+        get_keys().filter(pk=get_keys().order_by('pk').first().pk).update(
+            created_at=timezone.now() - timedelta(days=2),
+        )
+        call_command('prune_idempotency_keys', stdout=StringIO())
+        self.assertEqual(get_keys().count(), 1)
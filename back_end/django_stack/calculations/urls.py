@@ -17,6 +17,7 @@ urlpatterns = [
     path('<int:pk>/', views.CostCalculationDetailView.as_view(), name='calculation-detail'),
     path('<int:pk>/duplicate/', views.CostCalculationDuplicateView.as_view(), name='calculation-duplicate'),
     path('<int:pk>/toggle-favorite/', views.toggle_calculation_favorite, name='toggle-favorite'),
+    path('<int:pk>/report.<str:extension>', views.CalculationReportView.as_view(), name='calculation-report'),
     
     # Calculation Notes
     path('<int:calculation_pk>/notes/', views.CalculationNoteListCreateView.as_view(), name='calculation-notes'),
@@ -24,5 +25,7 @@ urlpatterns = [
     
     # Dashboard & Utilities
     path('dashboard/', views.user_dashboard_data, name='dashboard'),
+    path('bootstrap/', views.bootstrap, name='bootstrap'),
     path('compare-states/', views.states_comparison_data, name='compare-states'),
+    path('percentiles/', views.expense_percentiles, name='expense-percentiles'),
 ]
\ No newline at end of file
@@ -1,78 +1,105 @@
 # calculations/views.py
 
 from rest_framework import generics, status, permissions
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes, throttle_scope
+from rest_framework.negotiation import BaseContentNegotiation
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
 from django.contrib.auth import authenticate
+from concurrent.futures import TimeoutError as RenderTimeout
+from decimal import Decimal, InvalidOperation
 from django.contrib.auth.models import User
 from django.db import models  # ADDED: Missing import for models.Avg
+from django.http import Http404
 from django.shortcuts import get_object_or_404  # ADDED: Missing import
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
 
-from .models import CostCalculation, UserProfile, CalculationNote
+from mysite.idempotency import IdempotentMixin, idempotent
+from mysite.response_cache import CachedResponseMixin, cache_response
+from mysite.throttling import ScopedBucketThrottle
+from .archive import rehydrate, rehydrate_all, wants_archived
+from .authentication import login_token
+from .bootstrap import bootstrap_payload
+from .executors import ExecutorBusy, report_rendering_executor
+from .models import CostCalculation, CalculationNote
 from state_data.models import StateData
+from state_data.catalog import get_catalog
+from state_data.views import comparison_cache_tags
+from .profiles import get_profile_payload, get_profile_queryset
+from .percentiles import CATEGORIES as EXPENSE_CATEGORIES, RELATIVE_ACCURACY, get_sketch_catalog
+from .reports import (
+    CONTENT_TYPES, prepare_report, render_in_pool, report_not_modified, report_response, report_wait
+)
 from .serializers import (
     CostCalculationSerializer, CostCalculationSummarySerializer,
     UserProfileSerializer, UserRegistrationSerializer, 
     CalculationNoteSerializer, StateDataSerializer
 )
 
+def get_calculation_or_404(user, pk):
+    """The user's calculation ``pk``, brought back from the archive if it was archived"""
+    calculations = CostCalculation.objects.for_user(user)
+    try:
+        return calculations.get(pk=pk)
+    except CostCalculation.DoesNotExist:
+        pass
+    # Looked up again whatever rehydrate() says: a concurrent request may have restored it first
+    rehydrate(user, pk)
+    try:
+        return calculations.get(pk=pk)
+    except CostCalculation.DoesNotExist:
+        raise Http404('No CostCalculation matches the given query.')
+
 # Authentication Views
+def auth_response_data(user, token, profile_data):
+    """Payload returned by login and registration"""
+    return {
+        'token': token.key,
+        'user': {
+            'id': user.id,
+            'username': user.username,
+            'email': user.email,
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+        },
+        'profile': profile_data
+    }
+
 class CustomAuthToken(ObtainAuthToken):
     """Custom auth token view that returns user data along with token"""
+    throttle_classes = [ScopedBucketThrottle]
+    throttle_scope = 'login'
     
     def post(self, request, *args, **kwargs):
         serializer = self.serializer_class(data=request.data,
                                            context={'request': request})
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data['user']
-        token, created = Token.objects.get_or_create(user=user)
+        token = login_token(user)
         
-        # Get or create user profile
-        profile, created = UserProfile.objects.get_or_create(user=user)
-        
-        return Response({
-            'token': token.key,
-            'user': {
-                'id': user.id,
-                'username': user.username,
-                'email': user.email,
-                'first_name': user.first_name,
-                'last_name': user.last_name,
-            },
-            'profile': UserProfileSerializer(profile).data
-        })
+        return Response(auth_response_data(user, token, get_profile_payload(user)))
 
 class UserRegistrationView(generics.CreateAPIView):
     """User registration endpoint"""
     queryset = User.objects.all()
     serializer_class = UserRegistrationSerializer
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [ScopedBucketThrottle]
+    throttle_scope = 'register'
     
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = serializer.save()
         
-        # Create user profile
-        profile = UserProfile.objects.create(user=user)
-        
-        # Create auth token
-        token, created = Token.objects.get_or_create(user=user)
+        # Profile is created by the post_save signal; the token is new, so no lookup needed
+        token = Token.objects.create(user=user)
         
         return Response({
-            'token': token.key,
-            'user': {
-                'id': user.id,
-                'username': user.username,
-                'email': user.email,
-                'first_name': user.first_name,
-                'last_name': user.last_name,
-            },
-            'profile': UserProfileSerializer(profile).data,
+            **auth_response_data(user, token, UserProfileSerializer(user.profile).data),
             'message': 'User created successfully'
         }, status=status.HTTP_201_CREATED)
 
@@ -92,29 +119,37 @@ class UserProfileView(generics.RetrieveUpdateAPIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def get_object(self):
-        profile, created = UserProfile.objects.get_or_create(user=self.request.user)
-        return profile
+        return get_object_or_404(get_profile_queryset(), user=self.request.user)
+    
+    def retrieve(self, request, *args, **kwargs):
+        return Response(get_profile_payload(request.user))
 
 # State Data Views
-class StateDataListView(generics.ListAPIView):
+class StateDataListView(CachedResponseMixin, generics.ListAPIView):
     """List all states with their cost of living data"""
+    cache_tags = ['states']
+    cache_precompress = True
     queryset = StateData.objects.all()
     serializer_class = StateDataSerializer
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [ScopedBucketThrottle]
+    throttle_scope = 'state_catalog'
     filter_backends = [SearchFilter, OrderingFilter]
     search_fields = ['state_name', 'state_code']
     ordering_fields = ['state_name', 'cost_of_living_index']
     ordering = ['state_name']
 
-class StateDataDetailView(generics.RetrieveAPIView):
+class StateDataDetailView(CachedResponseMixin, generics.RetrieveAPIView):
     """Get detailed information about a specific state"""
+    cache_tags = ['state:{pk}']
     queryset = StateData.objects.all()
     serializer_class = StateDataSerializer
     permission_classes = [permissions.AllowAny]
 
 # Cost Calculation Views
-class CostCalculationListCreateView(generics.ListCreateAPIView):
+class CostCalculationListCreateView(IdempotentMixin, CachedResponseMixin, generics.ListCreateAPIView):
     """List user's calculations and create new ones"""
+    cache_tags = ['user:{user_id}:calculations', 'states']
     serializer_class = CostCalculationSerializer
     permission_classes = [permissions.IsAuthenticated]
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
@@ -124,68 +159,34 @@ class CostCalculationListCreateView(generics.ListCreateAPIView):
     ordering = ['-updated_at']
     
     def get_queryset(self):
-        return CostCalculation.objects.filter(user=self.request.user)
+        return CostCalculation.objects.for_user(self.request.user)
     
     def get_serializer_class(self):
         if self.request.method == 'GET':
             return CostCalculationSummarySerializer
         return CostCalculationSerializer
-
-class CostCalculationDetailView(generics.RetrieveUpdateDestroyAPIView):
-    """Get, update, or delete a specific calculation"""
-    serializer_class = CostCalculationSerializer
-    permission_classes = [permissions.IsAuthenticated]
-    
-    def get_queryset(self):
-        return CostCalculation.objects.filter(user=self.request.user)
-
-class CostCalculationDuplicateView(generics.CreateAPIView):
-    """Duplicate an existing calculation"""
-    serializer_class = CostCalculationSerializer
-    permission_classes = [permissions.IsAuthenticated]
     
-    def create(self, request, *args, **kwargs):
-        # FIXED: Use proper get_object_or_404 import
-        original_calculation = get_object_or_404(
-            CostCalculation.objects.filter(user=request.user),
-            pk=kwargs['pk']
-        )
-        
-        # Create a copy with modified name
-        calculation_data = CostCalculationSerializer(original_calculation).data
-        calculation_data['calculation_name'] = f"Copy of {calculation_data['calculation_name']}"
-        calculation_data['is_favorite'] = False
-        
-        # Remove read-only fields
-        for field in ['id', 'user', 'created_at', 'updated_at', 'notes']:
-            calculation_data.pop(field, None)
-        
-        serializer = self.get_serializer(data=calculation_data)
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
-        
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+    def list(self, request, *args, **kwargs):
+        # Archived calculations are left out unless asked for, which brings them back
+        if wants_archived(request.query_params):
+            rehydrate_all(request.user)
+        return super().list(request, *args, **kwargs)
 
 # Calculation Notes Views
-class CalculationNoteListCreateView(generics.ListCreateAPIView):
+class CalculationNoteListCreateView(IdempotentMixin, generics.ListCreateAPIView):
     """List and create notes for a calculation"""
     serializer_class = CalculationNoteSerializer
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
         calculation_id = self.kwargs['calculation_pk']
-        return CalculationNote.objects.filter(
-            calculation_id=calculation_id,
-            calculation__user=self.request.user
+        return CalculationNote.objects.for_user(self.request.user).filter(
+            calculation_id=calculation_id
         )
     
     def perform_create(self, serializer):
         calculation_id = self.kwargs['calculation_pk']
-        # FIXED: Use proper get_object_or_404 import
-        calculation = get_object_or_404(
-            CostCalculation.objects.filter(user=self.request.user),
-            pk=calculation_id
-        )
+        calculation = get_calculation_or_404(self.request.user, calculation_id)
         serializer.save(calculation=calculation)
 
 class CalculationNoteDetailView(generics.RetrieveUpdateDestroyAPIView):
@@ -195,18 +196,18 @@ class CalculationNoteDetailView(generics.RetrieveUpdateDestroyAPIView):
     
     def get_queryset(self):
         calculation_id = self.kwargs['calculation_pk']
-        return CalculationNote.objects.filter(
-            calculation_id=calculation_id,
-            calculation__user=self.request.user
+        return CalculationNote.objects.for_user(self.request.user).filter(
+            calculation_id=calculation_id
         )
 
 # Utility Views
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
+@cache_response(['user:{user_id}:calculations', 'states'])
 def user_dashboard_data(request):
     """Get dashboard summary data for the user"""
     user = request.user
-    calculations = CostCalculation.objects.filter(user=user)
+    calculations = CostCalculation.objects.for_user(user)
     
     # Calculate summary statistics
     total_calculations = calculations.count()
@@ -234,27 +235,19 @@ def user_dashboard_data(request):
         'worst_savings_scenario': CostCalculationSummarySerializer(worst_savings).data if worst_savings else None,
     })
 
-@api_view(['POST'])
+@api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
-def toggle_calculation_favorite(request, pk):
-    """Toggle the favorite status of a calculation"""
-    # FIXED: Use proper get_object_or_404 import
-    calculation = get_object_or_404(
-        CostCalculation.objects.filter(user=request.user),
-        pk=pk
-    )
-    
-    calculation.is_favorite = not calculation.is_favorite
-    calculation.save()
-    
-    return Response({
-        'id': calculation.id,
-        'is_favorite': calculation.is_favorite,
-        'message': f"Calculation {'added to' if calculation.is_favorite else 'removed from'} favorites"
-    })
+def bootstrap(request):
+    """Profile, state catalog, dashboard and first calculation page in one response"""
+    return Response(bootstrap_payload(
+        request, request.query_params.get('states_version'), request.query_params.get('ordering'),
+    ))
 
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
+@throttle_classes([ScopedBucketThrottle])
+@throttle_scope('state_compare')
+@cache_response(comparison_cache_tags, precompress=True)
 def states_comparison_data(request):
     """Get comparison data between states"""
     origin_state_id = request.GET.get('origin')
@@ -263,53 +256,76 @@ def states_comparison_data(request):
     if not origin_state_id:
         return Response({'error': 'Origin state is required'}, status=status.HTTP_400_BAD_REQUEST)
     
-    try:
-        origin_state = StateData.objects.get(pk=origin_state_id)
-        
-        # Default to Maine if no destination specified
-        if destination_state_id:
-            destination_state = StateData.objects.get(pk=destination_state_id)
-        else:
-            destination_state = StateData.objects.get(state_code='ME')
-        
-        # Calculate ratios
-        housing_ratio = destination_state.housing_index / origin_state.housing_index
-        utilities_ratio = destination_state.utilities_index / origin_state.utilities_index
-        grocery_ratio = destination_state.grocery_index / origin_state.grocery_index
-        transportation_ratio = destination_state.transportation_index / origin_state.transportation_index
-        overall_col_ratio = destination_state.cost_of_living_index / origin_state.cost_of_living_index
-        
-        return Response({
-            'origin_state': StateDataSerializer(origin_state).data,
-            'destination_state': StateDataSerializer(destination_state).data,
-            'comparison_ratios': {
-                'housing': round(housing_ratio, 3),
-                'utilities': round(utilities_ratio, 3),
-                'groceries': round(grocery_ratio, 3),
-                'transportation': round(transportation_ratio, 3),
-                'overall_cost_of_living': round(overall_col_ratio, 3),
-            },
-            'percentage_changes': {
-                'housing': round((housing_ratio - 1) * 100, 1),
-                'utilities': round((utilities_ratio - 1) * 100, 1),
-                'groceries': round((grocery_ratio - 1) * 100, 1),
-                'transportation': round((transportation_ratio - 1) * 100, 1),
-                'overall_cost_of_living': round((overall_col_ratio - 1) * 100, 1),
-            }
-        })
-        
-    except StateData.DoesNotExist:
+    catalog = get_catalog()
+    # Default to Maine if no destination specified
+    origin_state, destination_state = catalog.resolve(origin_state_id, destination_state_id)
+    if origin_state is None or destination_state is None:
         return Response({'error': 'State not found'}, status=status.HTTP_404_NOT_FOUND)
     
-    # Add these to your calculations/views.py
+    return Response(catalog.comparison(origin_state, destination_state, StateDataSerializer))
+
 
-class CostCalculationDetailView(generics.RetrieveUpdateDestroyAPIView):
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def expense_percentiles(request):
+    """Percentile ranks of monthly expenses among calculations from the same origin state"""
+    origin_state_id = request.query_params.get('origin')
+    if not origin_state_id:
+        return Response({'error': 'Origin state is required'}, status=status.HTTP_400_BAD_REQUEST)
+    origin_state, _ = get_catalog().resolve(origin_state_id)
+    if origin_state is None:
+        return Response({'error': 'State not found'}, status=status.HTTP_404_NOT_FOUND)
+    
+    amounts = {}
+    for category in EXPENSE_CATEGORIES:
+        raw = request.query_params.get(category)
+        if raw is None:
+            continue
+        try:
+            amount = Decimal(raw)
+        except InvalidOperation:
+            amount = None
+        if amount is None or not amount.is_finite() or amount < 0:
+            return Response({'error': f'{category} must be a non-negative amount'}, status=status.HTTP_400_BAD_REQUEST)
+        amounts[category] = amount
+    if not amounts:
+        return Response(
+            {'error': f"Give at least one of: {', '.join(EXPENSE_CATEGORIES)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    sketches = get_sketch_catalog()
+    percentiles = {}
+    for category, amount in amounts.items():
+        percentile, sample_size = sketches.percentile(origin_state.pk, category, amount)
+        percentiles[category] = {
+            'value': str(amount),
+            'percentile': None if percentile is None else round(percentile, 1),
+            'sample_size': sample_size,
+        }
+    return Response({
+        'origin_state': origin_state.state_code,
+        # Error bound documented in calculations/percentiles.py
+        'relative_accuracy': RELATIVE_ACCURACY,
+        'percentiles': percentiles,
+    })
+
+class CostCalculationDetailView(CachedResponseMixin, generics.RetrieveUpdateDestroyAPIView):
     """Get, update, or delete a specific calculation"""
+    cache_tags = ['calculation:{pk}', 'user:{user_id}', 'states', 'regions']
     serializer_class = CostCalculationSerializer
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
-        return CostCalculation.objects.filter(user=self.request.user)
+        return CostCalculation.objects.for_user(self.request.user)
+    
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            # Looked up again whatever rehydrate() says: a concurrent request may have restored it first
+            rehydrate(self.request.user, self.kwargs['pk'])
+            return super().get_object()
     
     def destroy(self, request, *args, **kwargs):
         """Delete a calculation with proper response"""
@@ -320,43 +336,68 @@ class CostCalculationDetailView(generics.RetrieveUpdateDestroyAPIView):
             'message': f'Calculation "{calculation_name}" deleted successfully'
         }, status=status.HTTP_200_OK)
 
-class CostCalculationDuplicateView(generics.CreateAPIView):
+class CostCalculationDuplicateView(IdempotentMixin, generics.CreateAPIView):
     """Duplicate an existing calculation"""
     serializer_class = CostCalculationSerializer
     permission_classes = [permissions.IsAuthenticated]
     
     def create(self, request, *args, **kwargs):
-        original_calculation = get_object_or_404(
-            CostCalculation.objects.filter(user=request.user),
-            pk=kwargs['pk']
-        )
+        original_calculation = get_calculation_or_404(request.user, kwargs['pk'])
         
-        # Create a copy with modified name
-        calculation_data = CostCalculationSerializer(original_calculation).data
-        calculation_data['calculation_name'] = f"Copy of {calculation_data['calculation_name']}"
-        calculation_data['is_favorite'] = False
-        
-        # Remove read-only fields
-        for field in ['id', 'user', 'created_at', 'updated_at', 'notes']:
-            calculation_data.pop(field, None)
-        
-        serializer = self.get_serializer(data=calculation_data)
-        serializer.is_valid(raise_exception=True)
-        new_calculation = serializer.save()
+        # Copied model to model, so the copy is one INSERT without a round trip through the API fields
+        serializer = self.get_serializer()
+        new_calculation = serializer.duplicate(original_calculation)
         
         return Response({
             'message': f'Calculation duplicated successfully',
-            'calculation': serializer.data
+            'calculation': self.get_serializer(new_calculation).data
         }, status=status.HTTP_201_CREATED)
 
+class ReportContentNegotiation(BaseContentNegotiation):
+    """The URL names the report's format, so Accept is not checked; errors are rendered as JSON"""
+
+    def select_parser(self, request, parsers):
+        return parsers[0] if parsers else None
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+class CalculationReportView(APIView):
+    """Printable report for a calculation, as report.html or report.pdf (see calculations/reports.py)"""
+    permission_classes = [permissions.IsAuthenticated]
+    content_negotiation_class = ReportContentNegotiation
+    
+    def get(self, request, pk, extension):
+        if extension not in CONTENT_TYPES:
+            raise Http404('Reports are available as .html or .pdf')
+        report = prepare_report(get_calculation_or_404(request.user, pk), extension)
+        not_modified = report_not_modified(request, report)
+        if not_modified is not None:
+            return not_modified
+        
+        if not report.path.exists():
+            try:
+                render_in_pool(report).result(timeout=report_wait())
+            except ExecutorBusy as e:
+                return Response(
+                    {'detail': 'Server is busy, please retry shortly.'},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': str(e.retry_after)}
+                )
+            except RenderTimeout:
+                # Still rendering; the retry finds the file or joins the same render
+                return Response(
+                    {'detail': 'The report is being prepared, please retry shortly.'},
+                    status=status.HTTP_202_ACCEPTED,
+                    headers={'Retry-After': str(report_rendering_executor.retry_after)}
+                )
+        return report_response(report, f'calculation-{pk}-report.{extension}')
+
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
+@idempotent
 def toggle_calculation_favorite(request, pk):
     """Toggle the favorite status of a calculation"""
-    calculation = get_object_or_404(
-        CostCalculation.objects.filter(user=request.user),
-        pk=pk
-    )
+    calculation = get_calculation_or_404(request.user, pk)
     
     calculation.is_favorite = not calculation.is_favorite
     calculation.save()
@@ -0,0 +1,25 @@
+# gunicorn.conf.py
+# gunicorn picks this file up from the working directory:
+#     METRICS_MULTIPROCESS_DIR=/tmp/mysite-metrics gunicorn mysite.wsgi --workers 4
+
+# Import (and warm up, see mysite/warmup.py) the app once in the master so
+# workers start warm and share the primed caches copy-on-write
+preload_app = True
+
+
+def post_worker_init(worker):
+    """Open this worker's own database connections; readiness follows warm-up"""
+    from mysite.warmup import warm_up
+    warm_up()
+
+
+def child_exit(server, worker):
+    """Fold a dead worker's counters into the metrics archive, even if it was killed"""
+    from mysite.metrics import mark_process_dead
+    mark_process_dead(worker.pid)
+
+
+def worker_exit(server, worker):
+    """Merge this worker's buffered percentile sketch changes before it goes"""
+    from calculations.percentiles import sketch_buffer
+    sketch_buffer.close()
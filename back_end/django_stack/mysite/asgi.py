@@ -12,5 +12,12 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
+# Route login/registration (and other async views) to their native async versions
+os.environ.setdefault('DJANGO_ROOT_URLCONF', 'mysite.asgi_urls')
 
 application = get_asgi_application()
+
+# Prime caches now; connections are opened per worker (gunicorn.conf.py post_worker_init)
+from mysite.warmup import start_warm_up  # noqa: E402
+
+start_warm_up(connect=False)
@@ -0,0 +1,18 @@
+"""
+URL configuration used when serving through mysite.asgi.
+
+Async views are matched first and shadow their sync counterparts at the same
+paths; every other route falls through to mysite.urls.
+"""
+
+from django.urls import path, include
+
+from . import views
+from .urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    # Long-lived streams only make sense where an idle connection does not hold a thread
+    path('api/events/', views.events, name='events'),
+    path('api/calculations/', include('calculations.async_urls')),
+    path('api/states/', include('state_data.async_urls')),
+] + sync_urlpatterns
@@ -0,0 +1,127 @@
+# mysite/async_api.py
+"""
+Helpers for native async API views served under mysite.asgi.
+
+DRF views are sync-only, so under ASGI every request pays a thread hop.
+``async_api_view`` gives a plain Django coroutine the parts of DRF the read
+endpoints rely on: token authentication, permission check, throttling and
+rendering with the configured JSON renderer. Methods the coroutine does not
+handle are delegated to the existing sync DRF view.
+"""
+
+import functools
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.settings import api_settings
+
+
+def api_response(data, status=status.HTTP_200_OK, headers=None):
+    """Render ``data`` with the first configured DRF renderer, exactly as a DRF Response would"""
+    renderer = api_settings.DEFAULT_RENDERER_CLASSES[0]()
+    response = HttpResponse(
+        renderer.render(data),
+        status=status,
+        content_type=f'{renderer.media_type}; charset={renderer.charset}' if renderer.charset else renderer.media_type,
+    )
+    for name, value in (headers or {}).items():
+        response[name] = value
+    return response
+
+
+def error_response(exc):
+    """Turn a DRF APIException into the same response DRF's exception handler produces"""
+    headers = {}
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        exc.status_code = status.HTTP_401_UNAUTHORIZED
+        headers['WWW-Authenticate'] = 'Token'
+    if getattr(exc, 'wait', None):
+        headers['Retry-After'] = '%d' % exc.wait
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    return api_response(data, status=exc.status_code, headers=headers)
+
+
+async def authenticate(request):
+    """Set request.user/request.auth from the configured token authentication"""
+    request.user, request.auth = AnonymousUser(), None
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        authenticator = authentication_class()
+        if not hasattr(authenticator, 'aauthenticate'):
+            continue
+        result = await authenticator.aauthenticate(request)
+        if result is not None:
+            request.user, request.auth = result
+            return
+
+
+class ThrottleScope:
+    """Stand-in for a DRF view, which throttles consult for ``throttle_scope``"""
+
+    def __init__(self, throttle_scope):
+        self.throttle_scope = throttle_scope
+
+
+def check_throttles(request, throttle_classes, scope):
+    view = ThrottleScope(scope)
+    durations = []
+    for throttle_class in throttle_classes:
+        throttle = throttle_class()
+        if not throttle.allow_request(request, view):
+            durations.append(throttle.wait())
+    if durations:
+        waits = [duration for duration in durations if duration is not None]
+        raise exceptions.Throttled(max(waits) if waits else None)
+
+
+def async_throttle(throttle_classes, throttle_scope):
+    """
+    Throttle a coroutine view that does its own parsing and authenticates
+    nobody (login, registration). The request counts as anonymous, so the
+    buckets are kept per client IP.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def view(request, *args, **kwargs):
+            request.user, request.auth = AnonymousUser(), None
+            try:
+                check_throttles(request, throttle_classes, throttle_scope)
+            except exceptions.Throttled as exc:
+                return error_response(exc)
+            return await func(request, *args, **kwargs)
+
+        return view
+    return decorator
+
+
+def async_api_view(permission='authenticated', throttle_classes=None, throttle_scope=None, fallback=None):
+    """
+    Decorate a coroutine handling GET (and HEAD) for an API endpoint.
+
+    ``permission`` is 'authenticated' or 'any'; ``throttle_classes`` defaults
+    to DEFAULT_THROTTLE_CLASSES; ``fallback`` is the sync view that serves
+    every other method.
+    """
+    def decorator(func):
+        @csrf_exempt
+        @functools.wraps(func)
+        async def view(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                if fallback is None:
+                    return error_response(exceptions.MethodNotAllowed(request.method))
+                return await sync_to_async(fallback)(request, *args, **kwargs)
+
+            try:
+                await authenticate(request)
+                if permission == 'authenticated' and not request.user.is_authenticated:
+                    raise exceptions.NotAuthenticated()
+                classes = throttle_classes if throttle_classes is not None else api_settings.DEFAULT_THROTTLE_CLASSES
+                check_throttles(request, classes, throttle_scope)
+                return await func(request, *args, **kwargs)
+            except exceptions.APIException as exc:
+                return error_response(exc)
+
+        return view
+    return decorator
@@ -0,0 +1,117 @@
+# mysite/checks.py
+"""
+System checks for what every worker has to share.
+
+Tag versions (mysite/response_cache.py), which invalidate cached responses,
+revoke cached auth tokens and tell the in-process catalogs to reload, cached
+profile payloads,
+read-your-writes stickiness and, when THROTTLING['BACKEND'] is 'cache',
+throttle buckets all live in Django caches. In a per-process cache a write
+only invalidates the worker that handled it, and the others keep serving
+what they had. ``check --deploy`` also requires Redis or Memcached for
+them: FileBasedCache is shared but slow, and unpickles whatever anyone who
+can write its directory puts there. It also requires a /metrics token,
+without which production refuses every scrape. Registered from
+CalculationsConfig.ready().
+"""
+
+import os
+import stat
+
+from django.conf import settings
+from django.core import checks
+
+PER_PROCESS_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+FILE_BACKEND = 'django.core.cache.backends.filebased.FileBasedCache'
+
+PRODUCTION_BACKENDS = (
+    'django.core.cache.backends.redis.RedisCache',
+    'django.core.cache.backends.memcached.PyMemcacheCache',
+    'django.core.cache.backends.memcached.PyLibMCCache',
+)
+
+
+def shared_cache_aliases():
+    """{cache alias: what needs it shared}"""
+    from .db_routers import routing_setting
+    from .response_cache import response_cache_setting
+    from .throttling import throttling_setting
+
+    aliases = {'default': ['cached profiles']}
+    aliases.setdefault(response_cache_setting('CACHE_ALIAS'), []).append('response cache tags and token revocation')
+    if routing_setting('REPLICAS'):
+        aliases.setdefault(routing_setting('CACHE_ALIAS'), []).append('read-your-writes stickiness')
+    if throttling_setting('BACKEND') == 'cache':
+        aliases.setdefault(throttling_setting('CACHE_ALIAS'), []).append('throttle buckets')
+    return aliases
+
+
+def writable_by_others(path):
+    """
+    Whether other users can put files in directory ``path``: it is group- or
+    world-writable, or it does not exist yet and anyone could create it
+    first (its nearest existing parent is world-writable, as /tmp is).
+    """
+    path = os.path.abspath(path)
+    if os.path.exists(path):
+        return bool(os.stat(path).st_mode & (stat.S_IWGRP | stat.S_IWOTH))
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    return bool(os.stat(path).st_mode & stat.S_IWOTH)
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_caches(app_configs, **kwargs):
+    messages = []
+    for alias, uses in shared_cache_aliases().items():
+        backend = settings.CACHES.get(alias, {}).get('BACKEND')
+        if backend in PER_PROCESS_BACKENDS:
+            # A single runserver process is fine; anything with several workers is not
+            message_class, id = (checks.Warning, 'mysite.W001') if settings.DEBUG else (checks.Error, 'mysite.E001')
+            messages.append(message_class(
+                f"CACHES['{alias}'] uses {backend.rsplit('.', 1)[-1]}, which is not shared between processes "
+                f"(needed for: {', '.join(uses)}).",
+                hint='Set CACHE_BACKEND to RedisCache (or FileBasedCache for local development).',
+                id=id,
+            ))
+            continue
+        if backend == FILE_BACKEND and writable_by_others(settings.CACHES[alias]['LOCATION']):
+            messages.append(checks.Error(
+                f"CACHES['{alias}'] LOCATION {settings.CACHES[alias]['LOCATION']} can be written by other users, "
+                f"and FileBasedCache unpickles what it reads from there.",
+                hint='Point CACHE_LOCATION at a directory only this project can write (chmod 700).',
+                id='mysite.E003',
+            ))
+    return messages
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_production_caches(app_configs, **kwargs):
+    messages = []
+    for alias, uses in shared_cache_aliases().items():
+        backend = settings.CACHES.get(alias, {}).get('BACKEND')
+        if backend not in PRODUCTION_BACKENDS:
+            messages.append(checks.Error(
+                f"CACHES['{alias}'] uses {backend.rsplit('.', 1)[-1]}, which is not a production cache "
+                f"(needed for: {', '.join(uses)}).",
+                hint='Set CACHE_BACKEND to RedisCache or PyMemcacheCache and CACHE_LOCATION to its server.',
+                id='mysite.E002',
+            ))
+    return messages
+
+
+@checks.register(checks.Tags.security, deploy=True)
+def check_metrics_token(app_configs, **kwargs):
+    from .metrics import metrics_setting
+
+    if metrics_setting('AUTH_TOKEN'):
+        return []
+    return [checks.Error(
+        "METRICS['AUTH_TOKEN'] is empty, so /metrics refuses every scrape unless DEBUG is on.",
+        hint='Set METRICS_AUTH_TOKEN and have Prometheus send it as a bearer token.',
+        id='mysite.E004',
+    )]
@@ -0,0 +1,172 @@
+# mysite/compression.py
+"""
+Response compression: brotli when the client accepts it and the ``brotli``
+package is installed, gzip otherwise.
+
+Bodies smaller than COMPRESSION['MIN_SIZE'], streaming responses, already
+encoded ones and types that do not compress well are left alone. Responses
+that carry a ``content_version`` attribute (set by mysite.response_cache for
+views using ``precompress``, and by the async state views) always have the
+same body for the same version, so their compressed bytes are kept in a
+per-process LRU and compressed once, at a higher level, instead of on every
+request.
+"""
+
+import gzip
+import re
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+from .metrics import cache_requests
+from .middleware import HybridMiddleware
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+
+DEFAULT_COMPRESSION = {
+    'ENABLED': True,
+    'MIN_SIZE': 1024,
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 5,
+    # Versioned bodies are compressed once, so they can afford the slow levels
+    'CACHED_GZIP_LEVEL': 9,
+    'CACHED_BROTLI_QUALITY': 11,
+    'CACHE_MAX_BYTES': 16 * 1024 * 1024,
+}
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml', 'image/svg+xml')
+
+ACCEPT_ENCODING_PART = re.compile(r'^\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*$')
+
+
+def compression_setting(name):
+    return getattr(settings, 'COMPRESSION', {}).get(name, DEFAULT_COMPRESSION[name])
+
+
+def accepted_encodings(header):
+    """Encodings named in an Accept-Encoding header with a non-zero quality"""
+    accepted = set()
+    for part in header.split(','):
+        match = ACCEPT_ENCODING_PART.match(part)
+        if match is None:
+            continue
+        name, quality = match.group(1).lower(), match.group(2)
+        try:
+            if quality is not None and float(quality) <= 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(name)
+    return accepted
+
+
+def choose_encoding(header):
+    accepted = accepted_encodings(header)
+    if brotli is not None and ('br' in accepted or '*' in accepted):
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress(content, encoding, cached=False):
+    if encoding == 'br':
+        quality = compression_setting('CACHED_BROTLI_QUALITY' if cached else 'BROTLI_QUALITY')
+        return brotli.compress(content, quality=quality)
+    level = compression_setting('CACHED_GZIP_LEVEL' if cached else 'GZIP_LEVEL')
+    # mtime=0 keeps the output identical for identical input
+    return gzip.compress(content, compresslevel=level, mtime=0)
+
+
+class CompressedBodyCache:
+    """LRU of compressed bodies keyed by (content version, encoding), bounded by total size"""
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, length):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+        original_length, body = entry
+        # A version names one body; a different length means the view reused a version by mistake
+        return body if original_length == length else None
+
+    def set(self, key, length, body):
+        max_bytes = compression_setting('CACHE_MAX_BYTES')
+        if len(body) > max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous[1])
+            self.entries[key] = (length, body)
+            self.size += len(body)
+            while self.size > max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+compressed_bodies = CompressedBodyCache()
+
+
+class CompressionMiddleware(HybridMiddleware):
+    """Place it above any middleware that reads or changes the response body"""
+
+    def process_response(self, request, response):
+        if not compression_setting('ENABLED'):
+            return response
+        # Vary even when not compressing this one, so caches keep the variants apart
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        if (
+            response.streaming
+            or response.has_header('Content-Encoding')
+            or 'no-transform' in response.get('Cache-Control', '')
+            or not response.get('Content-Type', '').startswith(COMPRESSIBLE_TYPES)
+            or len(response.content) < compression_setting('MIN_SIZE')
+        ):
+            return response
+
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        content = response.content
+        version = getattr(response, 'content_version', None)
+        if version is None:
+            compressed = compress(content, encoding)
+        else:
+            key = (version, encoding)
+            compressed = compressed_bodies.get(key, len(content))
+            cache_requests.labels('compressed', 'miss' if compressed is None else 'hit').inc()
+            if compressed is None:
+                compressed = compress(content, encoding, cached=True)
+                compressed_bodies.set(key, len(content), compressed)
+
+        if len(compressed) >= len(content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        # The compressed body differs from the one a strong ETag was computed for
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
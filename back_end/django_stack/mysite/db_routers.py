@@ -0,0 +1,164 @@
+# mysite/db_routers.py
+"""
+Primary/replica database routing with read-your-writes stickiness.
+
+Writes always go to ``default``. Reads go to a random alias from
+DATABASE_ROUTING['REPLICAS'] unless the current request has written, is
+inside a transaction, or belongs to a client that wrote within the last
+STICKY_SECONDS (tracked by ReadYourWritesMiddleware through the shared
+cache, so stickiness holds across workers).
+"""
+
+import hashlib
+import random
+import threading
+from collections import Counter
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from .middleware import HybridMiddleware
+
+
+DEFAULT_DATABASE_ROUTING = {
+    'REPLICAS': [],
+    'STICKY_SECONDS': 5,
+    'CACHE_ALIAS': 'default',
+}
+
+
+def routing_setting(name):
+    return getattr(settings, 'DATABASE_ROUTING', {}).get(name, DEFAULT_DATABASE_ROUTING[name])
+
+
+class RoutingState:
+    """Per-request routing flags, shared with any threads the request hops to"""
+
+    __slots__ = ('pinned', 'wrote')
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+_routing_state = ContextVar('db_routing_state', default=None)
+
+
+class ReadReplicaRouter:
+    """Sends reads to replicas and writes to the primary"""
+
+    def db_for_read(self, model, **hints):
+        replicas = routing_setting('REPLICAS')
+        if not replicas:
+            return 'default'
+        state = _routing_state.get()
+        if state is not None and (state.pinned or state.wrote):
+            return 'default'
+        if connections['default'].in_atomic_block:
+            return 'default'
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db == 'default':
+            # Related objects of a row read from the primary come from the primary too
+            return 'default'
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        state = _routing_state.get()
+        if state is not None:
+            state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in routing_setting('REPLICAS')
+
+
+def sticky_cache_keys(request):
+    """Identities a recent write is remembered under: the auth token and the client address"""
+    keys = [f"rw:pin:ip:{request.META.get('REMOTE_ADDR', '')}"]
+    authorization = request.META.get('HTTP_AUTHORIZATION')
+    if authorization:
+        keys.append('rw:pin:auth:' + hashlib.sha1(authorization.encode()).hexdigest())
+    return keys
+
+
+class ReadYourWritesMiddleware(HybridMiddleware):
+    """Pins a client's reads to the primary for STICKY_SECONDS after it writes"""
+
+    def process_request(self, request):
+        pinned = False
+        if routing_setting('REPLICAS'):
+            cache = caches[routing_setting('CACHE_ALIAS')]
+            pinned = bool(cache.get_many(sticky_cache_keys(request)))
+        request._routing_token = _routing_state.set(RoutingState(pinned))
+        return None
+
+    def process_response(self, request, response):
+        token = getattr(request, '_routing_token', None)
+        if token is None:
+            return response
+        state = _routing_state.get()
+        if state is not None and state.wrote and routing_setting('REPLICAS'):
+            cache = caches[routing_setting('CACHE_ALIAS')]
+            cache.set_many(
+                {key: True for key in sticky_cache_keys(request)},
+                routing_setting('STICKY_SECONDS'),
+            )
+        _routing_state.reset(token)
+        return response
+
+
+# Per-alias query counters
+
+class QueryCounters:
+    """Process-wide count of reads and writes executed on each database alias"""
+
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, alias, sql):
+        kind = 'read' if sql.lstrip()[:6].upper() == 'SELECT' else 'write'
+        with self._lock:
+            self._counts[(alias, kind)] += 1
+
+    def snapshot(self):
+        """{alias: {'read': n, 'write': n}}"""
+        with self._lock:
+            counts = dict(self._counts)
+        result = {}
+        for (alias, kind), count in counts.items():
+            result.setdefault(alias, {'read': 0, 'write': 0})[kind] = count
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+query_counters = QueryCounters()
+
+
+class CountingWrapper:
+    """Execute wrapper that feeds query_counters for one connection"""
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def __call__(self, execute, sql, params, many, context):
+        query_counters.record(self.alias, sql)
+        return execute(sql, params, many, context)
+
+
+def install_query_counter(sender, connection, **kwargs):
+    if not any(isinstance(wrapper, CountingWrapper) for wrapper in connection.execute_wrappers):
+        connection.execute_wrappers.append(CountingWrapper(connection.alias))
+
+
+connection_created.connect(install_query_counter, dispatch_uid='mysite.db_routers.query_counters')
@@ -0,0 +1,291 @@
+# mysite/events.py
+"""
+Change notifications for server-sent events.
+
+Model signals publish small events (see calculations/signals.py and
+state_data/signals.py) to a channel, such as ``user:3`` or ``states``, once
+the transaction commits. Each event is encoded as an SSE message once and
+handed to every subscribed stream on that channel (mysite.views.events).
+
+A subscription is a deque and an asyncio.Event, and an idle stream is a
+task waiting on that event with a heartbeat timeout, so open connections
+cost next to nothing. Subscribers are grouped by event loop, so a publish
+from a sync thread wakes each loop once however many streams it serves.
+
+With EVENTS['BROKER_DIR'] set, every process that serves streams binds a
+Unix datagram socket ``events-<pid>.sock`` in that directory and publishers
+send each event to all of them, so writes handled by any worker (WSGI or
+ASGI) reach streams held by every ASGI worker on the box. Without it events
+stay within the process.
+
+A stream is authenticated once, when it opens, so it ends after
+EVENTS['MAX_AGE'] seconds and EventSource reconnects and authenticates
+again: a revoked token then gets a 401 instead of further events.
+"""
+
+import asyncio
+import atexit
+import errno
+import glob
+import json
+import os
+import socket
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import transaction
+
+
+DEFAULT_EVENTS = {
+    'BROKER_DIR': '',
+    'HEARTBEAT': 20,        # seconds between keep-alive comments on idle streams
+    'RETRY_MS': 5000,       # reconnection delay suggested to EventSource clients
+    'MAX_QUEUE': 100,       # undelivered events per stream before it is told to resync
+    'MAX_AGE': 30,          # seconds before a stream ends so the client reauthenticates; None for no limit
+}
+
+# Sent instead of the events a slow stream missed: the client should refetch everything
+RESYNC_MESSAGE = b'event: resync\ndata: {}\n\n'
+
+
+def events_setting(name):
+    return getattr(settings, 'EVENTS', {}).get(name, DEFAULT_EVENTS[name])
+
+
+def encode_event(event_type, data):
+    return f'event: {event_type}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'.encode()
+
+
+class Subscription:
+    """Messages waiting for one stream; only touched from its event loop"""
+
+    __slots__ = ('channels', 'loop', 'messages', 'ready', 'overflowed')
+
+    def __init__(self, channels, loop, max_queue):
+        self.channels = channels
+        self.loop = loop
+        self.messages = deque(maxlen=max_queue)
+        self.ready = asyncio.Event()
+        self.overflowed = False
+
+    def deliver(self, message):
+        if len(self.messages) == self.messages.maxlen:
+            self.overflowed = True
+        self.messages.append(message)
+        self.ready.set()
+
+    async def next_messages(self, timeout):
+        """Everything queued since the last call, or None after ``timeout`` seconds of silence"""
+        if not self.messages:
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        self.ready.clear()
+        if self.overflowed:
+            self.overflowed = False
+            self.messages.clear()
+            return [RESYNC_MESSAGE]
+        messages = list(self.messages)
+        self.messages.clear()
+        return messages
+
+
+def _deliver_all(subscriptions, message):
+    for subscription in subscriptions:
+        subscription.deliver(message)
+
+
+class EventBus:
+    """Channel -> subscriptions, safe to publish to from any thread"""
+
+    def __init__(self):
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channels):
+        subscription = Subscription(tuple(channels), asyncio.get_running_loop(), events_setting('MAX_QUEUE'))
+        with self._lock:
+            for channel in subscription.channels:
+                self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._channels.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._channels[channel]
+
+    def subscriber_count(self):
+        with self._lock:
+            return len({subscription for subscribers in self._channels.values() for subscription in subscribers})
+
+    def dispatch(self, channel, message):
+        with self._lock:
+            subscribers = self._channels.get(channel)
+            if not subscribers:
+                return
+            by_loop = {}
+            for subscription in subscribers:
+                by_loop.setdefault(subscription.loop, []).append(subscription)
+
+        try:
+            current_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            current_loop = None
+        for loop, subscriptions in by_loop.items():
+            if loop is current_loop:
+                _deliver_all(subscriptions, message)
+            elif not loop.is_closed():
+                loop.call_soon_threadsafe(_deliver_all, subscriptions, message)
+
+
+bus = EventBus()
+
+
+class SocketBroker:
+    """Fans events out to every process with a socket in ``directory``"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sender.setblocking(False)
+        self.listening = {}  # loop -> bound socket
+
+    def path_for(self, pid):
+        return os.path.join(self.directory, f'events-{pid}.sock')
+
+    def listen(self, loop):
+        """Bind this process's socket and dispatch what arrives on ``loop``"""
+        if loop in self.listening:
+            return
+        path = self.path_for(os.getpid())
+        if os.path.exists(path):
+            os.unlink(path)
+        receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        receiver.bind(path)
+        receiver.setblocking(False)
+        loop.add_reader(receiver.fileno(), self._receive, receiver)
+        if not self.listening:
+            atexit.register(self.close)
+        self.listening[loop] = receiver
+
+    def _receive(self, receiver):
+        while True:
+            try:
+                datagram = receiver.recv(65536)
+            except BlockingIOError:
+                return
+            channel, _, message = datagram.partition(b'\n')
+            bus.dispatch(channel.decode(), message)
+
+    def send(self, channel, message):
+        datagram = channel.encode() + b'\n' + message
+        for path in glob.glob(os.path.join(self.directory, 'events-*.sock')):
+            try:
+                self.sender.sendto(datagram, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Left behind by a process that is gone
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            except OSError as exc:
+                # A receiver that is not keeping up loses this event rather than blocking the writer
+                if exc.errno not in (errno.EAGAIN, errno.ENOBUFS):
+                    raise
+
+    def close(self):
+        for loop, receiver in self.listening.items():
+            if not loop.is_closed():
+                loop.remove_reader(receiver.fileno())
+            receiver.close()
+        self.listening.clear()
+        path = self.path_for(os.getpid())
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """The socket broker when EVENTS['BROKER_DIR'] is set, else None"""
+    global _broker
+    directory = events_setting('BROKER_DIR')
+    if not directory:
+        return None
+    if _broker is None or _broker.directory != directory:
+        with _broker_lock:
+            if _broker is None or _broker.directory != directory:
+                os.makedirs(directory, exist_ok=True)
+                _broker = SocketBroker(directory)
+    return _broker
+
+
+def _reset_after_fork():
+    # Sockets and loops belong to the parent; children bind their own on first subscribe
+    global _broker
+    _broker = None
+    bus._channels.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def subscribe(channels):
+    """Subscribe the running event loop to ``channels``; pair with unsubscribe()"""
+    broker = get_broker()
+    if broker is not None:
+        broker.listen(asyncio.get_running_loop())
+    return bus.subscribe(channels)
+
+
+def unsubscribe(subscription):
+    bus.unsubscribe(subscription)
+
+
+def publish(channel, event_type, data):
+    """Send an event to every stream subscribed to ``channel`` (in every process, with a broker)"""
+    message = encode_event(event_type, data)
+    broker = get_broker()
+    if broker is None:
+        bus.dispatch(channel, message)
+    else:
+        broker.send(channel, message)
+
+
+def publish_on_commit(channel, event_type, data_or_callable):
+    """publish() once the current transaction commits, so clients never refetch stale rows"""
+    def send():
+        data = data_or_callable() if callable(data_or_callable) else data_or_callable
+        publish(channel, event_type, data)
+    transaction.on_commit(send)
+
+
+async def event_stream(channels):
+    """SSE body for a stream subscribed to ``channels``: events as they arrive, comments as heartbeats"""
+    # Subscribing on first iteration means a response that is never sent leaves nothing behind
+    subscription = subscribe(channels)
+    heartbeat = events_setting('HEARTBEAT')
+    max_age = events_setting('MAX_AGE')
+    deadline = None if max_age is None else time.monotonic() + max_age
+    try:
+        yield f"retry: {events_setting('RETRY_MS')}\n: connected\n\n".encode()
+        while True:
+            timeout = heartbeat if deadline is None else min(heartbeat, deadline - time.monotonic())
+            if timeout <= 0:
+                return
+            messages = await subscription.next_messages(timeout)
+            if messages is not None:
+                yield b''.join(messages)
+            elif deadline is None or time.monotonic() < deadline:
+                yield b': keep-alive\n\n'
+    finally:
+        unsubscribe(subscription)
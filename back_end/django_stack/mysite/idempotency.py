@@ -0,0 +1,170 @@
+# mysite/idempotency.py
+"""
+Idempotency-Key support for mutating API endpoints.
+
+A client that sends ``Idempotency-Key: <unique string>`` with a POST can
+retry it safely: the first response is stored for TTL seconds under (user,
+key), with a hash of the method, path and body, and every retry with the
+same key and the same request gets that response back (marked
+``Idempotent-Replayed: true``) without the work being done again. The same
+key with a different request is refused with 422.
+
+Keys live in a table on ``default`` (IDEMPOTENCY['MODEL']) whose unique
+(user, key) constraint decides which request does the work, so retries are
+caught whichever worker or machine they land on. The first request inserts
+the row; a retry that arrives while it is still running waits for its
+response (polling, up to WAIT seconds) rather than racing it. If the first
+request fails without a response worth keeping (a 5xx or an exception),
+its row is removed and the next one in line does the work; a claim left
+behind by a crashed worker is taken over after LOCK_TIMEOUT seconds.
+Responses the view returns with a status below 500 are kept; errors raised
+as exceptions (validation errors, 404s) are not, so a retry just runs the
+same checks again. ``prune_idempotency_keys`` deletes expired rows.
+"""
+
+import functools
+import hashlib
+import time
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+
+DEFAULT_IDEMPOTENCY = {
+    'ENABLED': True,
+    'MODEL': 'calculations.IdempotencyKey',
+    'TTL': 24 * 60 * 60,
+    # Longest a request may hold a key; a crashed worker's claim is taken over after this
+    'LOCK_TIMEOUT': 60,
+    'WAIT': 10,
+    'POLL_INTERVAL': 0.05,
+    'MAX_KEY_LENGTH': 255,
+}
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+# Response headers worth replaying
+KEPT_HEADERS = ('Location',)
+
+
+def idempotency_setting(name):
+    return getattr(settings, 'IDEMPOTENCY', {}).get(name, DEFAULT_IDEMPOTENCY[name])
+
+
+def get_keys():
+    """The key table's rows, always on the primary: a replica may not have the claim yet"""
+    return apps.get_model(idempotency_setting('MODEL'))._base_manager.using('default')
+
+
+def request_fingerprint(request):
+    digest = hashlib.sha256()
+    for part in (request.method.encode(), request.path.encode(), request.body):
+        digest.update(part)
+        digest.update(b'\x1f')
+    return digest.hexdigest()
+
+
+def _replay(stored):
+    response = Response(stored.response_data, status=stored.status_code, headers=stored.response_headers)
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def _error(detail, status_code, headers=None):
+    return Response({'detail': detail}, status=status_code, headers=headers)
+
+
+def _claim(keys, user, key_hash, fingerprint):
+    """Insert the key's row; None if another request has it"""
+    try:
+        with transaction.atomic(using='default'):
+            return keys.create(user=user, key=key_hash, fingerprint=fingerprint, created_at=timezone.now())
+    except IntegrityError:
+        return None
+
+
+def _run(keys, claim, get_response):
+    try:
+        response = get_response()
+    except BaseException:
+        keys.filter(pk=claim.pk).delete()
+        raise
+    if isinstance(response, Response) and response.status_code < 500:
+        claim.status_code = response.status_code
+        claim.response_data = response.data
+        claim.response_headers = {name: response[name] for name in KEPT_HEADERS if response.has_header(name)}
+        claim.save(using='default', update_fields=['status_code', 'response_data', 'response_headers'])
+    else:
+        keys.filter(pk=claim.pk).delete()
+    return response
+
+
+def serve_idempotent(request, get_response):
+    """Call ``get_response`` once per Idempotency-Key and request; replay its response for retries"""
+    key = request.headers.get(HEADER)
+    user = getattr(request, 'user', None)
+    if not key or not idempotency_setting('ENABLED') or user is None or not user.is_authenticated:
+        return get_response()
+    if len(key) > idempotency_setting('MAX_KEY_LENGTH'):
+        return _error(f'{HEADER} is too long.', status.HTTP_400_BAD_REQUEST)
+
+    keys = get_keys()
+    fingerprint = request_fingerprint(request)
+    key_hash = hashlib.sha256(key.encode()).hexdigest()
+    deadline = time.monotonic() + idempotency_setting('WAIT')
+
+    while True:
+        claim = _claim(keys, user, key_hash, fingerprint)
+        if claim is not None:
+            return _run(keys, claim, get_response)
+
+        stored = keys.filter(user=user, key=key_hash).first()
+        if stored is None:
+            # The holder gave up between our insert and this read; claim it again
+            continue
+        now = timezone.now()
+        finished = stored.status_code is not None
+        lifetime = idempotency_setting('TTL') if finished else idempotency_setting('LOCK_TIMEOUT')
+        if stored.created_at < now - timedelta(seconds=lifetime):
+            # An expired response, or a claim its crashed worker never released
+            keys.filter(pk=stored.pk, created_at=stored.created_at).delete()
+            continue
+        if stored.fingerprint != fingerprint:
+            return _error(
+                f'{HEADER} was already used for a different request.',
+                status.HTTP_422_UNPROCESSABLE_ENTITY,
+            )
+        if finished:
+            return _replay(stored)
+
+        if time.monotonic() >= deadline:
+            return _error(
+                f'A request with this {HEADER} is still in progress.',
+                status.HTTP_409_CONFLICT,
+                headers={'Retry-After': '1'},
+            )
+        time.sleep(idempotency_setting('POLL_INTERVAL'))
+
+
+def idempotent(func):
+    """
+    Honour Idempotency-Key on an @api_view function. Apply it below @api_view
+    so authentication, permissions and throttles run first.
+    """
+    @functools.wraps(func)
+    def wrapper(request, *args, **kwargs):
+        return serve_idempotent(request, lambda: func(request, *args, **kwargs))
+    return wrapper
+
+
+class IdempotentMixin:
+    """Honours Idempotency-Key on a generic view's POST"""
+
+    def post(self, request, *args, **kwargs):
+        return serve_idempotent(request, lambda: super(IdempotentMixin, self).post(request, *args, **kwargs))
@@ -0,0 +1,244 @@
+# mysite/logs.py
+"""
+Structured, non-blocking logging.
+
+BackgroundHandler only enqueues records on the calling thread; a daemon
+thread formats them as JSON (JSONFormatter) and writes them out, so a slow
+stdout or log pipe never stalls a request. RequestLogMiddleware assigns each
+request an id and exposes it, the user id and the view to every record
+logged while the request runs (RequestContextFilter). SamplingFilter keeps a
+configurable fraction of each logger's records below WARNING.
+"""
+
+import atexit
+import copy
+import datetime
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+
+from django.utils.functional import SimpleLazyObject, empty
+
+from .middleware import HybridMiddleware
+
+
+_request_context = ContextVar('log_request_context', default=None)
+
+# Attributes every LogRecord has; anything else on a record came from ``extra``
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class RequestContext:
+    __slots__ = ('request_id', 'request')
+
+    def __init__(self, request_id, request):
+        self.request_id = request_id
+        self.request = request
+
+    def user_id(self):
+        # Only a user that authentication has already resolved; never trigger a lookup from logging
+        user = self.request.__dict__.get('user')
+        if user is None or isinstance(user, SimpleLazyObject) and user._wrapped is empty:
+            return None
+        return user.pk if user.is_authenticated else None
+
+    def view(self):
+        match = getattr(self.request, 'resolver_match', None)
+        return match.view_name if match is not None else None
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep ``rates[logger]`` of the records below WARNING from each logger.
+
+    The most specific configured name wins, so {'calculations': 0.1,
+    'calculations.views': 1.0} samples everything under calculations except
+    the views. Loggers with no configured rate are not sampled.
+    """
+
+    def __init__(self, rates=None, name=''):
+        super().__init__(name)
+        self.rates = dict(rates or {})
+        self._resolved = {}
+
+    def rate_for(self, logger_name):
+        rate = self._resolved.get(logger_name)
+        if rate is None:
+            rate, name = 1.0, logger_name
+            while name:
+                if name in self.rates:
+                    rate = self.rates[name]
+                    break
+                name = name.rpartition('.')[0]
+            self._resolved[logger_name] = rate
+        return rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate_for(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamp records with the current request's id, user id and view"""
+
+    def filter(self, record):
+        context = _request_context.get()
+        if context is not None:
+            record.request_id = context.request_id
+            record.user_id = context.user_id()
+            record.view = context.view()
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, request context and any ``extra`` fields"""
+
+    def format(self, record):
+        data = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exception'] = record.exc_text
+        if record.stack_info:
+            data['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(data, default=str)
+
+
+class BackgroundHandler(logging.Handler):
+    """
+    Hands records to a writer thread through a bounded queue.
+
+    The calling thread only merges the message arguments and enqueues; the
+    formatter configured for this handler runs on the writer thread. When
+    the queue is full the record is dropped and counted rather than
+    blocking, and the writer reports the count once it catches up.
+    """
+
+    def __init__(self, stream=None, max_queue=10000):
+        super().__init__()
+        self.target = logging.StreamHandler(stream or sys.stderr)
+        self.max_queue = max_queue
+        self.dropped = 0
+        self._start()
+        _background_handlers.append(self)
+
+    def _start(self):
+        self.queue = queue.Queue(self.max_queue)
+        self._thread = threading.Thread(target=self._drain, name='log-writer', daemon=True)
+        self._thread.start()
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def emit(self, record):
+        try:
+            record = copy.copy(record)
+            # Resolve arguments now: they may change or belong to this thread by the time the writer runs
+            record.msg, record.args = record.getMessage(), None
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def _drain(self):
+        reported = 0
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            if self.dropped != reported:
+                self.target.handle(logging.makeLogRecord({
+                    'name': 'mysite.logs', 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                    'msg': f'Log queue full, dropped {self.dropped - reported} records',
+                }))
+                reported = self.dropped
+            self.target.handle(record)
+
+    def flush(self, timeout=2.0):
+        """Wait (briefly) for queued records to be written"""
+        deadline = time.monotonic() + timeout
+        while not self.queue.empty() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.target.flush()
+
+    def close(self):
+        if self._thread.is_alive():
+            self.queue.put(None)
+            self._thread.join(2.0)
+        self.target.close()
+        super().close()
+
+
+_background_handlers = []
+
+
+def _restart_after_fork():
+    # The writer thread does not survive fork(); give each worker its own
+    for handler in _background_handlers:
+        handler._start()
+
+
+def _close_at_exit():
+    for handler in _background_handlers:
+        handler.close()
+
+
+os.register_at_fork(after_in_child=_restart_after_fork)
+atexit.register(_close_at_exit)
+
+
+# Request logging
+
+request_logger = logging.getLogger('mysite.request')
+
+REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+
+class RequestLogMiddleware(HybridMiddleware):
+    """Assigns a request id (or keeps a sane X-Request-ID) and logs one record per request; place it first"""
+
+    def process_request(self, request):
+        request_id = request.META.get('HTTP_X_REQUEST_ID', '')
+        if not REQUEST_ID.match(request_id):
+            request_id = uuid.uuid4().hex
+        request._log_start = time.perf_counter()
+        request._log_token = _request_context.set(RequestContext(request_id, request))
+        return None
+
+    def process_response(self, request, response):
+        token = getattr(request, '_log_token', None)
+        if token is None:
+            return response
+        context = token.var.get()
+        response['X-Request-ID'] = context.request_id
+        request_logger.info(
+            '%s %s %s', request.method, request.path, response.status_code,
+            extra={
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'duration_ms': round((time.perf_counter() - request._log_start) * 1000, 2),
+            },
+        )
+        _request_context.reset(token)
+        return response
@@ -0,0 +1,401 @@
+# mysite/metrics.py
+"""
+In-process metrics registry with Prometheus text exposition.
+
+Counters, gauges and histograms live in plain dicts guarded by a lock, so
+recording is a dict update. With METRICS['MULTIPROCESS_DIR'] set, each
+process writes its values to ``<dir>/metrics-<pid>.json`` at most once per
+FLUSH_INTERVAL and the scrape endpoint merges every file, so any gunicorn
+worker can answer for all of them. When a process exits (or gunicorn reports
+a worker dead through ``child_exit``), its counters and histograms are
+folded into ``metrics-archive.json`` and its gauges dropped.
+"""
+
+import atexit
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .middleware import HybridMiddleware
+from .performance import current_timings
+
+
+DEFAULT_METRICS = {
+    'MULTIPROCESS_DIR': '',
+    'FLUSH_INTERVAL': 1.0,
+    'AUTH_TOKEN': '',
+}
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+ARCHIVE_FILE = 'metrics-archive.json'
+
+
+def metrics_setting(name):
+    return getattr(settings, 'METRICS', {}).get(name, DEFAULT_METRICS[name])
+
+
+class MetricChild:
+    """One labelled series of a metric"""
+
+    __slots__ = ('metric', 'key')
+
+    def __init__(self, metric, key):
+        self.metric = metric
+        self.key = key
+
+    def inc(self, amount=1):
+        self.metric.inc_key(self.key, amount)
+
+    def dec(self, amount=1):
+        self.metric.inc_key(self.key, -amount)
+
+    def set(self, value):
+        self.metric.set_key(self.key, value)
+
+    def observe(self, value):
+        self.metric.observe_key(self.key, value)
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Metric:
+    """Base for counters and gauges: one float per label combination"""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), lock=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = lock or threading.Lock()
+        self._values = {}
+        self._children = {}
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f'{self.name} expects labels {self.labelnames}')
+            child = self._children.setdefault(key, MetricChild(self, key))
+        return child
+
+    def inc(self, amount=1):
+        self.inc_key((), amount)
+
+    def inc_key(self, key, amount):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set_key(self, key, value):
+        with self._lock:
+            self._values[key] = float(value)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def dump(self):
+        with self._lock:
+            samples = [[list(key), value] for key, value in self._values.items()]
+        return {
+            'type': self.type,
+            'help': self.documentation,
+            'labelnames': list(self.labelnames),
+            'samples': samples,
+        }
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc_key(self, key, amount):
+        if amount < 0:
+            raise ValueError('Counters can only increase')
+        super().inc_key(key, amount)
+
+
+class Gauge(Metric):
+    """A value that goes up and down; ``mode`` is how processes combine: 'sum' or 'max'"""
+
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), lock=None, mode='sum'):
+        super().__init__(name, documentation, labelnames, lock)
+        self.mode = mode
+
+    def set(self, value):
+        self.set_key((), value)
+
+    def dec(self, amount=1):
+        self.inc_key((), -amount)
+
+    def dump(self):
+        data = super().dump()
+        data['mode'] = self.mode
+        return data
+
+
+class Histogram(Metric):
+    """Bucketed observations; each series is [count per bucket..., +Inf count, sum]"""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), lock=None, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames, lock)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value):
+        self.observe_key((), value)
+
+    def time(self):
+        return MetricChild(self, ()).time()
+
+    def observe_key(self, key, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def dump(self):
+        with self._lock:
+            samples = [[list(key), list(series)] for key, series in self._values.items()]
+        return {
+            'type': self.type,
+            'help': self.documentation,
+            'labelnames': list(self.labelnames),
+            'buckets': list(self.buckets),
+            'samples': samples,
+        }
+
+
+class MetricsRegistry:
+    """Holds every metric of the process and handles per-process files"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+
+    def _register(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=(), mode='sum'):
+        return self._register(Gauge, name, documentation, labelnames, mode=mode)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def dump(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.dump() for metric in metrics}
+
+    def reset(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.reset()
+
+    # Multiprocess files
+
+    def process_file(self, pid=None):
+        directory = metrics_setting('MULTIPROCESS_DIR')
+        return os.path.join(directory, f'metrics-{pid or os.getpid()}.json') if directory else None
+
+    def flush(self):
+        path = self.process_file()
+        if path is None:
+            return
+        self._last_flush = time.monotonic()
+        write_json(path, self.dump())
+
+    def maybe_flush(self):
+        if time.monotonic() - self._last_flush >= metrics_setting('FLUSH_INTERVAL'):
+            self.flush()
+
+    def collect(self):
+        """Metric dumps of every live process plus the archive of exited ones, merged"""
+        directory = metrics_setting('MULTIPROCESS_DIR')
+        if not directory:
+            return self.dump()
+        self.flush()
+        merged = {}
+        for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+            dump = read_json(path)
+            if dump:
+                merge_dumps(merged, dump, include_gauges=not path.endswith(ARCHIVE_FILE))
+        return merged
+
+
+registry = MetricsRegistry()
+
+
+def write_json(path, data):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as handle:
+        json.dump(data, handle)
+    os.replace(tmp, path)
+
+
+def read_json(path):
+    try:
+        with open(path) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        # Removed or replaced between glob and open
+        return None
+
+
+def merge_dumps(merged, dump, include_gauges=True):
+    for name, metric in dump.items():
+        if metric['type'] == 'gauge' and not include_gauges:
+            continue
+        target = merged.setdefault(name, {**metric, 'samples': []})
+        series = {tuple(labels): value for labels, value in target['samples']}
+        for labels, value in metric['samples']:
+            key = tuple(labels)
+            current = series.get(key)
+            if current is None:
+                series[key] = value
+            elif metric['type'] == 'histogram':
+                series[key] = [a + b for a, b in zip(current, value)]
+            elif metric.get('mode') == 'max':
+                series[key] = max(current, value)
+            else:
+                series[key] = current + value
+        target['samples'] = [[list(key), value] for key, value in series.items()]
+    return merged
+
+
+def mark_process_dead(pid):
+    """Fold an exited process's counters and histograms into the archive file"""
+    directory = metrics_setting('MULTIPROCESS_DIR')
+    if not directory:
+        return
+    path = registry.process_file(pid)
+    dump = read_json(path)
+    if dump is None:
+        return
+    import fcntl
+    with open(os.path.join(directory, 'metrics-archive.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        archive_path = os.path.join(directory, ARCHIVE_FILE)
+        archive = read_json(archive_path) or {}
+        write_json(archive_path, merge_dumps(archive, dump, include_gauges=False))
+        os.remove(path)
+
+
+def _flush_at_exit():
+    if metrics_setting('MULTIPROCESS_DIR'):
+        registry.flush()
+        mark_process_dead(os.getpid())
+
+
+atexit.register(_flush_at_exit)
+# A forked worker starts from zero; whatever the parent recorded stays in the parent's file
+os.register_at_fork(after_in_child=registry.reset)
+
+
+# Exposition
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def render_prometheus(dumps):
+    lines = []
+    for name, metric in sorted(dumps.items()):
+        names = metric['labelnames']
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for values, value in sorted(metric['samples']):
+            if metric['type'] != 'histogram':
+                lines.append(f'{name}{_labels(names, values)} {_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip([*metric['buckets'], float('inf')], value[:-1]):
+                cumulative += count
+                le = 'le="%s"' % _number(bound)
+                lines.append(f'{name}_bucket{_labels(names, values, le)} {cumulative}')
+            lines.append(f'{name}_sum{_labels(names, values)} {_number(value[-1])}')
+            lines.append(f'{name}_count{_labels(names, values)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+# Request metrics
+
+http_requests = registry.counter(
+    'http_requests_total', 'HTTP requests by view, method and status', ['view', 'method', 'status'])
+http_request_duration = registry.histogram(
+    'http_request_duration_seconds', 'Request latency by view', ['view'])
+db_queries_per_request = registry.histogram(
+    'db_queries_per_request', 'SQL statements executed per request', ['view'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89))
+db_time_per_request = registry.histogram(
+    'db_time_per_request_seconds', 'Time spent in SQL per request', ['view'])
+cache_requests = registry.counter(
+    'cache_requests_total', 'Cache lookups by cache and result (hit or miss)', ['cache', 'result'])
+
+
+class MetricsMiddleware(HybridMiddleware):
+    """Records request count, latency and SQL per view; place it right after PerformanceMiddleware"""
+
+    def process_request(self, request):
+        request._metrics_start = time.perf_counter()
+        return None
+
+    def process_response(self, request, response):
+        start = getattr(request, '_metrics_start', None)
+        if start is None:
+            return response
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else 'unmatched'
+        http_requests.labels(view, request.method, response.status_code).inc()
+        http_request_duration.labels(view).observe(time.perf_counter() - start)
+
+        timings = current_timings()
+        if timings is not None:
+            db_queries_per_request.labels(view).observe(timings.sql_count)
+            db_time_per_request.labels(view).observe(timings.sql_time)
+
+        registry.maybe_flush()
+        return response
@@ -0,0 +1,58 @@
+# mysite/middleware.py
+
+import math
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+
+class HybridMiddleware:
+    """
+    Base for lightweight middleware that runs natively under WSGI and ASGI.
+
+    Django's MiddlewareMixin hops to a thread for every hook under ASGI;
+    these hooks do no I/O, so they are called inline in either mode.
+    Subclasses implement ``process_request`` (may return a response) and/or
+    ``process_response``.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        response = self.process_request(request)
+        if response is None:
+            response = self.get_response(request)
+        return self.process_response(request, response)
+
+    async def __acall__(self, request):
+        response = self.process_request(request)
+        if response is None:
+            response = await self.get_response(request)
+        return self.process_response(request, response)
+
+    def process_request(self, request):
+        return None
+
+    def process_response(self, request, response):
+        return response
+
+
+class RateLimitHeadersMiddleware(HybridMiddleware):
+    """Adds X-RateLimit-* headers for requests that went through a bucket throttle"""
+
+    def process_response(self, request, response):
+        rate_limit = getattr(request, 'rate_limit', None)
+        if rate_limit is not None:
+            limit, remaining, reset = rate_limit
+            response['X-RateLimit-Limit'] = str(limit)
+            response['X-RateLimit-Remaining'] = str(max(0, int(remaining)))
+            response['X-RateLimit-Reset'] = str(math.ceil(reset))
+        return response
@@ -0,0 +1,41 @@
+# mysite/parsers.py
+"""
+JSON parsing with orjson.
+
+ORJSONParser accepts and returns the same data as DRF's JSONParser. Bodies
+orjson rejects, bodies with integers too long for orjson to keep exact (it
+would return floats), bodies in charsets other than UTF-8, and everything
+when orjson is not installed are parsed by JSONParser itself, so results
+and error messages match it exactly.
+"""
+
+import io
+
+from rest_framework.parsers import JSONParser, get_encoding
+
+from .renderers import ORJSONRenderer, orjson
+
+UTF8_NAMES = {'utf-8', 'utf8'}
+
+# A run of 20+ digits may be an integer orjson cannot hold exactly; mapping
+# every digit to 0 and using a substring search is much faster than a regex
+DIGITS_TO_ZERO = bytes.maketrans(b'123456789', b'000000000')
+LONG_NUMBER = b'0' * 20
+
+
+class ORJSONParser(JSONParser):
+    """Drop-in JSONParser that decodes with orjson"""
+
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None or not self.strict or get_encoding(parser_context or {}).lower() not in UTF8_NAMES:
+            return super().parse(stream, media_type, parser_context)
+
+        body = stream.read()
+        if LONG_NUMBER in body.translate(DIGITS_TO_ZERO):
+            return super().parse(io.BytesIO(body), media_type, parser_context)
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            return super().parse(io.BytesIO(body), media_type, parser_context)
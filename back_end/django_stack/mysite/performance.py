@@ -0,0 +1,213 @@
+# mysite/performance.py
+"""
+Per-request timing: SQL count and time, serializer time, view time and total.
+
+PerformanceMiddleware (outermost) measures the whole request and adds a
+``Server-Timing`` header; ViewTimingMiddleware (innermost) measures URL
+resolution, the view and rendering. SQL is timed by an execute wrapper on
+every connection and serializer time by timing the outermost
+``Serializer.data`` call, both of which only touch a ContextVar when no
+request is being measured. Serializer time includes any SQL run by lazy
+querysets while serializing.
+
+A fraction of requests (PERFORMANCE['SAMPLE_RATE']) also keep their SQL
+text; those that exceed SLOW_REQUEST_MS are logged to ``mysite.performance``
+as a JSON record with their slowest statements.
+"""
+
+import logging
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework.serializers import BaseSerializer
+
+from .middleware import HybridMiddleware
+
+
+logger = logging.getLogger('mysite.performance')
+
+DEFAULT_PERFORMANCE = {
+    'ENABLED': True,
+    'SERVER_TIMING': True,
+    'SAMPLE_RATE': 0.0,
+    'SLOW_REQUEST_MS': 500,
+    'MAX_LOGGED_QUERIES': 10,
+}
+
+
+def performance_setting(name):
+    return getattr(settings, 'PERFORMANCE', {}).get(name, DEFAULT_PERFORMANCE[name])
+
+
+class RequestTimings:
+    """Accumulated timings for one request; durations are in seconds"""
+
+    __slots__ = ('start', 'sampled', 'sql_count', 'sql_time', 'queries',
+                 'serializer_time', 'serializer_depth', 'view_time')
+
+    def __init__(self, sampled=False):
+        self.start = time.perf_counter()
+        self.sampled = sampled
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.queries = [] if sampled else None
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+        self.view_time = 0.0
+
+    def server_timing(self, total):
+        return ', '.join([
+            f'db;dur={self.sql_time * 1000:.1f};desc="{self.sql_count} queries"',
+            f'serialize;dur={self.serializer_time * 1000:.1f}',
+            f'view;dur={self.view_time * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+    def slow_request_record(self, request, response, total):
+        slowest = sorted(self.queries, key=lambda query: query[1], reverse=True)
+        match = getattr(request, 'resolver_match', None)
+        return {
+            'event': 'slow_request',
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match is not None else None,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 1),
+            'view_ms': round(self.view_time * 1000, 1),
+            'serializer_ms': round(self.serializer_time * 1000, 1),
+            'sql_ms': round(self.sql_time * 1000, 1),
+            'sql_count': self.sql_count,
+            'queries': [
+                {'alias': alias, 'ms': round(duration * 1000, 2), 'sql': sql}
+                for sql, duration, alias in slowest[:performance_setting('MAX_LOGGED_QUERIES')]
+            ],
+        }
+
+
+_current_timings = ContextVar('request_timings', default=None)
+
+
+def current_timings():
+    return _current_timings.get()
+
+
+# SQL timing
+
+class SQLTimingWrapper:
+    """Execute wrapper that adds each statement to the current request's timings"""
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def __call__(self, execute, sql, params, many, context):
+        timings = _current_timings.get()
+        if timings is None:
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            timings.sql_count += 1
+            timings.sql_time += duration
+            if timings.queries is not None:
+                timings.queries.append((sql, duration, self.alias))
+
+
+def install_sql_timer(sender=None, connection=None, **kwargs):
+    if not any(isinstance(wrapper, SQLTimingWrapper) for wrapper in connection.execute_wrappers):
+        connection.execute_wrappers.append(SQLTimingWrapper(connection.alias))
+
+
+connection_created.connect(install_sql_timer, dispatch_uid='mysite.performance.sql_timer')
+
+
+# Serializer timing
+
+def install_serializer_timer():
+    """Time BaseSerializer.data, which every Serializer and ListSerializer goes through"""
+    data = BaseSerializer.data
+    if getattr(data.fget, 'times_serializer', False):
+        return
+
+    def timed_data(serializer):
+        timings = _current_timings.get()
+        if timings is None:
+            return data.fget(serializer)
+        timings.serializer_depth += 1
+        start = time.perf_counter()
+        try:
+            return data.fget(serializer)
+        finally:
+            timings.serializer_depth -= 1
+            if not timings.serializer_depth:
+                # Nested .data calls are already inside the outer measurement
+                timings.serializer_time += time.perf_counter() - start
+
+    timed_data.times_serializer = True
+    BaseSerializer.data = property(timed_data, doc=data.__doc__)
+
+
+# Middleware
+
+class PerformanceMiddleware(HybridMiddleware):
+    """Measures each request and reports it in a Server-Timing header; place it first"""
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        install_serializer_timer()
+        for connection in connections.all(initialized_only=True):
+            install_sql_timer(connection=connection)
+
+    def process_request(self, request):
+        if not performance_setting('ENABLED'):
+            return None
+        sample_rate = performance_setting('SAMPLE_RATE')
+        timings = RequestTimings(sampled=sample_rate > 0 and random.random() < sample_rate)
+        request._timings_token = _current_timings.set(timings)
+        return None
+
+    def process_response(self, request, response):
+        token = getattr(request, '_timings_token', None)
+        if token is None:
+            return response
+        timings = _current_timings.get()
+        _current_timings.reset(token)
+        total = time.perf_counter() - timings.start
+
+        if performance_setting('SERVER_TIMING'):
+            response['Server-Timing'] = timings.server_timing(total)
+        if timings.sampled and total * 1000 >= performance_setting('SLOW_REQUEST_MS'):
+            record = timings.slow_request_record(request, response, total)
+            logger.warning('Slow request %s %s', request.method, request.path, extra=record)
+        return response
+
+
+class ViewTimingMiddleware(HybridMiddleware):
+    """Measures URL resolution, the view and rendering; place it last"""
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        timings = _current_timings.get()
+        if timings is None:
+            return self.get_response(request)
+        start = time.perf_counter()
+        try:
+            return self.get_response(request)
+        finally:
+            timings.view_time += time.perf_counter() - start
+
+    async def __acall__(self, request):
+        timings = _current_timings.get()
+        if timings is None:
+            return await self.get_response(request)
+        start = time.perf_counter()
+        try:
+            return await self.get_response(request)
+        finally:
+            timings.view_time += time.perf_counter() - start
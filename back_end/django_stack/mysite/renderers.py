@@ -0,0 +1,94 @@
+# mysite/renderers.py
+"""
+JSON rendering with orjson.
+
+ORJSONRenderer produces the same bytes as DRF's JSONRenderer for the
+compact, strict, unicode output this API uses: types orjson does not handle
+natively (Decimal, lazy strings, and datetimes, which DRF formats its own
+way) go through DRF's JSONEncoder.default. Pretty-printed output (indent),
+non-default JSON settings, payloads orjson rejects and installs without
+orjson fall back to JSONRenderer. So do payloads holding floats orjson
+writes differently: it renders NaN and infinity as null where strict DRF
+raises, and 1e16 where json.dumps writes 1e+16. Those are only looked for
+when the output has a null or an exponent in it.
+"""
+
+import re
+from decimal import Decimal
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+if orjson is not None:
+    ORJSON_OPTIONS = (
+        orjson.OPT_NON_STR_KEYS
+        | orjson.OPT_PASSTHROUGH_DATETIME
+        | orjson.OPT_PASSTHROUGH_DATACLASS
+    )
+
+# DRF escapes these so the output is also valid JavaScript
+LINE_SEPARATOR = '\u2028'.encode()
+PARAGRAPH_SEPARATOR = '\u2029'.encode()
+
+# Where a NaN, infinity or exponent float may have been written
+MAYBE_SPECIAL_FLOAT = re.compile(rb'null|\de-?\d')
+
+
+def has_special_float(data):
+    """Whether ``data`` holds a float (or Decimal, which DRF encodes as one) orjson renders unlike json.dumps"""
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            stack.extend(value.keys())
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+        elif isinstance(value, (float, Decimal)):
+            try:
+                text = repr(float(value))
+            except ValueError:
+                # A signalling NaN; JSONRenderer raises for it
+                return True
+            if 'e' in text or text in ('nan', 'inf', '-inf'):
+                return True
+    return False
+
+
+class ORJSONRenderer(JSONRenderer):
+    """Drop-in JSONRenderer that encodes with orjson"""
+
+    encoder_class = encoders.JSONEncoder
+
+    def __init__(self):
+        self._default = self.encoder_class().default
+        self._fast = (
+            orjson is not None and not self.ensure_ascii and self.compact and self.strict
+        )
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if not self._fast or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=self._default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            # e.g. integers beyond 64 bits; let the stdlib encoder succeed or raise as before
+            return super().render(data, accepted_media_type, renderer_context)
+        if MAYBE_SPECIAL_FLOAT.search(ret) and has_special_float(data):
+            # Raises for NaN and infinity, as JSONRenderer does in strict mode
+            return super().render(data, accepted_media_type, renderer_context)
+
+        if LINE_SEPARATOR in ret:
+            ret = ret.replace(LINE_SEPARATOR, b'\\u2028')
+        if PARAGRAPH_SEPARATOR in ret:
+            ret = ret.replace(PARAGRAPH_SEPARATOR, b'\\u2029')
+        return ret
@@ -0,0 +1,158 @@
+# mysite/response_cache.py
+"""
+Tag-based caching of DRF GET responses.
+
+Each cached response is stored under a key built from the view, user, path,
+query string, Accept header and the current version of every tag the
+response depends on (e.g. ``state:12`` or ``user:3:calculations``).
+Invalidating a tag just bumps its version, so every entry built on the old
+version stops matching and ages out on its own. Only get/set/get_many are
+used, so any Django cache backend every worker shares works: file-based
+on one box, Redis across machines. A per-process cache (locmem) only
+invalidates the worker that made the change; mysite/checks.py rejects it.
+
+Views whose payloads are large and change rarely pass ``precompress=True``:
+their responses carry the cache key as ``content_version``, which lets
+mysite.compression reuse the compressed body instead of recompressing it.
+"""
+
+import functools
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+
+from .metrics import cache_requests
+
+
+DEFAULT_RESPONSE_CACHE = {
+    'ENABLED': True,
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 300,
+    'KEY_PREFIX': 'resp',
+}
+
+
+def response_cache_setting(name):
+    return getattr(settings, 'RESPONSE_CACHE', {}).get(name, DEFAULT_RESPONSE_CACHE[name])
+
+
+def get_cache():
+    return caches[response_cache_setting('CACHE_ALIAS')]
+
+
+def _tag_key(tag):
+    return f"{response_cache_setting('KEY_PREFIX')}:tag:{tag}"
+
+
+def _new_version():
+    return uuid.uuid4().hex[:12]
+
+
+def tag_versions(tags):
+    """Current version of each tag, creating versions for tags seen for the first time"""
+    cache = get_cache()
+    keys = {_tag_key(tag): tag for tag in tags}
+    found = cache.get_many(keys)
+    for key in keys.keys() - found.keys():
+        # add() keeps whichever version another worker may have just created
+        cache.add(key, _new_version(), None)
+        found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def invalidate_tags(*tags):
+    """Make every cached response that depends on any of ``tags`` stale"""
+    if tags:
+        get_cache().set_many({_tag_key(tag): _new_version() for tag in tags}, None)
+
+
+def response_cache_key(scope, request, tags):
+    user = getattr(request, 'user', None)
+    parts = [
+        scope,
+        str(user.pk) if user is not None and user.is_authenticated else 'anon',
+        request.path,
+        '&'.join(sorted(f'{k}={v}' for k, v in request.GET.lists())),
+        request.META.get('HTTP_ACCEPT', ''),
+        *tags,
+        *tag_versions(tags),
+    ]
+    digest = hashlib.sha1('\x1f'.join(parts).encode()).hexdigest()
+    return f"{response_cache_setting('KEY_PREFIX')}:{scope}:{digest}"
+
+
+def serve_cached(scope, request, tags, get_response, timeout=None, precompress=False):
+    """Return the cached response for this request, or call ``get_response`` and cache a 200"""
+    if not response_cache_setting('ENABLED') or request.method != 'GET':
+        return get_response()
+
+    cache = get_cache()
+    key = response_cache_key(scope, request, tags)
+    cached = cache.get(key)
+    if cached is not None:
+        cache_requests.labels('response', 'hit').inc()
+        status_code, data = cached
+        response = Response(data, status=status_code)
+        response['X-Cache'] = 'HIT'
+        if precompress:
+            response.content_version = key
+        return response
+
+    cache_requests.labels('response', 'miss').inc()
+    response = get_response()
+    if isinstance(response, Response) and response.status_code == 200:
+        cache.set(key, (response.status_code, response.data),
+                  timeout if timeout is not None else response_cache_setting('TIMEOUT'))
+        response['X-Cache'] = 'MISS'
+        if precompress:
+            response.content_version = key
+    return response
+
+
+def _resolve_tags(tags, request, kwargs):
+    if callable(tags):
+        return list(tags(request, **kwargs))
+    user_id = request.user.pk if request.user.is_authenticated else 'anon'
+    return [tag.format(user_id=user_id, **kwargs) for tag in tags]
+
+
+def cache_response(tags, timeout=None, precompress=False):
+    """
+    Cache an @api_view function's GET responses.
+
+    ``tags`` is a list of templates formatted with ``user_id`` and the URL
+    kwargs (e.g. ``'user:{user_id}:calculations'``), or a callable taking
+    ``(request, **kwargs)`` and returning the tags. Apply it below
+    @api_view so authentication, permissions and throttles still run first.
+    ``precompress`` lets the compression middleware reuse compressed bodies.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(request, *args, **kwargs):
+            return serve_cached(
+                func.__qualname__, request, _resolve_tags(tags, request, kwargs),
+                lambda: func(request, *args, **kwargs), timeout, precompress,
+            )
+        return wrapper
+    return decorator
+
+
+class CachedResponseMixin:
+    """Caches GET responses of a generic view; set ``cache_tags`` like cache_response's ``tags``"""
+
+    cache_tags = ()
+    cache_timeout = None
+    cache_precompress = False
+
+    def get_cache_tags(self):
+        return _resolve_tags(self.cache_tags, self.request, self.kwargs)
+
+    def get(self, request, *args, **kwargs):
+        return serve_cached(
+            type(self).__name__, request, self.get_cache_tags(),
+            lambda: super(CachedResponseMixin, self).get(request, *args, **kwargs),
+            self.cache_timeout, self.cache_precompress,
+        )
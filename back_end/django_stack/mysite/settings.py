@@ -13,7 +13,8 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 import os
 from pathlib import Path
-from decouple import config
+from corsheaders.defaults import default_headers
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -55,7 +56,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'mysite.logs.RequestLogMiddleware',
+    'mysite.performance.PerformanceMiddleware',
+    'mysite.metrics.MetricsMiddleware',
+    'mysite.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'mysite.db_routers.ReadYourWritesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -63,9 +69,12 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
+    'mysite.middleware.RateLimitHeadersMiddleware',
+    'mysite.performance.ViewTimingMiddleware',
 ]
 
-ROOT_URLCONF = 'mysite.urls'
+# mysite.asgi switches this to mysite.asgi_urls so async views take over
+ROOT_URLCONF = config('DJANGO_ROOT_URLCONF', default='mysite.urls')
 
 TEMPLATES = [
     {
@@ -99,6 +108,67 @@ DATABASES = {
     }
 }
 
+# Optional read replicas, e.g. DATABASE_REPLICA_HOSTS=db-replica-1,db-replica-2.
+# Each becomes an alias ('replica1', ...) of the same database on another host.
+# For local testing, point a replica at the primary host to exercise the split.
+DATABASE_REPLICA_HOSTS = config('DATABASE_REPLICA_HOSTS', default='', cast=Csv())
+for index, host in enumerate(DATABASE_REPLICA_HOSTS, start=1):
+    DATABASES[f'replica{index}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+# Optional user shards for calculations and notes (see mysite/sharding.py), e.g.
+# DATABASE_SHARDS=shard1,shard2. Each alias is a database named <NAME>_<alias> on
+# DATABASE_<ALIAS>_HOST (default: the primary's host). Only ever append to the list.
+DATABASE_SHARDS = config('DATABASE_SHARDS', default='', cast=Csv())
+for alias in DATABASE_SHARDS:
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'NAME': f"{DATABASES['default']['NAME']}_{alias}",
+        'HOST': config(f'DATABASE_{alias.upper()}_HOST', default=DATABASES['default']['HOST']),
+    }
+
+DATABASE_ROUTERS = ['mysite.sharding.ShardRouter', 'mysite.db_routers.ReadReplicaRouter']
+
+DATABASE_SHARDING = {
+    'SHARDS': ['default', *DATABASE_SHARDS],
+    'DIRECTORY_TTL': 5,  # seconds; rebalance_shards waits at least this long before deleting moved rows
+}
+
+DATABASE_ROUTING = {
+    'REPLICAS': [f'replica{index}' for index in range(1, len(DATABASE_REPLICA_HOSTS) + 1)],
+    'STICKY_SECONDS': config('DATABASE_STICKY_SECONDS', default=5, cast=int),
+    'CACHE_ALIAS': 'default',
+}
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Every worker must share this cache: cache tag versions invalidate cached
+# responses, revoke cached tokens and reload the in-process catalogs
+# everywhere, and profiles are cached here (mysite/checks.py rejects a
+# per-process backend).
+#
+# Production uses Redis (CACHE_BACKEND=django.core.cache.backends.redis.RedisCache,
+# CACHE_LOCATION=redis://host:6379) or Memcached (PyMemcacheCache);
+# `manage.py check --deploy` refuses anything else (mysite/checks.py). FileBasedCache, the development
+# default, opens and unpickles a file on every tag lookup and lists the whole
+# directory to cull once MAX_ENTRIES is reached. It unpickles whatever is in
+# LOCATION, so that must be a directory only this project's user can write:
+# var/cache in the project, created 0700.
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': config('CACHE_LOCATION', default=str(BASE_DIR / 'var' / 'cache')),
+        'OPTIONS': {
+            # Past this a third of the entries are culled; a culled tag version only makes its responses stale
+            'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=10000, cast=int),
+        },
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -151,11 +221,21 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # REST Framework configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'calculations.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # orjson-backed drop-ins for DRF's JSONRenderer/JSONParser (see mysite/renderers.py)
+    'DEFAULT_RENDERER_CLASSES': [
+        'mysite.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'mysite.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 50,
     'DEFAULT_FILTER_BACKENDS': [
@@ -163,6 +243,169 @@ REST_FRAMEWORK = {
         'rest_framework.filters.SearchFilter',
         'rest_framework.filters.OrderingFilter',
     ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'mysite.throttling.AnonBucketThrottle',
+        'mysite.throttling.UserBucketThrottle',
+        'mysite.throttling.TokenBucketThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'anon': '300/min',
+        'user': '1200/min',
+        'token': '600/min',
+        # Per-view scopes (throttle_scope): login and registration per client IP,
+        # and the public state endpoints
+        'login': '10/min',
+        'register': '5/min',
+        'state_catalog': '60/min',
+        'state_compare': '120/min',
+        'regions': '120/min',
+    },
+}
+
+# Token-bucket throttle storage (see mysite/throttling.py)
+THROTTLING = {
+    'BACKEND': config('THROTTLE_BACKEND', default='local'),  # 'local' or 'cache'
+    'CACHE_ALIAS': 'default',
+    'MAX_KEYS': 100000,
+}
+
+# Token authentication cache and sliding expiry (see calculations/authentication.py)
+TOKEN_AUTH = {
+    'CACHE_SIZE': config('TOKEN_CACHE_SIZE', default=10000, cast=int),
+    'CACHE_TTL': config('TOKEN_CACHE_TTL', default=30, cast=int),
+    'EXPIRY': config('TOKEN_EXPIRY_SECONDS', default=60 * 60 * 24 * 14, cast=int),
+    'LAST_SEEN_FLUSH_INTERVAL': config('TOKEN_LAST_SEEN_FLUSH_INTERVAL', default=60, cast=int),
+}
+
+# Bounded thread pool for password hashing in the async login/registration views
+PASSWORD_HASHING_EXECUTOR = {
+    'MAX_WORKERS': config('PASSWORD_HASHING_WORKERS', default=4, cast=int),
+    'MAX_QUEUE': config('PASSWORD_HASHING_QUEUE', default=32, cast=int),
+    'RETRY_AFTER': 1,  # seconds, sent with 503 responses when the queue is full
+}
+
+# Printable calculation reports, rendered off the request thread (see calculations/reports.py)
+REPORT_RENDERING_EXECUTOR = {
+    'MAX_WORKERS': config('REPORT_RENDERING_WORKERS', default=2, cast=int),
+    'MAX_QUEUE': config('REPORT_RENDERING_QUEUE', default=16, cast=int),
+    'RETRY_AFTER': 2,
+    'WAIT': 5,  # seconds a request waits for a render before answering 202
+}
+
+# "How do I compare?" percentile sketches (see calculations/percentiles.py)
+PERCENTILE_SKETCHES = {
+    'FLUSH_INTERVAL': config('PERCENTILE_FLUSH_INTERVAL', default=10, cast=int),
+    'MIN_SAMPLE_SIZE': 10,
+}
+
+# Replayed responses for POSTs sent with an Idempotency-Key header (see mysite/idempotency.py)
+IDEMPOTENCY = {
+    'ENABLED': config('IDEMPOTENCY_ENABLED', default=True, cast=bool),
+    'TTL': 24 * 60 * 60,
+    'WAIT': 10,  # seconds a concurrent retry waits for the first request before answering 409
+}
+
+# Tag-invalidated caching of API GET responses (see mysite/response_cache.py)
+RESPONSE_CACHE = {
+    'ENABLED': config('RESPONSE_CACHE_ENABLED', default=True, cast=bool),
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 300,
+}
+
+# Seconds a serialized user profile stays cached (invalidated on every profile/user save)
+PROFILE_CACHE_TIMEOUT = 300
+
+# Seconds a worker keeps its in-memory state catalog before re-reading it, even
+# if no change reached its cache (see state_data/catalog.py)
+STATE_CATALOG_TTL = 60
+
+# Per-request timing (see mysite/performance.py). Sampled requests keep their
+# SQL and are logged to 'mysite.performance' when slower than SLOW_REQUEST_MS.
+PERFORMANCE = {
+    'ENABLED': config('PERFORMANCE_ENABLED', default=True, cast=bool),
+    'SERVER_TIMING': config('SERVER_TIMING', default=True, cast=bool),
+    'SAMPLE_RATE': config('PERFORMANCE_SAMPLE_RATE', default=0.0, cast=float),
+    'SLOW_REQUEST_MS': config('SLOW_REQUEST_MS', default=500, cast=int),
+    'MAX_LOGGED_QUERIES': 10,
+}
+
+# Metrics served at /metrics (see mysite/metrics.py). Under gunicorn, point
+# METRICS_MULTIPROCESS_DIR at an empty directory shared by the workers so the
+# scrape covers all of them; METRICS_AUTH_TOKEN requires "Bearer <token>".
+# Without DEBUG the endpoint refuses every scrape until a token is set, and
+# ``check --deploy`` reports the missing token.
+METRICS = {
+    'MULTIPROCESS_DIR': config('METRICS_MULTIPROCESS_DIR', default=''),
+    'FLUSH_INTERVAL': 1.0,
+    'AUTH_TOKEN': config('METRICS_AUTH_TOKEN', default=''),
+}
+
+# gzip/brotli response compression (see mysite/compression.py). Bodies of
+# precompressed views are compressed once per content version and kept in a
+# per-process LRU of at most COMPRESSION_CACHE_MAX_BYTES.
+COMPRESSION = {
+    'ENABLED': config('COMPRESSION_ENABLED', default=True, cast=bool),
+    'MIN_SIZE': config('COMPRESSION_MIN_SIZE', default=1024, cast=int),
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 5,
+    'CACHED_GZIP_LEVEL': 9,
+    'CACHED_BROTLI_QUALITY': 11,
+    'CACHE_MAX_BYTES': config('COMPRESSION_CACHE_MAX_BYTES', default=16 * 1024 * 1024, cast=int),
+}
+
+# Warm-up at worker start (see mysite/warmup.py); /ready answers 503 until it
+# has finished. WARMUP_BACKGROUND lets the server accept connections meanwhile.
+WARMUP = {
+    'ENABLED': config('WARMUP_ENABLED', default=True, cast=bool),
+    'BACKGROUND': config('WARMUP_BACKGROUND', default=False, cast=bool),
+}
+
+# Server-sent change notifications at /api/events/ under ASGI (see mysite/events.py).
+# Set EVENTS_BROKER_DIR to a directory shared by all workers on the host so an
+# event published by any of them reaches streams held by the others. Streams
+# are authenticated when they open and end after EVENTS_MAX_AGE seconds (by
+# default as long as a revoked token stays in the token cache) so clients
+# reconnect and authenticate again.
+EVENTS = {
+    'BROKER_DIR': config('EVENTS_BROKER_DIR', default=''),
+    'HEARTBEAT': config('EVENTS_HEARTBEAT', default=20, cast=int),
+    'RETRY_MS': 5000,
+    'MAX_QUEUE': 100,
+    'MAX_AGE': config('EVENTS_MAX_AGE', default=TOKEN_AUTH['CACHE_TTL'], cast=int),
+}
+
+# JSON logs (see mysite/logs.py). Records are queued and written to stdout by a
+# background thread; REQUEST_LOG_SAMPLE_RATE of the per-request access records
+# are kept (warnings and errors are never sampled).
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'mysite.logs.JSONFormatter'},
+    },
+    'filters': {
+        'sampling': {
+            '()': 'mysite.logs.SamplingFilter',
+            'rates': {
+                'mysite.request': config('REQUEST_LOG_SAMPLE_RATE', default=0.1, cast=float),
+            },
+        },
+        'request_context': {'()': 'mysite.logs.RequestContextFilter'},
+    },
+    'handlers': {
+        'background': {
+            'class': 'mysite.logs.BackgroundHandler',
+            'formatter': 'json',
+            'filters': ['sampling', 'request_context'],
+            'stream': 'ext://sys.stdout',
+            'max_queue': 10000,
+        },
+    },
+    'loggers': {
+        'mysite': {'handlers': ['background'], 'level': config('LOG_LEVEL', default='INFO'), 'propagate': False},
+        'calculations': {'handlers': ['background'], 'level': config('LOG_LEVEL', default='INFO'), 'propagate': False},
+        'state_data': {'handlers': ['background'], 'level': config('LOG_LEVEL', default='INFO'), 'propagate': False},
+    },
 }
 
 # CORS settings for React frontend
@@ -175,6 +418,8 @@ CORS_ALLOWED_ORIGINS = [
 
 CORS_ALLOW_CREDENTIALS = True
 
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
+
 # API Keys (use environment variables in production)
 BLS_API_KEY = config('BLS_API_KEY', default='')
 TAX_API_KEY = config('TAX_API_KEY', default='')
@@ -0,0 +1,272 @@
+# mysite/sharding.py
+"""
+Horizontal sharding of per-user data across database aliases.
+
+DATABASE_SHARDING['SHARDS'] lists the aliases that hold calculations and
+notes, ``default`` first. A user's rows all live on one shard: the alias
+recorded for them in the directory (calculations.UserShard), or else the one
+rendezvous hashing picks for their id. Hashing needs no lookup, and adding a
+shard only rehomes the users that hash to it, who are pinned to their old
+shard with ``rebalance_shards --pin-for`` before the new list is deployed
+and then moved across with ``rebalance_shards``.
+
+Views reach the right shard through ``for_user()`` on the sharded models'
+querysets; saves, deletes and related-object access follow the instance
+(ShardRouter). Everything else stays on ``default``, but the reference
+tables calculations join to (StateData, Region) are copied to every shard
+(``sync_shards``, then kept current by state_data/signals.py) so joins and
+foreign keys hold. Workers keep the directory in memory and reload it when
+its cache tag moves on, and at least every DIRECTORY_TTL seconds whatever
+the cache says, so a move reaches every worker within that time even where
+the cache is not shared (rebalance_shards waits at least that long before
+deleting anything). Each shard hands out ids from its own range of
+2**ID_RANGE_BITS, so rows keep their ids when moved. Only append to SHARDS:
+an alias's position fixes its range.
+
+For local testing, add SQLite aliases in a settings module, e.g.
+``DATABASES['shard1'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME':
+'shard1.sqlite3'}`` and ``DATABASE_SHARDING = {'SHARDS': ['default',
+'shard1']}``, then ``migrate --database=shard1`` and ``sync_shards``.
+"""
+
+import hashlib
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.db import connections, models, transaction
+
+from .response_cache import invalidate_tags, tag_versions
+
+
+DEFAULT_DATABASE_SHARDING = {
+    'SHARDS': ['default'],
+    'SHARDED_MODELS': [
+        'calculations.CostCalculation', 'calculations.CalculationNote', 'calculations.ArchivedCalculationBatch',
+    ],
+    'REFERENCE_MODELS': ['state_data.StateData', 'state_data.Region'],
+    'DIRECTORY_MODEL': 'calculations.UserShard',
+    'DIRECTORY_TTL': 5,  # seconds a worker trusts its directory before re-reading it
+}
+
+ID_RANGE_BITS = 40
+
+DIRECTORY_TAG = 'shard_directory'
+
+
+def sharding_setting(name):
+    return getattr(settings, 'DATABASE_SHARDING', {}).get(name, DEFAULT_DATABASE_SHARDING[name])
+
+
+def is_sharded(model):
+    return model._meta.label in sharding_setting('SHARDED_MODELS')
+
+
+def sharded_models():
+    return [apps.get_model(label) for label in sharding_setting('SHARDED_MODELS')]
+
+
+def reference_models():
+    return [apps.get_model(label) for label in sharding_setting('REFERENCE_MODELS')]
+
+
+def hashed_shard(user_id, shards):
+    """Rendezvous hashing: the shard with the highest score for this user"""
+    return max(shards, key=lambda alias: hashlib.sha1(f'{alias}:{user_id}'.encode()).digest())
+
+
+class ShardDirectory:
+    """Users placed away from their hashed shard, loaded whole (it only holds the exceptions)"""
+
+    def __init__(self, placements, version):
+        self.placements = placements
+        self.version = version
+        self.loaded_at = time.monotonic()
+
+    def is_current(self, version):
+        return self.version == version and time.monotonic() - self.loaded_at < sharding_setting('DIRECTORY_TTL')
+
+    def shard_for(self, user_id):
+        alias = self.placements.get(user_id)
+        return alias if alias is not None else hashed_shard(user_id, sharding_setting('SHARDS'))
+
+
+_directory = None
+_lock = threading.Lock()
+
+
+def get_shard_directory():
+    """The current directory, reloaded from ``default`` when its cache tag has moved on or it is DIRECTORY_TTL old"""
+    global _directory
+    [version] = tag_versions([DIRECTORY_TAG])
+    directory = _directory
+    if directory is None or not directory.is_current(version):
+        with _lock:
+            if _directory is None or not _directory.is_current(version):
+                model = apps.get_model(sharding_setting('DIRECTORY_MODEL'))
+                _directory = ShardDirectory(
+                    dict(model.objects.using('default').values_list('user_id', 'alias')), version,
+                )
+            directory = _directory
+    return directory
+
+
+async def aget_shard_directory():
+    return await sync_to_async(get_shard_directory)()
+
+
+def invalidate_shard_directory():
+    invalidate_tags(DIRECTORY_TAG)
+
+
+def shard_for_user(user_id):
+    if len(sharding_setting('SHARDS')) == 1:
+        return 'default'
+    return get_shard_directory().shard_for(user_id)
+
+
+async def ashard_for_user(user_id):
+    if len(sharding_setting('SHARDS')) == 1:
+        return 'default'
+    return (await aget_shard_directory()).shard_for(user_id)
+
+
+class ShardedQuerySet(models.QuerySet):
+    """QuerySet of a model whose rows live on their owner's shard"""
+
+    # Lookup from the model to the owning user
+    user_lookup = 'user'
+
+    def _on_shard(self, alias, user):
+        # Rows on default keep going through the router, so replica reads still apply
+        queryset = self if alias == 'default' else self.using(alias)
+        return queryset.filter(**{self.user_lookup: user})
+
+    def for_user(self, user):
+        """``user``'s rows, on their shard"""
+        return self._on_shard(shard_for_user(user.pk), user)
+
+    async def afor_user(self, user):
+        return self._on_shard(await ashard_for_user(user.pk), user)
+
+    def create(self, **kwargs):
+        if self._db is not None:
+            return super().create(**kwargs)
+        # Saved with the instance as the routing hint, so it lands beside its owner or parent
+        obj = self.model(**kwargs)
+        obj.save(force_insert=True)
+        return obj
+
+
+class ShardRouter:
+    """
+    Routes sharded models by the instance at hand; defers everything else.
+
+    Returns None for rows on ``default`` so ReadReplicaRouter still picks a
+    replica for reads and records writes for read-your-writes stickiness.
+    """
+
+    def _alias_for(self, model, hints):
+        instance = hints.get('instance')
+        if instance is None or not is_sharded(model):
+            return None
+        if instance._meta.label == settings.AUTH_USER_MODEL:
+            # user.calculations and friends
+            alias = shard_for_user(instance.pk)
+        elif not is_sharded(type(instance)):
+            return None
+        elif instance._state.adding and getattr(instance, 'user_id', None) is not None:
+            # A new row goes to its owner's shard, whatever a related assignment stamped on it
+            alias = shard_for_user(instance.user_id)
+        else:
+            alias = self._alias_of_parent(instance) or instance._state.db
+        return alias if alias != 'default' else None
+
+    def _alias_of_parent(self, instance):
+        """Where a new child row goes: beside the sharded parent it was attached to"""
+        if not instance._state.adding:
+            return None
+        for field in instance._meta.concrete_fields:
+            if field.is_relation and is_sharded(field.related_model) and field.is_cached(instance):
+                parent = field.get_cached_value(instance)
+                if parent is not None:
+                    return parent._state.db
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._alias_for(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._alias_for(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Users live on default and reference data is copied to every shard
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Shards carry the full schema; only the sharded tables and reference copies are used
+        return None
+
+
+# Shard maintenance, used by sync_shards and rebalance_shards
+
+def id_range_start(alias):
+    return sharding_setting('SHARDS').index(alias) << ID_RANGE_BITS
+
+
+def reserve_id_range(alias):
+    """
+    Start new ids of the sharded tables on ``alias`` at the beginning of its
+    range, unless they are already past it. Returns the tables moved on.
+    """
+    start = id_range_start(alias)
+    connection = connections[alias]
+    moved = []
+    for model in sharded_models():
+        table = model._meta.db_table
+        column = model._meta.pk.column
+        last = model._base_manager.using(alias).aggregate(last=models.Max('pk'))['last'] or 0
+        if last >= start:
+            continue
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT setval(pg_get_serial_sequence(%s, %s), %s)', [table, column, start])
+            elif connection.vendor == 'sqlite':
+                cursor.execute('UPDATE sqlite_sequence SET seq = %s WHERE name = %s', [start, table])
+                if not cursor.rowcount:
+                    cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)', [table, start])
+            else:
+                raise NotImplementedError(f'Cannot set id ranges on {connection.vendor}')
+        moved.append(table)
+    return moved
+
+
+def insert_rows(model, objs, using):
+    """INSERT ``objs`` as they are, ids and timestamps included (auto_now is not applied)"""
+    fields = model._meta.concrete_fields
+    batch_size = max(connections[using].ops.bulk_batch_size(fields, objs), 1)
+    for start in range(0, len(objs), batch_size):
+        model._base_manager._insert(objs[start:start + batch_size], fields=fields, using=using, raw=True)
+
+
+def replicate_reference_rows(model, pks=None):
+    """Copy ``model`` rows (those in ``pks``, or all) from default to every other shard"""
+    shards = [alias for alias in sharding_setting('SHARDS') if alias != 'default']
+    if not shards:
+        return
+    source = model._base_manager.using('default')
+    rows = list(source.filter(pk__in=pks) if pks is not None else source.all())
+    for alias in shards:
+        with transaction.atomic(using=alias):
+            target = model._base_manager.using(alias)
+            (target.filter(pk__in=pks) if pks is not None else target.all())._raw_delete(alias)
+            insert_rows(model, rows, alias)
+
+
+def replicate_on_commit(instance):
+    """replicate_reference_rows() for one saved or deleted row, once the change commits"""
+    if len(sharding_setting('SHARDS')) > 1:
+        model, pk = type(instance), instance.pk
+        transaction.on_commit(lambda: replicate_reference_rows(model, [pk]))
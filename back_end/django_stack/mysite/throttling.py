@@ -0,0 +1,207 @@
+# mysite/throttling.py
+"""
+Token-bucket request throttling for DRF views.
+
+Buckets live in process memory by default, so a throttle decision is a dict
+lookup under a lock and never touches the database. Set
+THROTTLING['BACKEND'] = 'cache' to share buckets between workers through a
+Django cache alias (file-based on one box, Redis across machines).
+
+Rates use DRF's format in REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']: a rate of
+'60/min' gives a bucket of 60 requests that refills at one per second.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+
+DEFAULT_THROTTLING = {
+    'BACKEND': 'local',        # 'local' (per process) or 'cache' (shared via CACHE_ALIAS)
+    'CACHE_ALIAS': 'default',
+    'MAX_KEYS': 100000,        # buckets kept per process before the least recent is dropped
+}
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def throttling_setting(name):
+    return getattr(settings, 'THROTTLING', {}).get(name, DEFAULT_THROTTLING[name])
+
+
+def parse_rate(rate):
+    """'60/min' -> (capacity 60, refill 1.0 token per second)"""
+    num, period = rate.split('/')
+    capacity = int(num)
+    return capacity, capacity / PERIODS[period[0]]
+
+
+class LocalBucketStore:
+    """In-process token buckets, bounded by evicting the least recently used key"""
+
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, refill_rate):
+        """Take one token from ``key``'s bucket; returns (allowed, tokens left)"""
+        now = time.monotonic()
+        with self._lock:
+            state = self._buckets.get(key)
+            if state is None:
+                tokens = capacity
+            else:
+                tokens = min(capacity, state[0] + (now - state[1]) * refill_rate)
+                self._buckets.move_to_end(key)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, tokens
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBucketStore:
+    """
+    Token buckets shared through a Django cache.
+
+    Read-modify-write is not atomic across workers, so concurrent requests on
+    the same key can be over-admitted by a few tokens; the limit still holds
+    over any sustained period.
+    """
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def consume(self, key, capacity, refill_rate):
+        cache = caches[self.alias]
+        cache_key = f'throttle:{key}'
+        now = time.time()
+        state = cache.get(cache_key)
+        if state is None:
+            tokens = capacity
+        else:
+            tokens = min(capacity, state[0] + (now - state[1]) * refill_rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        # Keep the entry only as long as it takes the bucket to refill completely
+        cache.set(cache_key, (tokens, now), int(capacity / refill_rate) + 1)
+        return allowed, tokens
+
+    def clear(self):
+        caches[self.alias].clear()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_bucket_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if throttling_setting('BACKEND') == 'cache':
+                    _store = CacheBucketStore(throttling_setting('CACHE_ALIAS'))
+                else:
+                    _store = LocalBucketStore(throttling_setting('MAX_KEYS'))
+    return _store
+
+
+def reset_bucket_store():
+    global _store
+    with _store_lock:
+        _store = None
+
+
+class BucketThrottle(BaseThrottle):
+    """Base token-bucket throttle; subclasses choose the scope and the bucket key"""
+
+    scope = None
+
+    def __init__(self):
+        self._wait = None
+
+    def get_scope(self, view):
+        return self.scope
+
+    def get_bucket_key(self, request, view):
+        """Identity the bucket is kept for, or None to leave the request unthrottled"""
+        raise NotImplementedError('.get_bucket_key() must be overridden')
+
+    def allow_request(self, request, view):
+        scope = self.get_scope(view)
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope) if scope else None
+        if rate is None:
+            return True
+        key = self.get_bucket_key(request, view)
+        if key is None:
+            return True
+
+        capacity, refill_rate = parse_rate(rate)
+        allowed, tokens = get_bucket_store().consume(f'{scope}:{key}', capacity, refill_rate)
+        self._wait = None if allowed else (1 - tokens) / refill_rate
+        record_rate_limit(request, capacity, tokens, (capacity - tokens) / refill_rate)
+        return allowed
+
+    def wait(self):
+        return self._wait
+
+
+class AnonBucketThrottle(BucketThrottle):
+    """Limits unauthenticated requests per client IP"""
+
+    scope = 'anon'
+
+    def get_bucket_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return None
+        return self.get_ident(request)
+
+
+class UserBucketThrottle(BucketThrottle):
+    """Limits authenticated requests per user (and anonymous ones per IP)"""
+
+    scope = 'user'
+
+    def get_bucket_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return f'u{request.user.pk}'
+        return self.get_ident(request)
+
+
+class TokenBucketThrottle(BucketThrottle):
+    """Limits requests per auth token, so each of a user's devices gets its own bucket"""
+
+    scope = 'token'
+
+    def get_bucket_key(self, request, view):
+        key = getattr(request.auth, 'key', None)
+        return f't{key}' if key else None
+
+
+class ScopedBucketThrottle(UserBucketThrottle):
+    """Limits by user or IP using the rate named by the view's ``throttle_scope``"""
+
+    def get_scope(self, view):
+        return getattr(view, 'throttle_scope', None)
+
+
+def record_rate_limit(request, limit, remaining, reset):
+    """Remember the tightest bucket seen for RateLimitHeadersMiddleware"""
+    http_request = getattr(request, '_request', request)
+    current = getattr(http_request, 'rate_limit', None)
+    if current is None or remaining < current[1]:
+        http_request.rate_limit = (limit, remaining, reset)
@@ -21,10 +21,14 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from . import views
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/calculations/', include('calculations.urls')),
     path('api/states/', include('state_data.urls')),
+    path('metrics', views.metrics, name='metrics'),
+    path('ready', views.ready, name='ready'),
 ]
 
 if settings.DEBUG:
@@ -0,0 +1,60 @@
+# mysite/views.py
+
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework import exceptions
+
+from .async_api import authenticate, error_response
+from .events import event_stream
+from .metrics import metrics_setting, registry, render_prometheus
+from .warmup import is_ready, state as warmup_state
+
+
+@require_GET
+def metrics(request):
+    """Prometheus scrape endpoint covering every worker process; open without a token only under DEBUG"""
+    token = metrics_setting('AUTH_TOKEN')
+    if not token:
+        if not settings.DEBUG:
+            return HttpResponseForbidden()
+    elif not hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        render_prometheus(registry.collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
+
+
+@require_GET
+def ready(request):
+    """Readiness probe: 503 until this worker has finished warming up"""
+    if not is_ready():
+        return JsonResponse({'status': 'warming'}, status=503)
+    return JsonResponse({'status': 'ready', 'warmup': warmup_state.steps})
+
+
+@require_GET
+async def events(request):
+    """Server-sent change notifications for the signed-in user; only mounted under ASGI (mysite.asgi_urls)"""
+    # EventSource cannot set headers, so browsers pass the token in the query string
+    token = request.GET.get('token')
+    if token and 'HTTP_AUTHORIZATION' not in request.META:
+        request.META['HTTP_AUTHORIZATION'] = f'Token {token}'
+    try:
+        await authenticate(request)
+        if not request.user.is_authenticated:
+            raise exceptions.NotAuthenticated()
+    except exceptions.APIException as exc:
+        return error_response(exc)
+
+    response = StreamingHttpResponse(
+        event_stream([f'user:{request.user.pk}', 'states']),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
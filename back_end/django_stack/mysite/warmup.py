@@ -0,0 +1,157 @@
+# mysite/warmup.py
+"""
+Worker warm-up, so the first requests after a deploy are not the slow ones.
+
+warm_up() compiles the URL resolver, loads the state catalog with its
+comparisons, builds the radius-search index and serializes a row through
+every app serializer once (DRF builds ModelSerializer fields by
+introspection on first use). It then opens
+the database connections, except when called with ``connect=False`` in a
+process that is about to fork: gunicorn with ``preload_app`` runs the
+expensive part once in the master (see gunicorn.conf.py), the workers share
+the result copy-on-write and each opens its own connections in
+``post_worker_init``. Until warm-up has finished the readiness endpoint
+(mysite.views.ready) answers 503.
+"""
+
+import inspect
+import logging
+import threading
+import time
+from importlib import import_module
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections
+from django.urls import get_resolver
+from django.utils.module_loading import module_has_submodule
+from rest_framework.serializers import ModelSerializer, Serializer
+
+
+DEFAULT_WARMUP = {
+    'ENABLED': True,
+    'BACKGROUND': False,
+}
+
+logger = logging.getLogger('mysite.warmup')
+
+
+def warmup_setting(name):
+    return getattr(settings, 'WARMUP', {}).get(name, DEFAULT_WARMUP[name])
+
+
+class WarmupState:
+    def __init__(self):
+        self.primed = False
+        self.connected = False
+        self.steps = {}
+        self.finished = threading.Event()
+
+
+state = WarmupState()
+_lock = threading.Lock()
+
+
+def app_serializers():
+    """Concrete serializer classes defined in each installed app's serializers module"""
+    for app_config in apps.get_app_configs():
+        # rest_framework's own serializers module only holds the generic base classes
+        if app_config.name == 'rest_framework' or not module_has_submodule(app_config.module, 'serializers'):
+            continue
+        module = import_module(f'{app_config.name}.serializers')
+        for _, cls in inspect.getmembers(module, inspect.isclass):
+            if issubclass(cls, Serializer) and cls.__module__ == module.__name__:
+                yield cls
+
+
+def compile_urls():
+    resolver = get_resolver()
+    # Reading reverse_dict populates the resolver, which also compiles every pattern
+    return len(resolver.reverse_dict)
+
+
+def prime_state_catalog():
+    from calculations.serializers import StateDataSerializer as CalculationStateSerializer
+    from state_data.catalog import get_catalog
+    from state_data.serializers import StateDataSerializer
+
+    catalog = get_catalog()
+    catalog.prime((StateDataSerializer, CalculationStateSerializer))
+    return len(catalog.states)
+
+
+def prime_place_index():
+    from state_data.geo import get_place_index
+
+    return len(get_place_index().places)
+
+
+def exercise_serializers():
+    count = 0
+    for cls in app_serializers():
+        # Building the field mapping is the expensive first-use introspection
+        fields = cls().fields
+        if issubclass(cls, ModelSerializer) and fields:
+            instance = cls.Meta.model._default_manager.first()
+            if instance is not None:
+                cls(instance).data
+        count += 1
+    return count
+
+
+def open_connections():
+    for alias in connections:
+        connections[alias].ensure_connection()
+    return len(connections.all())
+
+
+PRIME_STEPS = [
+    ('urls', compile_urls),
+    ('state_catalog', prime_state_catalog),
+    ('place_index', prime_place_index),
+    ('serializers', exercise_serializers),
+]
+
+
+def _run(name, func):
+    started = time.perf_counter()
+    try:
+        result = func()
+    except Exception:
+        logger.exception('Warm-up step %s failed', name)
+        result = None
+    state.steps[name] = {'result': result, 'ms': round((time.perf_counter() - started) * 1000, 1)}
+
+
+def warm_up(connect=True):
+    """Run whatever warm-up this process still needs; safe to call more than once"""
+    if not warmup_setting('ENABLED'):
+        state.finished.set()
+        return state
+    with _lock:
+        if not state.primed:
+            for name, func in PRIME_STEPS:
+                _run(name, func)
+            state.primed = True
+        if connect and not state.connected:
+            _run('connections', open_connections)
+            state.connected = True
+        elif not connect:
+            # Connections opened while priming must not be inherited by forked workers
+            connections.close_all()
+        state.finished.set()
+    logger.info('Warm-up finished', extra={'steps': state.steps})
+    return state
+
+
+def start_warm_up(connect=True):
+    """warm_up() now, or on a background thread when WARMUP['BACKGROUND'] is set"""
+    if warmup_setting('BACKGROUND'):
+        # Connections are per thread, so one opened on the warm-up thread would serve nobody
+        threading.Thread(target=warm_up, kwargs={'connect': False}, name='warm-up', daemon=True).start()
+    else:
+        warm_up(connect)
+
+
+def is_ready():
+    return state.finished.is_set()
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
 
 application = get_wsgi_application()
+
+# Prime caches now; connections are opened per worker (gunicorn.conf.py post_worker_init)
+from mysite.warmup import start_warm_up  # noqa: E402
+
+start_warm_up(connect=False)
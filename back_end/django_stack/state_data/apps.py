@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class StateDataConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'state_data'
+
+    def ready(self):
+        from . import signals  # noqa: F401
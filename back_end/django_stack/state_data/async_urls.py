@@ -0,0 +1,10 @@
+# state_data/async_urls.py - Async endpoints, mounted ahead of state_data/urls.py under ASGI
+
+from django.urls import path
+from . import async_views
+
+urlpatterns = [
+    path('', async_views.state_list, name='async-state-list'),
+    path('compare/', async_views.states_comparison, name='async-states-comparison'),
+    path('nearby/', async_views.nearby_places, name='async-nearby-places'),
+]
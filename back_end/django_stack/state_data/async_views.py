@@ -0,0 +1,48 @@
+# state_data/async_views.py - Native async read endpoints served under mysite.asgi
+
+from rest_framework import status
+
+from mysite.async_api import api_response, async_api_view
+from mysite.throttling import ScopedBucketThrottle
+from .catalog import aget_catalog
+from .geo import aget_place_index, nearby_payload
+from .views import SAMPLE_STATES
+
+
+@async_api_view(permission='any', throttle_classes=[ScopedBucketThrottle], throttle_scope='state_catalog')
+async def state_list(request):
+    """Async counterpart of state_list_simple"""
+    catalog = await aget_catalog()
+    if not catalog.states:
+        return api_response(SAMPLE_STATES)
+    response = api_response(catalog.serialized())
+    response.content_version = f'{request.get_full_path()}:{catalog.version}'
+    return response
+
+
+@async_api_view(permission='any', throttle_classes=[ScopedBucketThrottle], throttle_scope='state_compare')
+async def states_comparison(request):
+    """Async counterpart of states_comparison_data"""
+    origin_state_id = request.GET.get('origin')
+    if not origin_state_id:
+        return api_response({'error': 'Origin state is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    catalog = await aget_catalog()
+    origin_state, destination_state = catalog.resolve(origin_state_id, request.GET.get('destination'))
+    if origin_state is None or destination_state is None:
+        return api_response({'error': 'State not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    response = api_response(catalog.comparison(origin_state, destination_state))
+    response.content_version = f'{request.get_full_path()}:{catalog.version}'
+    return response
+
+
+@async_api_view(permission='any', throttle_classes=[ScopedBucketThrottle], throttle_scope='regions')
+async def nearby_places(request):
+    """Async counterpart of views.nearby_places"""
+    catalog = await aget_catalog()
+    index = await aget_place_index()
+    try:
+        return api_response(nearby_payload(request.GET, catalog, index))
+    except ValueError as e:
+        return api_response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
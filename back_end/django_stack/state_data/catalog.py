@@ -0,0 +1,139 @@
+# state_data/catalog.py
+"""
+In-process catalog of every StateData row.
+
+There are only a few dozen states and they change rarely, so each worker
+keeps them in memory together with their serialized form and the
+comparison payloads computed from them. The catalog is tied to the version
+of the ``states`` response cache tag, which the StateData signals bump on
+every save or delete; any worker sharing the cache reloads on its next
+access. Workers also reload once their catalog is STATE_CATALOG_TTL
+seconds old, in case a change never reached their cache, and
+state_exists() asks the database about ids the catalog does not know yet.
+Payloads handed out are shared between requests: treat them as read-only.
+"""
+
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from mysite.response_cache import tag_versions
+from .models import StateData
+from .serializers import StateDataSerializer
+
+DEFAULT_DESTINATION_CODE = 'ME'
+
+DEFAULT_CATALOG_TTL = 60
+
+
+def comparison_payload(origin_state, destination_state, serializer_class=StateDataSerializer):
+    """Cost ratios and percentage changes for moving from origin_state to destination_state"""
+    housing_ratio = destination_state.housing_index / origin_state.housing_index
+    utilities_ratio = destination_state.utilities_index / origin_state.utilities_index
+    grocery_ratio = destination_state.grocery_index / origin_state.grocery_index
+    transportation_ratio = destination_state.transportation_index / origin_state.transportation_index
+    overall_col_ratio = destination_state.cost_of_living_index / origin_state.cost_of_living_index
+
+    return {
+        'origin_state': serializer_class(origin_state).data,
+        'destination_state': serializer_class(destination_state).data,
+        'comparison_ratios': {
+            'housing': round(housing_ratio, 3),
+            'utilities': round(utilities_ratio, 3),
+            'groceries': round(grocery_ratio, 3),
+            'transportation': round(transportation_ratio, 3),
+            'overall_cost_of_living': round(overall_col_ratio, 3),
+        },
+        'percentage_changes': {
+            'housing': round((housing_ratio - 1) * 100, 1),
+            'utilities': round((utilities_ratio - 1) * 100, 1),
+            'groceries': round((grocery_ratio - 1) * 100, 1),
+            'transportation': round((transportation_ratio - 1) * 100, 1),
+            'overall_cost_of_living': round((overall_col_ratio - 1) * 100, 1),
+        }
+    }
+
+
+class StateCatalog:
+    """All states keyed by pk and code, plus memoized serializations and comparisons"""
+
+    def __init__(self, states, version):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.states = sorted(states, key=lambda state: state.state_name)
+        self.by_pk = {state.pk: state for state in self.states}
+        self.by_code = {state.state_code: state for state in self.states}
+        self._serialized = {}
+        self._comparisons = {}
+
+    def is_current(self, version):
+        ttl = getattr(settings, 'STATE_CATALOG_TTL', DEFAULT_CATALOG_TTL)
+        return self.version == version and time.monotonic() - self.loaded_at < ttl
+
+    def serialized(self, serializer_class=StateDataSerializer):
+        """``serializer_class(many=True).data`` for every state, ordered by name"""
+        data = self._serialized.get(serializer_class)
+        if data is None:
+            data = self._serialized[serializer_class] = serializer_class(self.states, many=True).data
+        return data
+
+    def resolve(self, origin_state_id, destination_state_id=None):
+        """Origin and destination (Maine by default) for request parameters; None for either that is missing"""
+        try:
+            origin = self.by_pk.get(int(origin_state_id))
+            destination = (
+                self.by_pk.get(int(destination_state_id)) if destination_state_id
+                else self.by_code.get(DEFAULT_DESTINATION_CODE)
+            )
+        except (TypeError, ValueError):
+            return None, None
+        return origin, destination
+
+    def comparison(self, origin, destination, serializer_class=StateDataSerializer):
+        key = (origin.pk, destination.pk, serializer_class)
+        payload = self._comparisons.get(key)
+        if payload is None:
+            payload = self._comparisons[key] = comparison_payload(origin, destination, serializer_class)
+        return payload
+
+    def prime(self, serializer_classes=(StateDataSerializer,)):
+        """Build the catalog listing and every comparison with the default destination ahead of time"""
+        destination = self.by_code.get(DEFAULT_DESTINATION_CODE)
+        for serializer_class in serializer_classes:
+            self.serialized(serializer_class)
+            if destination is not None:
+                for origin in self.states:
+                    self.comparison(origin, destination, serializer_class)
+
+
+_catalog = None
+_lock = threading.Lock()
+
+
+def get_catalog():
+    """The current catalog, reloaded from the database when the ``states`` tag has moved on or it is TTL old"""
+    global _catalog
+    [version] = tag_versions(['states'])
+    catalog = _catalog
+    if catalog is None or not catalog.is_current(version):
+        with _lock:
+            if _catalog is None or not _catalog.is_current(version):
+                _catalog = StateCatalog(list(StateData.objects.all()), version)
+            catalog = _catalog
+    return catalog
+
+
+def state_exists(pk):
+    """Whether StateData ``pk`` exists; only ids the catalog does not know cost a query"""
+    return pk in get_catalog().by_pk or StateData.objects.filter(pk=pk).exists()
+
+
+def default_destination():
+    """The default destination state (Maine) without a query, or None if the database has no such row"""
+    return get_catalog().by_code.get(DEFAULT_DESTINATION_CODE)
+
+
+async def aget_catalog():
+    return await sync_to_async(get_catalog)()
@@ -0,0 +1,262 @@
+# state_data/geo.py
+"""
+Radius search over state and region centroids.
+
+Every state and region with coordinates is placed on the unit sphere and
+indexed in a static k-d tree, built once per worker and rebuilt when the
+``states`` or ``regions`` cache tag moves on (like state_data.catalog).
+Straight-line (chord) distance between unit vectors grows monotonically with
+great-circle distance, so a radius in miles becomes a Euclidean ball and
+the tree answers "everything within N miles" in O(log n + k) without
+touching the database.
+"""
+
+import math
+import threading
+
+from asgiref.sync import sync_to_async
+
+from mysite.response_cache import tag_versions
+from .catalog import get_catalog
+from .models import Region
+
+EARTH_RADIUS_MILES = 3958.8
+
+# Approximate geographic centre of each state (latitude, longitude)
+STATE_CENTROIDS = {
+    'AL': (32.7794, -86.8287), 'AK': (64.0685, -152.2782), 'AZ': (34.2744, -111.6602),
+    'AR': (34.8938, -92.4426), 'CA': (37.1841, -119.4696), 'CO': (38.9972, -105.5478),
+    'CT': (41.6219, -72.7273), 'DE': (38.9896, -75.5050), 'FL': (28.6305, -82.4497),
+    'GA': (32.6415, -83.4426), 'HI': (20.2927, -156.3737), 'ID': (44.3509, -114.6130),
+    'IL': (40.0417, -89.1965), 'IN': (39.8942, -86.2816), 'IA': (42.0751, -93.4960),
+    'KS': (38.4937, -98.3804), 'KY': (37.5347, -85.3021), 'LA': (31.0689, -91.9968),
+    'ME': (45.3695, -69.2428), 'MD': (39.0550, -76.7909), 'MA': (42.2596, -71.8083),
+    'MI': (44.3467, -85.4102), 'MN': (46.2807, -94.3053), 'MS': (32.7364, -89.6678),
+    'MO': (38.3566, -92.4580), 'MT': (47.0527, -109.6333), 'NE': (41.5378, -99.7951),
+    'NV': (39.3289, -116.6312), 'NH': (43.6805, -71.5811), 'NJ': (40.1907, -74.6728),
+    'NM': (34.4071, -106.1126), 'NY': (42.9538, -75.5268), 'NC': (35.5557, -79.3877),
+    'ND': (47.4501, -100.4659), 'OH': (40.2862, -82.7937), 'OK': (35.5889, -97.4943),
+    'OR': (43.9336, -120.5583), 'PA': (40.8781, -77.7996), 'RI': (41.6762, -71.5562),
+    'SC': (33.9169, -80.8964), 'SD': (44.4443, -100.2263), 'TN': (35.8580, -86.3505),
+    'TX': (31.4757, -99.3312), 'UT': (39.3055, -111.6703), 'VT': (44.0687, -72.6658),
+    'VA': (37.5215, -78.8537), 'WA': (47.3826, -120.4472), 'WV': (38.6409, -80.6227),
+    'WI': (44.6243, -89.9941), 'WY': (42.9957, -107.5512),
+}
+
+# Subtrees this small are scanned rather than split further
+LEAF_SIZE = 8
+
+DEFAULT_RADIUS_MILES = 100
+MAX_RADIUS_MILES = 500
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+PLACE_TYPES = ('state', Region.COUNTY, Region.METRO)
+
+
+def unit_vector(latitude, longitude):
+    lat, lon = math.radians(latitude), math.radians(longitude)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+
+def chord_for_miles(miles):
+    """Straight-line distance between unit vectors ``miles`` apart along the surface"""
+    return 2 * math.sin(min(miles / EARTH_RADIUS_MILES, math.pi) / 2)
+
+
+def miles_for_chord(chord):
+    return 2 * EARTH_RADIUS_MILES * math.asin(min(chord / 2, 1.0))
+
+
+class KDTree:
+    """
+    Static k-d tree over 3-d points.
+
+    The tree is implicit: ``order`` is a permutation of the point indices in
+    which the node of range [lo, hi) sits at its midpoint, with the points
+    before it on the low side of ``axes[mid]`` and the points after it on the
+    high side.
+    """
+
+    def __init__(self, points):
+        self.points = points
+        self.order = list(range(len(points)))
+        self.axes = [0] * len(points)
+        stack = [(0, len(points))]
+        while stack:
+            lo, hi = stack.pop()
+            if hi - lo <= LEAF_SIZE:
+                continue
+            members = self.order[lo:hi]
+            # Split along the widest extent, which keeps the cells compact on a sphere
+            axis = max(range(3), key=lambda a: (
+                max(points[i][a] for i in members) - min(points[i][a] for i in members)
+            ))
+            members.sort(key=lambda i: points[i][axis])
+            self.order[lo:hi] = members
+            mid = (lo + hi) // 2
+            self.axes[mid] = axis
+            stack.append((lo, mid))
+            stack.append((mid + 1, hi))
+
+    def within(self, center, radius):
+        """(index, distance) for every point within ``radius`` of ``center``"""
+        points, order, axes = self.points, self.order, self.axes
+        cx, cy, cz = center
+        radius_squared = radius * radius
+        found = []
+        stack = [(0, len(points))]
+        while stack:
+            lo, hi = stack.pop()
+            if hi - lo <= LEAF_SIZE:
+                candidates = range(lo, hi)
+            else:
+                mid = (lo + hi) // 2
+                delta = center[axes[mid]] - points[order[mid]][axes[mid]]
+                if delta <= radius:
+                    stack.append((lo, mid))
+                if delta >= -radius:
+                    stack.append((mid + 1, hi))
+                candidates = (mid,)
+            for position in candidates:
+                index = order[position]
+                x, y, z = points[index]
+                distance_squared = (x - cx) ** 2 + (y - cy) ** 2 + (z - cz) ** 2
+                if distance_squared <= radius_squared:
+                    found.append((index, math.sqrt(distance_squared)))
+        return found
+
+
+class PlaceIndex:
+    """States and regions that have coordinates, with a k-d tree over their centroids"""
+
+    def __init__(self, places, version):
+        self.version = version
+        self.places = places
+        self.regions_by_pk = {place.pk: place for place in places if isinstance(place, Region)}
+        self.tree = KDTree([unit_vector(place.latitude, place.longitude) for place in places])
+
+    def nearby(self, latitude, longitude, miles):
+        """(place, distance in miles) for everything within ``miles`` of the point"""
+        found = self.tree.within(unit_vector(latitude, longitude), chord_for_miles(miles))
+        return [(self.places[index], miles_for_chord(chord)) for index, chord in found]
+
+
+def load_places():
+    states = [state for state in get_catalog().states if state.latitude is not None and state.longitude is not None]
+    regions = Region.objects.filter(latitude__isnull=False, longitude__isnull=False).only(
+        'id', 'region_type', 'code', 'name', 'state_id', 'latitude', 'longitude', 'population',
+        'cost_of_living_index', 'housing_index', 'utilities_index', 'grocery_index', 'transportation_index',
+    )
+    return states + list(regions)
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def get_place_index():
+    """The current index, rebuilt when the ``states`` or ``regions`` tag has moved on"""
+    global _index
+    version = ':'.join(tag_versions(['states', 'regions']))
+    index = _index
+    if index is None or index.version != version:
+        with _lock:
+            if _index is None or _index.version != version:
+                _index = PlaceIndex(load_places(), version)
+            index = _index
+    return index
+
+
+async def aget_place_index():
+    return await sync_to_async(get_place_index)()
+
+
+def place_type(place):
+    return place.region_type if isinstance(place, Region) else 'state'
+
+
+def _number(params, name, default=None, low=None, high=None):
+    raw = params.get(name)
+    if raw in (None, ''):
+        return default
+    try:
+        value = float(raw)
+    except ValueError:
+        raise ValueError(f'{name} must be a number')
+    if not math.isfinite(value) or (low is not None and value < low) or (high is not None and value > high):
+        raise ValueError(f'{name} must be between {low} and {high}')
+    return value
+
+
+def nearby_payload(params, catalog, index):
+    """
+    Places within ``radius`` miles of a point, cheapest relative to ``origin`` first.
+
+    The point is ``lat``/``lon``, or the centroid of state ``near`` or region
+    ``near_region`` (ids). ``type`` narrows to a comma-separated subset of
+    state, county and metro; ``max_ratio`` drops places whose overall cost
+    index is more than that multiple of the origin's (1 = no dearer). Raises
+    ValueError with a message for the client on bad parameters.
+    """
+    origin, _ = catalog.resolve(params.get('origin'), None)
+    if origin is None:
+        raise ValueError('Origin state is required')
+
+    if params.get('near_region'):
+        near_region = params['near_region']
+        center = index.regions_by_pk.get(int(near_region)) if near_region.isdigit() else None
+    elif params.get('near'):
+        center, _ = catalog.resolve(params['near'], None)
+    else:
+        center = None
+    if center is not None:
+        latitude, longitude = center.latitude, center.longitude
+        if latitude is None or longitude is None:
+            raise ValueError('That place has no coordinates')
+    elif params.get('near') or params.get('near_region'):
+        raise ValueError('Place not found')
+    else:
+        latitude = _number(params, 'lat', low=-90, high=90)
+        longitude = _number(params, 'lon', low=-180, high=180)
+        if latitude is None or longitude is None:
+            raise ValueError('lat and lon, near or near_region is required')
+
+    radius = _number(params, 'radius', DEFAULT_RADIUS_MILES, 0, MAX_RADIUS_MILES)
+    max_ratio = _number(params, 'max_ratio', low=0)
+    limit = int(_number(params, 'limit', DEFAULT_LIMIT, 1, MAX_LIMIT))
+    types = set(params.get('type', '').split(',')) & set(PLACE_TYPES) or set(PLACE_TYPES)
+
+    results = []
+    for place, distance in index.nearby(latitude, longitude, radius):
+        kind = place_type(place)
+        if kind not in types:
+            continue
+        ratio = place.cost_of_living_index / origin.cost_of_living_index
+        if max_ratio is not None and ratio > max_ratio:
+            continue
+        results.append((ratio, distance, kind, place))
+    results.sort(key=lambda result: (result[0], result[1]))
+
+    return {
+        'origin_state': {'id': origin.pk, 'state_code': origin.state_code, 'state_name': origin.state_name},
+        'center': {'latitude': latitude, 'longitude': longitude},
+        'radius_miles': radius,
+        'count': len(results),
+        'results': [
+            {
+                'type': kind,
+                'id': place.pk,
+                'code': place.state_code if kind == 'state' else place.code,
+                'name': place.state_name if kind == 'state' else place.name,
+                'state_code': place.state_code if kind == 'state' else catalog.by_pk[place.state_id].state_code,
+                'latitude': place.latitude,
+                'longitude': place.longitude,
+                'distance_miles': round(distance, 1),
+                'cost_of_living_index': place.cost_of_living_index,
+                'housing_index': place.housing_index,
+                'cost_ratio': round(ratio, 3),
+                'overall_cost_change': round((ratio - 1) * 100, 1),
+            }
+            for ratio, distance, kind, place in results[:limit]
+        ],
+    }
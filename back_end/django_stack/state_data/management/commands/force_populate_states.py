@@ -1,8 +1,14 @@
 # state_data/management/commands/force_populate_states.py
 
 from django.core.management.base import BaseCommand
+from mysite.metrics import registry
+from state_data.geo import STATE_CENTROIDS
 from state_data.models import StateData, VeteranBenefit
 
+# Folded into the shared metrics archive when the command exits (METRICS['MULTIPROCESS_DIR'])
+state_rows = registry.counter(
+    'state_population_rows_total', 'StateData rows written by the populate commands', ['command', 'action'])
+
 class Command(BaseCommand):
     help = 'Force populate all US states, overwriting existing data'
 
@@ -91,10 +97,13 @@ class Command(BaseCommand):
                     'state_income_tax_max': tax_max,
                     'sales_tax_rate': sales_tax,
                     'property_tax_rate': property_tax,
+                    'latitude': STATE_CENTROIDS[state_code][0],
+                    'longitude': STATE_CENTROIDS[state_code][1],
                     'data_source': 'Management Command - All 50 States'
                 }
             )
 
+            state_rows.labels('force_populate_states', 'created' if created else 'updated').inc()
             if created:
                 created_count += 1
                 self.stdout.write(
@@ -0,0 +1,290 @@
+# state_data/management/commands/ingest_regions.py
+"""
+Load county and metro area cost-of-living extracts into Region.
+
+Each CSV needs a header row with region_type ('county' or 'metro'), code,
+name, state_code, cost_of_living_index, housing_index, utilities_index,
+grocery_index and transportation_index; population, latitude and longitude
+are optional.
+
+Files are cut into byte ranges on line boundaries that worker processes
+parse and validate independently, so a large extract is read in pieces and
+on every core. Valid rows are compared with what is stored and only new or
+changed ones are upserted, one chunk at a time, inside a single transaction:
+re-running an unchanged extract writes nothing. Quoted fields must not
+contain line breaks.
+"""
+
+import csv
+import math
+import multiprocessing
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db import connections, transaction
+
+from mysite.response_cache import invalidate_tags
+from mysite.sharding import replicate_reference_rows
+from state_data.models import Region, StateData
+
+INDEX_FIELDS = [
+    'cost_of_living_index', 'housing_index', 'utilities_index', 'grocery_index', 'transportation_index',
+]
+COORDINATE_FIELDS = ['latitude', 'longitude']
+REQUIRED_COLUMNS = ['region_type', 'code', 'name', 'state_code'] + INDEX_FIELDS
+OPTIONAL_COLUMNS = ['population'] + COORDINATE_FIELDS
+
+# Order of the values compared with stored rows and written on upsert
+VALUE_FIELDS = ['name', 'state_id'] + INDEX_FIELDS + OPTIONAL_COLUMNS + ['data_source']
+
+MAX_REPORTED_ERRORS = 20
+
+# Inherited by forked workers so the state map and bounds are not pickled for every range
+_context = None
+
+
+class IngestionContext:
+    """What a worker needs to turn raw lines into validated rows"""
+
+    def __init__(self, state_ids, data_source):
+        self.state_ids = state_ids
+        self.data_source = data_source
+        self.region_types = {value for value, _ in Region.REGION_TYPE_CHOICES}
+        self.code_length = Region._meta.get_field('code').max_length
+        self.name_length = Region._meta.get_field('name').max_length
+        self.bounds = [(name, *field_bounds(Region._meta.get_field(name))) for name in INDEX_FIELDS]
+        self.coordinate_bounds = [(name, *field_bounds(Region._meta.get_field(name))) for name in COORDINATE_FIELDS]
+
+
+def field_bounds(field):
+    """(min, max) from a model field's Min/MaxValueValidators"""
+    low = high = None
+    for validator in field.validators:
+        if isinstance(validator, MinValueValidator):
+            low = validator.limit_value
+        elif isinstance(validator, MaxValueValidator):
+            high = validator.limit_value
+    return low, high
+
+
+def column_positions(columns):
+    """Field name -> index in a record, for the columns this command reads"""
+    return {name: columns.index(name) for name in REQUIRED_COLUMNS + OPTIONAL_COLUMNS if name in columns}
+
+
+def parse_bounded(field, raw, low, high):
+    number = float(raw or 'nan')
+    if not math.isfinite(number) or (low is not None and number < low) or (high is not None and number > high):
+        raise ValueError(f'{field} {raw!r} outside [{low}, {high}]')
+    return number
+
+
+def parse_row(values, positions):
+    """((region_type, code), values in VALUE_FIELDS order) for one CSV record; raises ValueError"""
+    def value(name):
+        index = positions.get(name)
+        return values[index].strip() if index is not None and index < len(values) else ''
+
+    region_type = value('region_type').lower()
+    if region_type not in _context.region_types:
+        raise ValueError(f'unknown region_type {region_type!r}')
+    code = value('code')
+    if not code or len(code) > _context.code_length:
+        raise ValueError(f'invalid code {code!r}')
+    name = value('name')
+    if not name or len(name) > _context.name_length:
+        raise ValueError('missing or overlong name')
+    state_id = _context.state_ids.get(value('state_code').upper())
+    if state_id is None:
+        raise ValueError(f"unknown state_code {value('state_code')!r}")
+
+    indices = [parse_bounded(field, value(field), low, high) for field, low, high in _context.bounds]
+
+    population = value('population') or None
+    if population is not None:
+        population = int(population.replace(',', ''))
+        if population < 0:
+            raise ValueError('negative population')
+
+    coordinates = [value(field) for field in COORDINATE_FIELDS]
+    if any(coordinates):
+        coordinates = [
+            parse_bounded(field, raw, low, high)
+            for raw, (field, low, high) in zip(coordinates, _context.coordinate_bounds)
+        ]
+    else:
+        coordinates = [None] * len(COORDINATE_FIELDS)
+
+    return (region_type, code), (name, state_id, *indices, population, *coordinates, _context.data_source)
+
+
+def parse_range(job):
+    """Validated rows and errors for the lines of ``path`` starting in [start, end)"""
+    path, start, end, columns = job
+    with open(path, 'rb') as extract:
+        extract.seek(start)
+        lines = extract.read(end - start).split(b'\n')
+
+    positions = column_positions(columns)
+    rows, errors = [], []
+
+    def error(number, message):
+        offset = start + sum(len(line) + 1 for line in lines[:number])
+        errors.append(f'{path} (byte {offset}): {message}')
+
+    try:
+        text = [line.decode('utf-8') for line in lines]
+    except UnicodeDecodeError:
+        # Find the offending lines; the rest of the range is still usable
+        text = []
+        for number, line in enumerate(lines):
+            try:
+                text.append(line.decode('utf-8'))
+            except UnicodeDecodeError as exc:
+                error(number, exc)
+                text.append('')
+
+    # Without quoted line breaks the reader yields exactly one record per line
+    for number, values in enumerate(csv.reader(text)):
+        if not values or not any(values):
+            continue
+        try:
+            if len(values) > len(columns):
+                raise ValueError(f'{len(values)} fields, header has {len(columns)}')
+            rows.append(parse_row(values, positions))
+        except ValueError as exc:
+            error(number, exc)
+    return rows, errors
+
+
+def split_ranges(path, chunk_size):
+    """Header columns and (start, end) byte ranges of ``path`` that each begin on a new line"""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as extract:
+        header = extract.readline()
+        columns = [column.strip().lower() for column in next(csv.reader([header.decode('utf-8-sig')]), [])]
+        boundaries = [extract.tell()]
+        while boundaries[-1] + chunk_size < size:
+            extract.seek(boundaries[-1] + chunk_size)
+            extract.readline()  # finish the line the cut landed in
+            boundaries.append(extract.tell())
+    boundaries.append(size)
+    return columns, [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+
+
+class Command(BaseCommand):
+    help = 'Validate county/metro cost-of-living CSV extracts and upsert the regions that changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='CSV extract(s) to load')
+        parser.add_argument('--source', default='', help='data_source recorded on written rows')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='parsing processes (default: CPU count)')
+        parser.add_argument('--chunk-size', type=int, default=8 * 1024 * 1024,
+                            help='bytes of CSV parsed per job')
+        parser.add_argument('--batch-size', type=int, default=1000, help='rows per upsert statement')
+        parser.add_argument('--strict', action='store_true',
+                            help='write nothing if any row is invalid')
+        parser.add_argument('--dry-run', action='store_true', help='report changes without writing them')
+
+    def handle(self, *args, **options):
+        global _context
+
+        started = time.perf_counter()
+        jobs = []
+        for path in options['paths']:
+            if not os.path.isfile(path):
+                raise CommandError(f'{path} does not exist')
+            columns, ranges = split_ranges(path, max(options['chunk_size'], 1))
+            missing = [column for column in REQUIRED_COLUMNS if column not in columns]
+            if missing:
+                raise CommandError(f"{path} is missing columns: {', '.join(missing)}")
+            jobs.extend((path, start, end, columns) for start, end in ranges)
+
+        state_ids = dict(StateData.objects.values_list('state_code', 'pk'))
+        if not state_ids:
+            raise CommandError('No state data found; run populate_states first')
+        _context = IngestionContext(state_ids, options['source'])
+
+        existing = {
+            (region_type, code): tuple(values)
+            for region_type, code, *values in Region.objects.values_list('region_type', 'code', *VALUE_FIELDS)
+        }
+
+        workers = options['workers'] or multiprocessing.cpu_count()
+        stats = {'read': 0, 'invalid': 0, 'unchanged': 0, 'created': 0, 'updated': 0}
+        errors = []
+        if workers > 1 and len(jobs) > 1:
+            # Workers only parse, but must not inherit this process's connections
+            connections.close_all()
+            pool = multiprocessing.get_context('fork').Pool(workers)
+            results = pool.imap(parse_range, jobs)
+        else:
+            pool = None
+            results = map(parse_range, jobs)
+
+        try:
+            with transaction.atomic():
+                seen = set()
+                for rows, range_errors in results:
+                    stats['read'] += len(rows) + len(range_errors)
+                    errors.extend(range_errors)
+                    changed = []
+                    for key, values in rows:
+                        if key in seen:
+                            errors.append(f'duplicate {key[0]} {key[1]}')
+                            continue
+                        seen.add(key)
+                        previous = existing.get(key)
+                        if previous == values:
+                            stats['unchanged'] += 1
+                            continue
+                        stats['updated' if previous else 'created'] += 1
+                        changed.append((key, values))
+                    if changed and not options['dry_run']:
+                        self.upsert(changed, options['batch_size'])
+
+                stats['invalid'] = len(errors)
+                if errors and options['strict']:
+                    raise CommandError(self.describe_errors(errors))
+                if options['dry_run']:
+                    transaction.set_rollback(True)
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+        for error in errors[:MAX_REPORTED_ERRORS]:
+            self.stderr.write(error)
+        if len(errors) > MAX_REPORTED_ERRORS:
+            self.stderr.write(f'... and {len(errors) - MAX_REPORTED_ERRORS} more invalid rows')
+
+        if (stats['created'] or stats['updated']) and not options['dry_run']:
+            invalidate_tags('regions')
+            # Bulk upserts send no signals, so refresh the calculation shards' copies here
+            replicate_reference_rows(Region)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Would write' if options['dry_run'] else 'Wrote'} {stats['created']} new and "
+            f"{stats['updated']} changed regions; {stats['unchanged']} unchanged, {stats['invalid']} invalid, "
+            f"{stats['read']} rows read from {len(jobs)} ranges in {elapsed:.1f}s"
+        ))
+
+    def upsert(self, rows, batch_size):
+        Region.objects.bulk_create(
+            [
+                Region(region_type=region_type, code=code, **dict(zip(VALUE_FIELDS, values)))
+                for (region_type, code), values in rows
+            ],
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=['code', 'region_type'],
+            update_fields=[field for field in VALUE_FIELDS if field != 'state_id'] + ['state', 'last_updated'],
+        )
+
+    def describe_errors(self, errors):
+        shown = '\n'.join(errors[:MAX_REPORTED_ERRORS])
+        more = len(errors) - MAX_REPORTED_ERRORS
+        return f"{len(errors)} invalid rows, nothing written:\n{shown}" + (f'\n... and {more} more' if more > 0 else '')
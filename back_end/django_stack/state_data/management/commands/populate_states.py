@@ -1,8 +1,14 @@
 # state_data/management/commands/populate_states.py
 
 from django.core.management.base import BaseCommand
+from mysite.metrics import registry
+from state_data.geo import STATE_CENTROIDS
 from state_data.models import StateData, VeteranBenefit
 
+# Folded into the shared metrics archive when the command exits (METRICS['MULTIPROCESS_DIR'])
+state_rows = registry.counter(
+    'state_population_rows_total', 'StateData rows written by the populate commands', ['command', 'action'])
+
 class Command(BaseCommand):
     help = 'Populate all US states with cost of living data'
 
@@ -79,10 +85,13 @@ class Command(BaseCommand):
                     'state_income_tax_max': tax_max,
                     'sales_tax_rate': sales_tax,
                     'property_tax_rate': property_tax,
+                    'latitude': STATE_CENTROIDS[state_code][0],
+                    'longitude': STATE_CENTROIDS[state_code][1],
                     'data_source': 'US Bureau of Labor Statistics / Tax Foundation'
                 }
             )
 
+            state_rows.labels('populate_states', 'created' if created else 'updated').inc()
             if created:
                 created_count += 1
                 self.stdout.write(
@@ -100,6 +109,7 @@ class Command(BaseCommand):
                 state_data.state_income_tax_max = tax_max
                 state_data.sales_tax_rate = sales_tax
                 state_data.property_tax_rate = property_tax
+                state_data.latitude, state_data.longitude = STATE_CENTROIDS[state_code]
                 state_data.data_source = 'US Bureau of Labor Statistics / Tax Foundation'
                 state_data.save()
                 updated_count += 1
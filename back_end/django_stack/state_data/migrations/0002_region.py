@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:49
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('state_data', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Region',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('region_type', models.CharField(choices=[('county', 'County'), ('metro', 'Metro area')], max_length=10)),
+                ('code', models.CharField(help_text='County FIPS code or metro area CBSA code', max_length=10)),
+                ('name', models.CharField(max_length=100)),
+                ('cost_of_living_index', models.FloatField(validators=[django.core.validators.MinValueValidator(30), django.core.validators.MaxValueValidator(400)])),
+                ('housing_index', models.FloatField(validators=[django.core.validators.MinValueValidator(10), django.core.validators.MaxValueValidator(800)])),
+                ('utilities_index', models.FloatField(validators=[django.core.validators.MinValueValidator(30), django.core.validators.MaxValueValidator(300)])),
+                ('grocery_index', models.FloatField(validators=[django.core.validators.MinValueValidator(50), django.core.validators.MaxValueValidator(200)])),
+                ('transportation_index', models.FloatField(validators=[django.core.validators.MinValueValidator(50), django.core.validators.MaxValueValidator(200)])),
+                ('population', models.PositiveIntegerField(blank=True, null=True)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('data_source', models.CharField(blank=True, max_length=200)),
+                ('state', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='regions', to='state_data.statedata')),
+            ],
+            options={
+                'verbose_name': 'Region',
+                'verbose_name_plural': 'Regions',
+                'ordering': ['name'],
+                'indexes': [models.Index(fields=['state', 'region_type', 'name'], name='region_state_type_name')],
+                'constraints': [models.UniqueConstraint(fields=('code', 'region_type'), name='unique_region_code')],
+            },
+        ),
+    ]
@@ -76,6 +76,16 @@ class StateData(models.Model):
         help_text="Effective property tax rate as percentage"
     )
     
+    # Geographic centre, for radius search (see state_data/geo.py)
+    latitude = models.FloatField(
+        null=True, blank=True,
+        validators=[MinValueValidator(-90), MaxValueValidator(90)]
+    )
+    longitude = models.FloatField(
+        null=True, blank=True,
+        validators=[MinValueValidator(-180), MaxValueValidator(180)]
+    )
+    
     # Metadata
     last_updated = models.DateTimeField(auto_now=True)
     data_source = models.CharField(max_length=200, blank=True)
@@ -137,4 +147,69 @@ class VeteranBenefit(models.Model):
         verbose_name_plural = "Veteran Benefits"
     
     def __str__(self):
-        return f"Veteran Benefits - {self.state.state_name}"
\ No newline at end of file
+        return f"Veteran Benefits - {self.state.state_name}"
+
+class Region(models.Model):
+    """Sub-state area (county or metro area) with its own cost of living indices"""
+    
+    COUNTY = 'county'
+    METRO = 'metro'
+    REGION_TYPE_CHOICES = [
+        (COUNTY, 'County'),
+        (METRO, 'Metro area'),
+    ]
+    
+    # Metro areas spanning several states belong to their principal state.
+    # Covered by the (state, region_type, name) index, so no separate FK index
+    state = models.ForeignKey(StateData, on_delete=models.CASCADE, related_name='regions', db_index=False)
+    region_type = models.CharField(max_length=10, choices=REGION_TYPE_CHOICES)
+    code = models.CharField(max_length=10, help_text="County FIPS code or metro area CBSA code")
+    name = models.CharField(max_length=100)
+    
+    # Same indices as StateData (100 = national average), with wider ranges:
+    # housing varies far more between counties than between states
+    cost_of_living_index = models.FloatField(
+        validators=[MinValueValidator(30), MaxValueValidator(400)]
+    )
+    housing_index = models.FloatField(
+        validators=[MinValueValidator(10), MaxValueValidator(800)]
+    )
+    utilities_index = models.FloatField(
+        validators=[MinValueValidator(30), MaxValueValidator(300)]
+    )
+    grocery_index = models.FloatField(
+        validators=[MinValueValidator(50), MaxValueValidator(200)]
+    )
+    transportation_index = models.FloatField(
+        validators=[MinValueValidator(50), MaxValueValidator(200)]
+    )
+    population = models.PositiveIntegerField(null=True, blank=True)
+    
+    # Centroid, for radius search (see state_data/geo.py)
+    latitude = models.FloatField(
+        null=True, blank=True,
+        validators=[MinValueValidator(-90), MaxValueValidator(90)]
+    )
+    longitude = models.FloatField(
+        null=True, blank=True,
+        validators=[MinValueValidator(-180), MaxValueValidator(180)]
+    )
+    
+    # Metadata
+    last_updated = models.DateTimeField(auto_now=True)
+    data_source = models.CharField(max_length=200, blank=True)
+    
+    class Meta:
+        verbose_name = "Region"
+        verbose_name_plural = "Regions"
+        ordering = ['name']
+        constraints = [
+            # Leads with code so lookups by code alone use it too
+            models.UniqueConstraint(fields=['code', 'region_type'], name='unique_region_code'),
+        ]
+        indexes = [
+            models.Index(fields=['state', 'region_type', 'name'], name='region_state_type_name'),
+        ]
+    
+    def __str__(self):
+        return f"{self.name} ({self.get_region_type_display()}, {self.code})"
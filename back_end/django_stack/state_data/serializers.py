@@ -1,7 +1,7 @@
 # state_data/serializers.py
 
 from rest_framework import serializers
-from .models import StateData, VeteranBenefit
+from .models import Region, StateData, VeteranBenefit
 
 class StateDataSerializer(serializers.ModelSerializer):
     is_maine = serializers.ReadOnlyField()
@@ -14,7 +14,7 @@ class StateDataSerializer(serializers.ModelSerializer):
             'housing_index', 'utilities_index', 'grocery_index', 'transportation_index',
             'state_income_tax_min', 'state_income_tax_max', 'sales_tax_rate', 
             'property_tax_rate', 'is_maine', 'has_no_state_income_tax',
-            'last_updated', 'data_source'
+            'latitude', 'longitude', 'last_updated', 'data_source'
         ]
         read_only_fields = ['id', 'last_updated', 'is_maine', 'has_no_state_income_tax']
 
@@ -31,4 +31,17 @@ class VeteranBenefitSerializer(serializers.ModelSerializer):
             'vehicle_registration_discount', 'hunting_fishing_license_free',
             'homestead_exemption', 'notes', 'last_updated'
         ]
-        read_only_fields = ['id', 'last_updated']
\ No newline at end of file
+        read_only_fields = ['id', 'last_updated']
+
+class RegionSerializer(serializers.ModelSerializer):
+    state_code = serializers.CharField(source='state.state_code', read_only=True)
+    
+    class Meta:
+        model = Region
+        fields = [
+            'id', 'region_type', 'code', 'name', 'state', 'state_code',
+            'cost_of_living_index', 'housing_index', 'utilities_index',
+            'grocery_index', 'transportation_index', 'population',
+            'latitude', 'longitude', 'last_updated', 'data_source'
+        ]
+        read_only_fields = fields
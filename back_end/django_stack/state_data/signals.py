@@ -0,0 +1,47 @@
+# state_data/signals.py
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from mysite.events import publish_on_commit
+from mysite.response_cache import invalidate_tags, tag_versions
+from mysite.sharding import replicate_on_commit
+from .models import Region, StateData, VeteranBenefit
+
+
+@receiver(post_save, sender=StateData)
+@receiver(post_delete, sender=StateData)
+def invalidate_state_responses(sender, instance, **kwargs):
+    """Comparisons are tagged by id or code; the catalog and calculation payloads by 'states'"""
+    invalidate_tags(f'state:{instance.pk}', f'state:{instance.state_code}', 'states')
+
+
+@receiver(post_save, sender=StateData)
+@receiver(post_delete, sender=StateData)
+def publish_states_version(sender, instance, raw=False, **kwargs):
+    """Every stream hears the new catalog version, which clients compare with the one they hold"""
+    if raw:
+        return
+    publish_on_commit('states', 'states', lambda: {'version': tag_versions(['states'])[0]})
+
+
+@receiver(post_save, sender=VeteranBenefit)
+@receiver(post_delete, sender=VeteranBenefit)
+def invalidate_benefit_responses(sender, instance, **kwargs):
+    invalidate_tags(f'state:{instance.state_id}')
+
+
+@receiver(post_save, sender=Region)
+@receiver(post_delete, sender=Region)
+def invalidate_region_responses(sender, instance, **kwargs):
+    """ingest_regions writes in bulk without signals and invalidates the tag itself"""
+    invalidate_tags('regions')
+
+
+@receiver(post_save, sender=StateData)
+@receiver(post_delete, sender=StateData)
+@receiver(post_save, sender=Region)
+@receiver(post_delete, sender=Region)
+def replicate_to_shards(sender, instance, **kwargs):
+    """Calculation shards join to their own copies of the reference rows"""
+    replicate_on_commit(instance)
@@ -1,3 +1,295 @@
-from django.test import TestCase
+import math
+import os
+import random
+import shutil
+import tempfile
+from io import StringIO
 
-# Create your tests here.
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+
+from mysite.sharding import replicate_reference_rows
+
+from .catalog import get_catalog
+from .geo import (
+    EARTH_RADIUS_MILES, MAX_RADIUS_MILES, STATE_CENTROIDS, KDTree, chord_for_miles, get_place_index,
+    miles_for_chord, nearby_payload, unit_vector,
+)
+from .management.commands.ingest_regions import split_ranges
+from .models import Region, StateData
+
+
+def haversine_miles(a, b):
+    (lat1, lon1), (lat2, lon2) = [(math.radians(lat), math.radians(lon)) for lat, lon in (a, b)]
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(min(math.sqrt(h), 1.0))
+
+
+class KDTreeTests(SimpleTestCase):
+    """The tree's radius search against a brute-force haversine scan"""
+
+    def setUp(self):
+        rng = random.Random(44)
+        # The state centroids plus enough scattered points for a tree several levels deep
+        self.coordinates = list(STATE_CENTROIDS.values()) + [
+            (rng.uniform(-80, 80), rng.uniform(-180, 180)) for _ in range(500)
+        ]
+        self.tree = KDTree([unit_vector(lat, lon) for lat, lon in self.coordinates])
+
+    def search(self, center, miles):
+        found = self.tree.within(unit_vector(*center), chord_for_miles(miles))
+        return {index: miles_for_chord(chord) for index, chord in found}
+
+    def brute_force(self, center, miles):
+        distances = {index: haversine_miles(center, point) for index, point in enumerate(self.coordinates)}
+        return {index: distance for index, distance in distances.items() if distance <= miles}
+
+    def assertMatchesBruteForce(self, center, miles):
+        found, expected = self.search(center, miles), self.brute_force(center, miles)
+        # Rounding may put a point sitting exactly on the boundary either side
+        on_boundary = {
+            index for index, point in enumerate(self.coordinates)
+            if abs(haversine_miles(center, point) - miles) < 1e-6
+        }
+        self.assertEqual(found.keys() - on_boundary, expected.keys() - on_boundary, (center, miles))
+        for index, distance in found.items():
+            self.assertAlmostEqual(distance, haversine_miles(center, self.coordinates[index]), places=6)
+
+    def test_radius_search_matches_a_brute_force_scan(self):
+        centers = [STATE_CENTROIDS['ME'], STATE_CENTROIDS['HI'], (0.0, 179.9), (89.0, 0.0), (-45.0, -60.0)]
+        for center in centers:
+            for miles in (1, 50, 250, 1000, 3000, 8000):
+                self.assertMatchesBruteForce(center, miles)
+
+    def test_zero_radius_finds_only_the_point_itself(self):
+        maine = list(STATE_CENTROIDS).index('ME')
+        self.assertEqual(self.search(STATE_CENTROIDS['ME'], 0), {maine: 0.0})
+        self.assertEqual(self.search((0.0, 0.0), 0), {})
+
+    def test_radius_beyond_the_antipode_finds_everything(self):
+        for miles in (EARTH_RADIUS_MILES * math.pi, 50000):
+            self.assertEqual(len(self.search(STATE_CENTROIDS['TX'], miles)), len(self.coordinates))
+
+    def test_empty_and_tiny_trees(self):
+        self.assertEqual(KDTree([]).within((1.0, 0.0, 0.0), 1.0), [])
+        self.assertEqual([index for index, _ in KDTree([(1.0, 0.0, 0.0)]).within((1.0, 0.0, 0.0), 0)], [0])
+
+
+class NearbyPayloadTests(TestCase):
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.states = {
+            code: self.create_state(code, name, index)
+            for code, name, index in [
+                ('ME', 'Maine', 110), ('NH', 'New Hampshire', 100), ('VT', 'Vermont', 95),
+                ('MA', 'Massachusetts', 130), ('TX', 'Texas', 90),
+            ]
+        }
+        self.portland = Region.objects.create(
+            state=self.states['ME'], region_type=Region.METRO, code='38860', name='Portland',
+            cost_of_living_index=98, housing_index=120, utilities_index=100, grocery_index=100,
+            transportation_index=100, latitude=43.6591, longitude=-70.2568,
+        )
+
+    def create_state(self, code, name, cost_of_living_index):
+        latitude, longitude = STATE_CENTROIDS[code]
+        return StateData.objects.create(
+            state_code=code, state_name=name, cost_of_living_index=cost_of_living_index, housing_index=100,
+            utilities_index=100, grocery_index=100, transportation_index=100, state_income_tax_min=0,
+            state_income_tax_max=5, sales_tax_rate=5, property_tax_rate=1,
+            latitude=latitude, longitude=longitude,
+        )
+
+    def nearby(self, **params):
+        params = {key: str(value) for key, value in params.items()}
+        return nearby_payload(params, get_catalog(), get_place_index())
+
+    def places(self, payload):
+        return [(result['type'], result['code']) for result in payload['results']]
+
+    def test_results_match_a_brute_force_scan(self):
+        origin = self.states['TX']
+        center = STATE_CENTROIDS['ME']
+        for radius in (0, 100, 200, 300, MAX_RADIUS_MILES):
+            payload = self.nearby(origin=origin.pk, near=self.states['ME'].pk, radius=radius)
+            expected = {
+                ('state', state.state_code) for state in self.states.values()
+                if haversine_miles(center, STATE_CENTROIDS[state.state_code]) <= radius
+            }
+            if haversine_miles(center, (self.portland.latitude, self.portland.longitude)) <= radius:
+                expected.add(('metro', self.portland.code))
+            self.assertEqual(set(self.places(payload)), expected, radius)
+        self.assertEqual(self.places(self.nearby(origin=origin.pk, near=self.states['ME'].pk, radius=0)),
+                         [('state', 'ME')])
+
+    def test_cheapest_first_and_max_ratio(self):
+        payload = self.nearby(origin=self.states['NH'].pk, near=self.states['NH'].pk, radius=MAX_RADIUS_MILES)
+        ratios = [result['cost_ratio'] for result in payload['results']]
+        self.assertEqual(ratios, sorted(ratios))
+        self.assertEqual(self.places(payload)[0], ('state', 'VT'))
+
+        # No dearer than New Hampshire (100): Vermont (95), Portland (98) and New Hampshire itself
+        payload = self.nearby(origin=self.states['NH'].pk, near=self.states['NH'].pk,
+                              radius=MAX_RADIUS_MILES, max_ratio=1)
+        self.assertEqual(self.places(payload), [('state', 'VT'), ('metro', '38860'), ('state', 'NH')])
+
+        payload = self.nearby(origin=self.states['NH'].pk, near=self.states['NH'].pk,
+                              radius=MAX_RADIUS_MILES, max_ratio=1, type='state')
+        self.assertEqual(self.places(payload), [('state', 'VT'), ('state', 'NH')])
+
+    def test_near_region(self):
+        payload = self.nearby(origin=self.states['TX'].pk, near_region=self.portland.pk, radius=0)
+        self.assertEqual(self.places(payload), [('metro', '38860')])
+        self.assertEqual(payload['results'][0]['state_code'], 'ME')
+
+    def test_bad_parameters(self):
+        maine = self.states['ME'].pk
+        for params, message in [
+            ({'near': maine}, 'Origin state is required'),
+            ({'origin': 999999, 'near': maine}, 'Origin state is required'),
+            ({'origin': 'ME', 'near': maine}, 'Origin state is required'),
+            ({'origin': maine, 'near': 999999}, 'Place not found'),
+            ({'origin': maine, 'near_region': 999999}, 'Place not found'),
+            ({'origin': maine, 'near_region': 'x'}, 'Place not found'),
+            ({'origin': maine}, 'lat and lon, near or near_region is required'),
+            ({'origin': maine, 'lat': 95, 'lon': 0}, 'lat must be between -90 and 90'),
+            ({'origin': maine, 'near': maine, 'radius': MAX_RADIUS_MILES + 1}, 'radius must be between 0 and 500'),
+            ({'origin': maine, 'near': maine, 'radius': 'nan'}, 'radius must be between 0 and 500'),
+        ]:
+            with self.assertRaisesMessage(ValueError, message):
+                self.nearby(**params)
+
+
+REGIONS_CSV = '''\
+region_type,code,name,state_code,cost_of_living_index,housing_index,utilities_index,grocery_index,transportation_index,population,latitude,longitude
+metro,38860,"Portland-South Portland, ME",ME,112.5,140.2,105.0,101.3,99.8,"556,893",43.6591,-70.2568
+county,23005,Cumberland County,me,115.0,150.0,104.0,102.0,100.0,303069,,
+county,23019,"Penobscot County, ""Bangor""",ME,92.1,85.4,101.2,99.0,98.7,152199,44.8,-68.7
+metro,30100,Lebanon-Claremont,NH,104.0,110.0,102.0,100.5,97.0,,43.6,-72.2
+county,33011,Hillsborough County,NH,118.3,135.0,107.5,103.0,101.0,422937,42.9,-71.7
+'''
+
+
+class IngestRegionsMixin:
+
+    def setUp(self):
+        super().setUp()
+        for cache in caches.all():
+            cache.clear()
+        for code, name in (('ME', 'Maine'), ('NH', 'New Hampshire')):
+            StateData.objects.create(
+                state_code=code, state_name=name, cost_of_living_index=100, housing_index=100,
+                utilities_index=100, grocery_index=100, transportation_index=100, state_income_tax_min=0,
+                state_income_tax_max=5, sales_tax_rate=5, property_tax_rate=1,
+            )
+        replicate_reference_rows(StateData)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'regions.csv')
+        self.write(REGIONS_CSV)
+
+    def write(self, text):
+        with open(self.path, 'w', encoding='utf-8', newline='') as extract:
+            extract.write(text)
+
+    def ingest(self, *args, **options):
+        stdout, stderr = StringIO(), StringIO()
+        options.setdefault('workers', 1)
+        call_command('ingest_regions', self.path, *args, stdout=stdout, stderr=stderr, **options)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def stored(self):
+        return {
+            (region.region_type, region.code): region
+            for region in Region.objects.select_related('state')
+        }
+
+
+class IngestRegionsTests(IngestRegionsMixin, TestCase):
+
+    # Copies go to the calculation shards
+    databases = '__all__'
+
+    def test_ranges_start_on_line_boundaries(self):
+        with open(self.path, 'rb') as extract:
+            content = extract.read()
+        header_end = content.index(b'\n') + 1
+        for chunk_size in (1, 17, 64, 100, len(content)):
+            columns, ranges = split_ranges(self.path, chunk_size)
+            self.assertEqual(columns[:4], ['region_type', 'code', 'name', 'state_code'])
+            self.assertEqual(ranges[0][0], header_end)
+            self.assertEqual(ranges[-1][1], len(content))
+            for (_, end), (start, _) in zip(ranges, ranges[1:]):
+                self.assertEqual(end, start)
+                self.assertEqual(content[start - 1:start], b'\n')
+
+    def test_rows_straddling_a_split_load_whole(self):
+        # 64-byte ranges cut through most lines, including quoted commas and quotes
+        stdout, stderr = self.ingest(chunk_size=64, source='test extract')
+        self.assertEqual(stderr, '')
+        self.assertIn('Wrote 5 new and 0 changed regions; 0 unchanged, 0 invalid', stdout)
+
+        regions = self.stored()
+        self.assertEqual(len(regions), 5)
+        portland = regions['metro', '38860']
+        self.assertEqual(portland.name, 'Portland-South Portland, ME')
+        self.assertEqual(portland.population, 556893)
+        self.assertEqual((portland.latitude, portland.longitude), (43.6591, -70.2568))
+        self.assertEqual(portland.data_source, 'test extract')
+        self.assertEqual(regions['county', '23019'].name, 'Penobscot County, "Bangor"')
+        cumberland = regions['county', '23005']
+        self.assertEqual(cumberland.state.state_code, 'ME')
+        self.assertIsNone(cumberland.latitude)
+        self.assertIsNone(regions['metro', '30100'].population)
+
+    def test_rerun_writes_nothing(self):
+        self.ingest()
+        before = {key: region.last_updated for key, region in self.stored().items()}
+        stdout, _ = self.ingest(chunk_size=64)
+        self.assertIn('Wrote 0 new and 0 changed regions; 5 unchanged, 0 invalid', stdout)
+        self.assertEqual({key: region.last_updated for key, region in self.stored().items()}, before)
+
+    def test_changed_row_is_updated(self):
+        self.ingest()
+        before = self.stored()
+        self.write(REGIONS_CSV.replace('118.3,135.0', '119.0,135.0'))
+        stdout, _ = self.ingest()
+        self.assertIn('Wrote 0 new and 1 changed regions; 4 unchanged', stdout)
+        after = self.stored()
+        self.assertEqual(after['county', '33011'].cost_of_living_index, 119.0)
+        self.assertEqual(after['county', '33011'].pk, before['county', '33011'].pk)
+        self.assertEqual(after['metro', '38860'].last_updated, before['metro', '38860'].last_updated)
+
+    def test_invalid_rows_are_rejected(self):
+        self.write(REGIONS_CSV + (
+            'county,99001,Nowhere,ZZ,100,100,100,100,100,,,\n'
+            'county,23031,York County,ME,100,900,100,100,100,,,\n'
+            'county,23005,Cumberland again,ME,100,100,100,100,100,,,\n'
+        ))
+        stdout, stderr = self.ingest()
+        self.assertIn('Wrote 5 new and 0 changed regions; 0 unchanged, 3 invalid', stdout)
+        self.assertIn("unknown state_code 'ZZ'", stderr)
+        self.assertIn("housing_index '900' outside [10, 800]", stderr)
+        self.assertIn('duplicate county 23005', stderr)
+        self.assertNotIn(('county', '23031'), self.stored())
+
+    def test_strict_writes_nothing_when_a_row_is_invalid(self):
+        self.write(REGIONS_CSV + 'town,1,Somewhere,ME,100,100,100,100,100,,,\n')
+        with self.assertRaisesMessage(CommandError, "unknown region_type 'town'"):
+            self.ingest('--strict')
+        self.assertFalse(Region.objects.exists())
+
+
+class IngestRegionsPoolTests(IngestRegionsMixin, TransactionTestCase):
+    """Parsing in forked workers gives what parsing in-process does"""
+
+    databases = '__all__'
+
+    def test_workers_load_every_range(self):
+        stdout, stderr = self.ingest(chunk_size=64, workers=3)
+        self.assertEqual(stderr, '')
+        self.assertIn('Wrote 5 new and 0 changed regions', stdout)
+        self.assertEqual(len(self.stored()), 5)
@@ -10,4 +10,11 @@ urlpatterns = [
     
     # Compare states  
     path('compare/', views.states_comparison_data, name='states-comparison'),
+    
+    # Places within a radius, cheapest first
+    path('nearby/', views.nearby_places, name='nearby-places'),
+    
+    # Counties and metro areas
+    path('regions/', views.RegionListView.as_view(), name='region-list'),
+    path('regions/<str:region_type>/<str:code>/', views.RegionDetailView.as_view(), name='region-detail'),
 ]
\ No newline at end of file
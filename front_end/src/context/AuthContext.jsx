@@ -1,7 +1,20 @@
 // src/contexts/AuthContext.jsx
 import React, { createContext, useContext, useState, useEffect } from 'react'
+import { useQueryClient } from '@tanstack/react-query'
 import toast from 'react-hot-toast'
-import api from '../utils/api'
+import api, { bootstrapAPI, eventsAPI } from '../utils/api'
+
+// The state catalog rarely changes, so it is kept between visits and only
+// re-sent by the server when its version moves on
+const STATES_CACHE_KEY = 'statesCatalog'
+
+const readCachedStates = () => {
+  try {
+    return JSON.parse(localStorage.getItem(STATES_CACHE_KEY))
+  } catch {
+    return null
+  }
+}
 
 const AuthContext = createContext()
 
@@ -18,6 +31,7 @@ export const AuthProvider = ({ children }) => {
   const [profile, setProfile] = useState(null)
   const [token, setToken] = useState(localStorage.getItem('token'))
   const [loading, setLoading] = useState(true)
+  const queryClient = useQueryClient()
 
   // Set up API interceptor for token
   useEffect(() => {
@@ -31,11 +45,53 @@ export const AuthProvider = ({ children }) => {
     }
   }, [token])
 
+  // Refetch what the server says has changed, including writes made in other tabs
+  useEffect(() => {
+    if (!token || typeof EventSource === 'undefined') return
+    const source = eventsAPI.connect(token)
+    const refreshCalculations = (event) => {
+      const { id } = JSON.parse(event.data)
+      queryClient.invalidateQueries({ queryKey: ['calculations'] })
+      queryClient.invalidateQueries({ queryKey: ['dashboard'] })
+      queryClient.invalidateQueries({ queryKey: ['calculation', String(id)] })
+    }
+    source.addEventListener('calculation', refreshCalculations)
+    source.addEventListener('calculation_deleted', refreshCalculations)
+    source.addEventListener('states', (event) => {
+      if (JSON.parse(event.data).version !== readCachedStates()?.version) {
+        localStorage.removeItem(STATES_CACHE_KEY)
+        queryClient.invalidateQueries({ queryKey: ['states'] })
+      }
+    })
+    // Sent when this stream fell too far behind to replay what it missed
+    source.addEventListener('resync', () => queryClient.invalidateQueries())
+    return () => source.close()
+  }, [token])
+
   const loadUserProfile = async () => {
     try {
-      const response = await api.get('/api/calculations/auth/profile/')
-      setProfile(response.data)
-      setUser(response.data.user)
+      // One request for everything the first screen needs
+      const cachedStates = readCachedStates()
+      const response = await bootstrapAPI.get({
+        states_version: cachedStates?.version,
+        ordering: '-created_at',
+      })
+      const { profile: profileData, states_version, states, dashboard, calculations } = response.data
+
+      let catalog = states
+      if (catalog) {
+        localStorage.setItem(STATES_CACHE_KEY, JSON.stringify({ version: states_version, states: catalog }))
+      } else {
+        catalog = cachedStates.states
+      }
+
+      // Seed the queries the Dashboard and Calculator pages would otherwise fetch
+      queryClient.setQueryData(['states'], { data: catalog })
+      queryClient.setQueryData(['dashboard'], { data: dashboard })
+      queryClient.setQueryData(['calculations', { limit: 5 }], { data: calculations })
+
+      setProfile(profileData)
+      setUser(profileData.user)
     } catch (error) {
       console.error('Error loading profile:', error)
       // If profile loading fails, token might be invalid
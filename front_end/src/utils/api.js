@@ -36,6 +36,16 @@ export const calculationsAPI = {
   toggleFavorite: (id) => api.post(`/api/calculations/${id}/toggle-favorite/`),
 }
 
+// First-load data: profile, state catalog, dashboard and first page of calculations
+export const bootstrapAPI = {
+  get: (params = {}) => api.get('/api/calculations/bootstrap/', { params }),
+}
+
+// Change notifications (ASGI server only); EventSource cannot set headers, so the token goes in the URL
+export const eventsAPI = {
+  connect: (token) => new EventSource(`${api.defaults.baseURL}/api/events/?token=${encodeURIComponent(token)}`),
+}
+
 // Authentication API functions
 export const authAPI = {
   login: (credentials) => api.post('/api/calculations/auth/login/', credentials),